@@ -0,0 +1,73 @@
+'''
+ConfigApplier against a simulated fleet, compared to writing every
+video encoder configuration of every device.
+
+A single fake camera listens on 0.0.0.0 and stands for every device,
+devices being addressed as 127.x.y.z. Requests take `delay` seconds,
+Set operations `set_delay` more, as a camera restarting its encoder.
+The fleet is already at the desired settings, as for most devices of a
+site on a rollout.
+
+    python benchmarks/config_apply.py [devices] [concurrency] [delay] [set_delay]
+'''
+
+import os
+import sys
+import time
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'tests'))
+
+from onvif.fleet import ONVIFFleet
+from onvif.configure import ConfigApplier
+from fake_camera import FakeCamera
+from fleet import inventory
+
+SETTINGS = {'video_encoder': {'Resolution': {'Width': 1920, 'Height': 1080},
+                              'RateControl': {'FrameRateLimit': 25,
+                                              'BitrateLimit': 4096}}}
+
+def write_all(camera):
+    '''Reads the options of every configuration and writes all of them'''
+    media = camera.get_service('media')
+    for config in media.GetVideoEncoderConfigurations():
+        media.GetVideoEncoderConfigurationOptions(
+                {'ConfigurationToken': config._token})
+        config.Resolution.Width = 1920
+        config.Resolution.Height = 1080
+        config.RateControl.FrameRateLimit = 25
+        config.RateControl.BitrateLimit = 4096
+        media.SetVideoEncoderConfiguration({'Configuration': config,
+                                            'ForcePersistence': True})
+
+def run(label, fleet, func, camera):
+    del camera.calls[:]
+    start = time.time()
+    errors = sum(1 for ret in fleet.map(func) if ret.error)
+    elapsed = time.time() - start
+    calls = Counter(camera.calls)
+    print '%-28s %7.2fs %6d requests %6d Set %5d errors' % (
+            label, elapsed, len(camera.calls),
+            calls['SetVideoEncoderConfiguration'], errors)
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    camera = FakeCamera(host='0.0.0.0').start()
+    camera.delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.005
+    camera.set_delay = float(sys.argv[4]) if len(sys.argv) > 4 else 0.2
+
+    fleet = ONVIFFleet(inventory(devices, camera.port),
+                       concurrency=concurrency, timeout=10)
+    # Discovery (GetCapabilities) of every camera, not measured
+    list(fleet.run('media', 'GetProfiles'))
+    applier = ConfigApplier(SETTINGS)
+    run('write every configuration', fleet, write_all, camera)
+    run('ConfigApplier dry run', fleet, applier.plan, camera)
+    run('ConfigApplier apply', fleet, applier.apply, camera)
+    camera.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+'''
+Reply decoding benchmark: suds unmarshalling (+ to_dict) vs. fast_decode.
+
+Decodes canned GetProfiles, GetStatus and PullMessages replies without
+any network I/O. Memory is the peak RSS growth of a forked process
+keeping `count` decoded replies, divided by `count`.
+
+    python benchmarks/decode.py [count]
+'''
+
+import os
+import sys
+import time
+import resource
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'tests'))
+
+from onvif import ONVIFService
+from onvif.decode import decode_reply
+from fake_camera import ENVELOPE, RESPONSES, MESSAGE
+
+WSDL_DIR = os.path.join(os.path.dirname(HERE), 'wsdl')
+
+GET_STATUS = '''<tptz:GetStatusResponse><tptz:PTZStatus>
+<tt:Position><tt:PanTilt x="0.5" y="-0.25" space="http://www.onvif.org/ver10/tptz/PanTiltSpaces/PositionGenericSpace"/>
+<tt:Zoom x="0.1" space="http://www.onvif.org/ver10/tptz/ZoomSpaces/PositionGenericSpace"/></tt:Position>
+<tt:MoveStatus><tt:PanTilt>IDLE</tt:PanTilt><tt:Zoom>IDLE</tt:Zoom></tt:MoveStatus>
+<tt:UtcTime>2026-01-01T00:00:00Z</tt:UtcTime>
+</tptz:PTZStatus></tptz:GetStatusResponse>'''
+
+VARIABLES = {'base': 'http://127.0.0.1', 'host': '127.0.0.1',
+             'hostname': 'fake', 'messages': MESSAGE * 20}
+
+CASES = [
+    ('media', 'GetProfiles', None, RESPONSES['GetProfiles'] % VARIABLES),
+    ('ptz', 'GetStatus', None, GET_STATUS),
+    ('events', 'PullMessages', 'PullPointSubscription',
+     RESPONSES['PullMessages'] % VARIABLES),
+]
+
+def service(name, port):
+    return ONVIFService('http://127.0.0.1/onvif/%s' % name, None, None,
+                        os.path.join(WSDL_DIR, '%s.wsdl' % name),
+                        portType=port)
+
+def suds_decode(method, soap_client, binding, body):
+    return ONVIFService.to_dict(soap_client.succeeded(binding, body))
+
+def fast_decode(method, soap_client, binding, body):
+    return decode_reply(method, body)
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(decode, method, body, count):
+    from onvif.registry import ServiceSoapClient
+    soap_client = ServiceSoapClient(method.client, method.method)
+    binding = soap_client.binding
+    args = (method.method, soap_client, binding, body)
+    decode(*args)
+
+    start = time.time()
+    for _ in range(count):
+        decode(*args)
+    elapsed = (time.time() - start) / count
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        before = maxrss()
+        kept = [ decode(*args) for _ in range(count) ]
+        os.write(write, str(maxrss() - before))
+        os._exit(0)
+    os.waitpid(pid, 0)
+    memory = float(os.read(read, 64)) * 1024 / count
+    os.close(read)
+    os.close(write)
+    return elapsed, memory
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print '%-14s %-6s %12s %14s' % ('operation', 'mode', 'ms/reply',
+                                    'bytes/reply')
+    for name, operation, portType, content in CASES:
+        method = getattr(service(name, portType).ws_client.service, operation)
+        body = ENVELOPE % content
+        for mode, decode in (('suds', suds_decode), ('fast', fast_decode)):
+            elapsed, memory = measure(decode, method, body, count)
+            print '%-14s %-6s %12.3f %14.0f' % (operation, mode,
+                                                elapsed * 1000, memory)
+
+if __name__ == '__main__':
+    main()
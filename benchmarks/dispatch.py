@@ -0,0 +1,69 @@
+'''
+Per-call Python overhead of ONVIFService operations, without the network.
+
+The transport answers every request in process with a canned reply, so
+the timings are the operation lookup, suds marshalling and unmarshalling
+only. `lookup` is the attribute access alone (`ptz.ContinuousMove`),
+`uncached` is the lookup as done before operations were cached.
+
+    python benchmarks/dispatch.py [calls]
+'''
+
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'tests'))
+
+from suds.transport import Transport, Reply
+
+from onvif import ONVIFService
+from fake_camera import ENVELOPE
+
+WSDL_DIR = os.path.join(os.path.dirname(HERE), 'wsdl')
+
+REPLY = ENVELOPE % '<tptz:ContinuousMoveResponse/>'
+
+PARAMS = {'ProfileToken': 'profile_1',
+          'Velocity': {'PanTilt': {'_x': 0.5, '_y': -0.5}}}
+
+
+class CannedTransport(Transport):
+    '''Answers every request with REPLY'''
+
+    def send(self, request):
+        return Reply(200, { }, REPLY)
+
+
+def timeit(fn, calls):
+    start = time.time()
+    for _ in xrange(calls):
+        fn()
+    return (time.time() - start) / calls * 1e6
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    ptz = ONVIFService('http://127.0.0.1/onvif/ptz', 'admin', '12345',
+                       os.path.join(WSDL_DIR, 'ptz.wsdl'),
+                       transport=CannedTransport())
+
+    def uncached():
+        return ptz.service_wrapper(getattr(ptz.ws_client.service,
+                                           'ContinuousMove'))
+
+    ptz.ContinuousMove(PARAMS)
+    print '%-32s %10.2f us' % ('lookup, uncached', timeit(uncached, calls))
+    print '%-32s %10.2f us' % ('lookup, cached',
+                               timeit(lambda: ptz.ContinuousMove, calls))
+
+    call_count = max(calls // 20, 1)
+    print '%-32s %10.2f us' % ('ContinuousMove, uncached',
+                               timeit(lambda: uncached()(PARAMS), call_count))
+    print '%-32s %10.2f us' % ('ContinuousMove, cached',
+                               timeit(lambda: ptz.ContinuousMove(PARAMS),
+                                      call_count))
+
+if __name__ == '__main__':
+    main()
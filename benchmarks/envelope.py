@@ -0,0 +1,65 @@
+'''
+Request envelope cost: built by suds against rendered from a compiled
+template (see `onvif.envelope`).
+
+Renders `count` ContinuousMove, Stop and PullMessages envelopes, with a
+DigestSecurity header, without any network I/O.
+
+    python benchmarks/envelope.py [count]
+'''
+
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from suds.client import Client
+
+from onvif import ONVIFService
+from onvif.client import envelope_compiler
+from onvif.registry import call_binding
+
+WSDL_DIR = os.path.join(os.path.dirname(HERE), 'wsdl')
+
+def service(wsdl, portType=None):
+    return ONVIFService('http://127.0.0.1/onvif/service', 'admin', '12345',
+                        os.path.join(WSDL_DIR, wsdl), portType=portType)
+
+def measure(label, func, count):
+    start = time.time()
+    for _ in xrange(count):
+        func()
+    elapsed = time.time() - start
+    print '%-36s %8.1f us/request' % (label, elapsed / count * 1e6)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    ptz = service('ptz.wsdl')
+    move = ptz.create_type('ContinuousMove')
+    move.ProfileToken = 'profile_1'
+    move.Velocity.PanTilt._x = 0.5
+    move.Velocity.PanTilt._y = -0.25
+    move.Velocity.Zoom._x = 0.0
+    pullpoint = service('events.wsdl', 'PullPointSubscription')
+    requests = [
+        (ptz, 'ContinuousMove', Client.dict(move)),
+        (ptz, 'Stop', {'ProfileToken': 'profile_1',
+                       'PanTilt': True, 'Zoom': True}),
+        (pullpoint, 'PullMessages', {'Timeout': 'PT10S',
+                                     'MessageLimit': 100}),
+    ]
+    for svc, name, params in requests:
+        func = getattr(svc.ws_client.service, name)
+        method, options = func.method, func.client.options
+        binding = call_binding(method.binding.input, options)
+        def suds_request():
+            binding.get_message(method, (), params).plain()
+        def compiled_request():
+            envelope_compiler.render(method, options, params).plain()
+        measure('%s, suds' % name, suds_request, count)
+        measure('%s, compiled' % name, compiled_request, count)
+
+if __name__ == '__main__':
+    main()
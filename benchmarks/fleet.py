@@ -0,0 +1,70 @@
+'''
+ONVIFFleet against a simulated fleet.
+
+A single fake camera listens on 0.0.0.0 and stands for every device,
+devices being addressed as 127.x.y.z (all of 127/8 is loopback on Linux).
+
+    python benchmarks/fleet.py [devices] [concurrency]
+'''
+
+import os
+import sys
+import time
+import resource
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'tests'))
+
+from onvif import ONVIFCamera
+from onvif.fleet import ONVIFFleet
+from fake_camera import FakeCamera
+
+def inventory(count, port):
+    for i in range(count):
+        subnet = i // 254
+        host = '127.%d.%d.%d' % (subnet // 256 + 1, subnet % 256, i % 254 + 1)
+        yield (host, port, 'admin', '12345')
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def run(fleet, service, operation):
+    start = time.time()
+    errors = 0
+    count = 0
+    for ret in fleet.run(service, operation):
+        count += 1
+        if ret.error:
+            errors += 1
+    elapsed = time.time() - start
+    print '%-35s %6d devices %7.2fs %8.1f calls/s %5d errors %7.1f MB' % (
+            '%s.%s' % (service, operation), count, elapsed,
+            count / elapsed, errors, maxrss())
+
+def serial_baseline(devices, port):
+    start = time.time()
+    for host, port, user, passwd in inventory(devices, port):
+        ONVIFCamera(host, port, user, passwd).devicemgmt.GetSystemDateAndTime()
+    elapsed = time.time() - start
+    print '%-35s %6d devices %7.2fs %8.1f calls/s' % (
+            'serial ONVIFCamera loop', devices, elapsed, devices / elapsed)
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    camera = FakeCamera(host='0.0.0.0').start()
+
+    serial_baseline(min(devices, 200), camera.port)
+
+    fleet = ONVIFFleet(inventory(devices, camera.port),
+                       concurrency=concurrency, timeout=10)
+    # First run pays the discovery (GetCapabilities) of every camera
+    run(fleet, 'devicemgmt', 'GetSystemDateAndTime')
+    run(fleet, 'media', 'GetProfiles')
+    run(fleet, 'media', 'GetProfiles')
+    print 'pool', fleet.pool.stats()
+    camera.stop()
+
+if __name__ == '__main__':
+    main()
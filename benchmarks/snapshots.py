@@ -0,0 +1,79 @@
+'''
+Snapshot polling, SnapshotClient against a GetSnapshotUri + urllib2 GET
+per image.
+
+A single fake camera on 0.0.0.0 stands for every device (127.x.y.z) and
+serves `size` KB images behind Digest authentication. Each run fetches
+`images` snapshots across the cameras with 16 threads. urllib2 opens a
+connection, resolves the URI and answers a 401 per image, then copies
+the body through several strings; SnapshotClient resolves the URI once,
+keeps its connection and authorization, and reads into a thread buffer.
+
+    python benchmarks/snapshots.py [cameras] [images] [size]
+'''
+
+import os
+import sys
+import time
+import urllib2
+import resource
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'tests'))
+
+from onvif import ONVIFCamera
+from fake_camera import FakeCamera
+from fleet import inventory
+
+WORKERS = 16
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def urllib2_fetch(camera):
+    media = camera.get_service('media')
+    uri = media.GetSnapshotUri({'ProfileToken': 'profile_1'}).Uri
+    passwords = urllib2.HTTPPasswordMgrWithDefaultRealm()
+    passwords.add_password(None, uri, camera.user, camera.passwd)
+    opener = urllib2.build_opener(urllib2.HTTPDigestAuthHandler(passwords))
+    return len(opener.open(uri, timeout=10).read())
+
+def client_fetch(camera):
+    return len(camera.snapshots.fetch('profile_1'))
+
+def run(label, fetch, cameras, images):
+    rss = maxrss()
+    executor = ThreadPoolExecutor(max_workers=WORKERS)
+    start = time.time()
+    total = sum(executor.map(fetch, [ cameras[i % len(cameras)]
+                                      for i in range(images) ]))
+    elapsed = time.time() - start
+    executor.shutdown()
+    print '%-16s %6d images %7.2fs %7.1f images/s %7.1f MB/s ' \
+          'peak RSS +%.1f MB' % (label, images, elapsed, images / elapsed,
+                                 total / elapsed / 1e6, maxrss() - rss)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    images = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+    camera = FakeCamera(host='0.0.0.0').start()
+    camera.snapshot = '\xff\xd8' + os.urandom(size << 10) + '\xff\xd9'
+    camera.digest = True
+    try:
+        cameras = [ ONVIFCamera(host, port, user, passwd, lazy=True)
+                    for host, port, user, passwd in
+                    inventory(count, camera.port) ]
+        # WSDL parsing and service creation out of the measures
+        for cam in cameras:
+            cam.get_service('media')
+        # Peak RSS only grows: the leaner run first
+        run('SnapshotClient', client_fetch, cameras, images)
+        run('urllib2', urllib2_fetch, cameras, images)
+    finally:
+        camera.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+'''
+Fleet restart with and without a CapabilityStore.
+
+Runs media.GetProfiles across a simulated fleet twice, with a fresh
+ONVIFFleet each time as after a process restart. Without the store both
+runs discover every device (GetCapabilities) before the operation, with
+it the second run goes straight to GetProfiles. `delay` is the reply
+latency of the fake devices, in seconds.
+
+    python benchmarks/warm_start.py [devices] [delay]
+'''
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'tests'))
+
+from onvif.fleet import ONVIFFleet
+from onvif.store import CapabilityStore
+from fake_camera import FakeCamera
+from fleet import inventory
+
+def restart(label, devices, port, **kwargs):
+    fleet = ONVIFFleet(inventory(devices, port), concurrency=64, timeout=10,
+                       **kwargs)
+    start = time.time()
+    errors = sum([ 1 for ret in fleet.run('media', 'GetProfiles')
+                   if ret.error ])
+    print '%-28s %6d devices %7.2fs %5d errors' % (label, devices,
+                                                   time.time() - start, errors)
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    camera = FakeCamera(host='0.0.0.0', delay=delay).start()
+    tmp = tempfile.mkdtemp()
+    try:
+        restart('no store', devices, camera.port)
+        restart('no store, restarted', devices, camera.port)
+        store = CapabilityStore(os.path.join(tmp, 'capabilities.db'))
+        restart('empty store', devices, camera.port, store=store)
+        # Revalidation would only add background load to the measure
+        restart('store, restarted', devices, camera.port, store=store,
+                revalidate=False)
+        store.close()
+    finally:
+        shutil.rmtree(tmp)
+        camera.stop()
+
+if __name__ == '__main__':
+    main()
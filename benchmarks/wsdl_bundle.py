@@ -0,0 +1,64 @@
+'''
+Cold start benchmark: precompiled WSDL bundle vs. suds parsing.
+
+Every run is a fresh interpreter, timing `import onvif` plus the creation
+of the devicemgmt and media services and a first `create_type` call.
+
+    python benchmarks/wsdl_bundle.py [runs]
+'''
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+WSDL_DIR = os.path.join(ROOT, 'wsdl')
+
+SCRIPT = '''
+import time
+start = time.time()
+from onvif import ONVIFService
+from onvif.registry import wsdl_registry
+mode, bundle, cache = %r, %r, %r
+if mode == 'bundle':
+    wsdl_registry.load_bundle(bundle, %r)
+for name in ('devicemgmt', 'media'):
+    service = ONVIFService('http://127.0.0.1/onvif/%%s' %% name, 'admin',
+                           '12345', %r + '/%%s.wsdl' %% name,
+                           cache_location=cache, no_cache=(mode == 'parse'))
+service.create_type('GetStreamUri')
+print time.time() - start
+'''
+
+def run(mode, bundle, cache):
+    code = SCRIPT % (mode, bundle, cache, WSDL_DIR, WSDL_DIR)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.check_output([sys.executable, '-c', code], env=env)
+    return float(out.strip().splitlines()[-1])
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    tmp = tempfile.mkdtemp()
+    try:
+        bundle = os.path.join(tmp, 'onvif.bundle')
+        cache = os.path.join(tmp, 'suds')
+
+        subprocess.check_call([sys.executable, '-m', 'onvif.compile_wsdl',
+                               '-w', WSDL_DIR, '-o', bundle,
+                               'devicemgmt.wsdl', 'media.wsdl'],
+                              env=dict(os.environ, PYTHONPATH=ROOT))
+        # Warm up suds' ObjectCache
+        run('cache', bundle, cache)
+
+        for mode in ('parse', 'cache', 'bundle'):
+            times = sorted([ run(mode, bundle, cache) for _ in range(runs) ])
+            print '%-7s min %.3fs  median %.3fs' % (mode, times[0],
+                                                     times[len(times) // 2])
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''
+WS-Security header cost per request: suds Security with a
+UsernameDigestTokenDtDiff against DigestSecurity.
+
+Builds and serializes `count` headers, then `count` whole GetHostname
+requests of a devicemgmt service using each header, without any
+network I/O.
+
+    python benchmarks/wsse.py [count]
+'''
+
+import os
+import sys
+import time
+import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from suds.wsse import Security
+
+from onvif import ONVIFService
+from onvif.client import UsernameDigestTokenDtDiff
+from onvif.registry import call_binding
+from onvif.wsse import DigestSecurity
+
+WSDL = os.path.join(os.path.dirname(HERE), 'wsdl', 'devicemgmt.wsdl')
+DT_DIFF = datetime.timedelta(seconds=-42)
+
+def suds_security():
+    security = Security()
+    security.tokens.append(UsernameDigestTokenDtDiff('admin', '12345',
+                                                     dt_diff=DT_DIFF))
+    return security
+
+def measure(label, func, count):
+    start = time.time()
+    for _ in xrange(count):
+        func()
+    elapsed = time.time() - start
+    print '%-36s %8.1f us/request' % (label, elapsed / count * 1e6)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    old, new = suds_security(), DigestSecurity('admin', '12345', DT_DIFF)
+    measure('header, suds token', lambda: old.xml().plain(), count)
+    measure('header, DigestSecurity.xml', lambda: new.xml().plain(), count)
+    measure('header, DigestSecurity.render', new.render, count)
+
+    service = ONVIFService('http://127.0.0.1/onvif/device_service',
+                           'admin', '12345', WSDL)
+    method = service.ws_client.service.GetHostname
+    for label, security in (('request, suds token', old),
+                            ('request, DigestSecurity', new)):
+        service.ws_client.set_options(wsse=security)
+        binding = call_binding(method.method.binding.input,
+                               service.ws_client.options)
+        def request():
+            binding.get_message(method.method, (), { }).plain()
+        measure(label, request, count)
+
+if __name__ == '__main__':
+    main()
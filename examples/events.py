@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from onvif import ONVIFCamera
+from onvif import ONVIFCamera, EventStream
 __author__ = 'vahid'
 
 
@@ -12,3 +12,7 @@ if __name__ == '__main__':
     req = pullpoint.create_type('PullMessages')
     req.MessageLimit=100
     print(pullpoint.PullMessages(req))
+
+    # Or stream them, the subscription is renewed as needed
+    for message in EventStream(mycam):
+        print(message.Topic.value)
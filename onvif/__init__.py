@@ -1,9 +1,13 @@
 from onvif.client import ONVIFService, ONVIFCamera, SERVICES
+from onvif.asyncclient import AsyncONVIFService, AsyncONVIFCamera
+from onvif.fleet import ONVIFFleet
+from onvif.events import EventStream
 from onvif.exceptions import ONVIFError, ERR_ONVIF_UNKNOWN, \
         ERR_ONVIF_PROTOCOL, ERR_ONVIF_WSDL, ERR_ONVIF_BUILD
 from onvif import cli
 
 __all__ = ( 'ONVIFService', 'ONVIFCamera', 'ONVIFError',
+            'AsyncONVIFService', 'AsyncONVIFCamera', 'ONVIFFleet', 'EventStream',
             'ERR_ONVIF_UNKNOWN', 'ERR_ONVIF_PROTOCOL',
             'ERR_ONVIF_WSDL', 'ERR_ONVIF_BUILD',
             'SERVICES', 'cli'
@@ -0,0 +1,829 @@
+''' Event loop driven ONVIF client, thousands of calls without threads '''
+
+import sys
+import socket
+import errno
+import asyncore
+import select
+import time
+import urlparse
+from collections import deque
+from cStringIO import StringIO
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+logger = logging.getLogger('onvif')
+
+import suds.sudsobject
+from suds.client import Client
+from suds.transport import TransportError
+
+from onvif.exceptions import ONVIFError
+from onvif.client import ONVIFService, ONVIFCamera, SERVICES, \
+                         envelope_compiler, ReplyRecorder, clock_offset, \
+                         parse_xaddrs
+from onvif.registry import ServiceSoapClient
+from onvif.decode import decode_reply
+
+
+class AsyncResult(object):
+    '''
+    The pending result of an asynchronous operation.
+
+    `result()` drives the loop until the operation completes, so it
+    must not be called from a callback running inside the loop; chain
+    operations with `add_done_callback` or `then` instead.
+    '''
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = [ ]
+
+    def done(self):
+        return self._done
+
+    def result(self, timeout=None):
+        if not self._done:
+            self.loop.run_until_complete(self, timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done:
+            self.loop.run_until_complete(self, timeout)
+        return self._exception
+
+    def add_done_callback(self, fn):
+        if self._done:
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        if not isinstance(exception, ONVIFError):
+            exception = ONVIFError(exception)
+        self._exception = exception
+        self._finish()
+
+    def _finish(self):
+        if self._done:
+            return
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, [ ]
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                logger.exception('Exception in AsyncResult callback')
+
+    def then(self, fn):
+        '''
+        Returns a new AsyncResult resolved with `fn(result)`,
+        `fn` may itself return an AsyncResult.
+        '''
+        chained = AsyncResult(self.loop)
+
+        def done(pending):
+            if pending._exception is not None:
+                return chained.set_exception(pending._exception)
+            try:
+                ret = fn(pending._result)
+            except Exception as err:
+                return chained.set_exception(err)
+            if isinstance(ret, AsyncResult):
+                ret.add_done_callback(
+                    lambda r: chained.set_exception(r._exception)
+                              if r._exception is not None
+                              else chained.set_result(r._result))
+            else:
+                chained.set_result(ret)
+
+        self.add_done_callback(done)
+        return chained
+
+    def catch(self, fn):
+        '''
+        Returns a new AsyncResult resolved with the result, or on failure
+        with `fn(exception)`, `fn` may itself return an AsyncResult.
+        '''
+        chained = AsyncResult(self.loop)
+
+        def done(pending):
+            if pending._exception is None:
+                return chained.set_result(pending._result)
+            try:
+                ret = fn(pending._exception)
+            except Exception as err:
+                return chained.set_exception(err)
+            if isinstance(ret, AsyncResult):
+                ret.add_done_callback(
+                    lambda r: chained.set_exception(r._exception)
+                              if r._exception is not None
+                              else chained.set_result(r._result))
+            else:
+                chained.set_result(ret)
+
+        self.add_done_callback(done)
+        return chained
+
+
+class HTTPResponse(object):
+    '''
+    Incremental parser of an HTTP/1.x response. Every byte is looked at
+    once: the body is kept as the list of its parts, only the partial
+    head or chunk header line is carried over to the next `feed`.
+    '''
+
+    def __init__(self):
+        # Unparsed bytes: the head, or a partial chunk header line
+        self.buffer = ''
+        self.version = None
+        self.status = None
+        self.reason = None
+        self.headers = { }
+        self.body = None
+        self.length = None
+        self.chunked = False
+        self.complete = False
+        self.parts = [ ]
+        self.received = 0
+        # Chunked body: 'size', 'data', 'crlf' after the data, 'trailer'
+        self.state = 'size'
+        # Bytes left in the current chunk
+        self.remaining = 0
+
+    def feed(self, data):
+        if self.status is None:
+            start = max(0, len(self.buffer) - 3)
+            self.buffer += data
+            end = self.buffer.find('\r\n\r\n', start)
+            if end < 0:
+                return
+            head, data = self.buffer[:end], self.buffer[end + 4:]
+            self.buffer = ''
+            lines = head.split('\r\n')
+            self.version, status, self.reason = \
+                    (lines[0].split(' ', 2) + [''])[:3]
+            self.status = int(status)
+            for line in lines[1:]:
+                key, _, value = line.partition(':')
+                self.headers[key.strip().lower()] = value.strip()
+            self.chunked = 'chunked' in self.headers.get('transfer-encoding', '')
+            if 'content-length' in self.headers:
+                self.length = int(self.headers['content-length'])
+            elif self.status in (204, 304) or 100 <= self.status < 200:
+                self.length = 0
+        if self.chunked:
+            self.feed_chunked(data)
+        elif data or self.length == 0:
+            self.parts.append(data)
+            self.received += len(data)
+            if self.length is not None and self.received >= self.length:
+                self.body = ''.join(self.parts)[:self.length]
+                self.complete = True
+
+    def feed_chunked(self, data):
+        if self.buffer:
+            data, self.buffer = self.buffer + data, ''
+        pos = 0
+        while not self.complete:
+            if self.state == 'data':
+                size = min(self.remaining, len(data) - pos)
+                if size == 0:
+                    return
+                self.parts.append(data[pos:pos + size])
+                self.received += size
+                self.remaining -= size
+                pos += size
+                if not self.remaining:
+                    self.state = 'crlf'
+                continue
+            end = data.find('\r\n', pos)
+            if end < 0:
+                self.buffer = data[pos:]
+                return
+            line, pos = data[pos:end], end + 2
+            if self.state == 'size':
+                self.remaining = int(line.split(';')[0], 16)
+                self.state = 'data' if self.remaining else 'trailer'
+            elif self.state == 'crlf':
+                self.state = 'size'
+            elif not line:
+                # Empty line ending the trailer
+                self.body = ''.join(self.parts)
+                self.complete = True
+
+    def eof(self):
+        '''The peer closed the connection'''
+        if not self.complete and self.status is not None \
+           and self.length is None and not self.chunked:
+            self.body = ''.join(self.parts)
+            self.complete = True
+        return self.complete
+
+    def keep_alive(self):
+        '''Whether the connection can carry another request'''
+        return self.complete and self.version == 'HTTP/1.1' and \
+               (self.chunked or self.length is not None) and \
+               self.headers.get('connection', '').lower() != 'close'
+
+
+def ip_address(host):
+    '''Whether `host` is an IPv4 or IPv6 address, needing no resolution'''
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return True
+        except (socket.error, ValueError):
+            pass
+    return False
+
+
+class HTTPConnection(asyncore.dispatcher):
+    '''
+    Persistent connection of an AsyncLoop to host:port, carrying one
+    HTTPRequest at a time
+    '''
+
+    def __init__(self, loop, key):
+        asyncore.dispatcher.__init__(self, map=loop.map)
+        self.loop = loop
+        self.key = key
+        # HTTPRequest being sent or answered, None while idle
+        self.request = None
+        self.outbuf = ''
+        self.last_used = time.time()
+
+    def open(self, family, address):
+        self.create_socket(family, socket.SOCK_STREAM)
+        self.connect(address)
+
+    def writable(self):
+        return not self.connected or bool(self.outbuf)
+
+    def handle_connect(self):
+        # Small request/response exchanges, don't wait for delayed ACKs
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle_write(self):
+        sent = self.send(self.outbuf)
+        self.outbuf = self.outbuf[sent:]
+        if self.request is not None:
+            self.request.sent += sent
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if not data:
+            return
+        request = self.request
+        if request is None:
+            # Nothing was asked, the connection is out of sync
+            self.drop()
+            return
+        request.response.feed(data)
+        if request.response.complete:
+            request.finish()
+
+    def handle_close(self):
+        request = self.request
+        self.drop()
+        if request is None:
+            return
+        if request.response.eof():
+            request.finish()
+        else:
+            request.failed(socket.error(errno.ECONNRESET,
+                                        'Connection closed before a response'))
+
+    def handle_error(self):
+        request = self.request
+        self.drop()
+        if request is not None:
+            request.failed(sys.exc_info()[1])
+
+    def drop(self):
+        '''Closes the connection, forgotten by the loop if idle'''
+        self.request = None
+        self.loop.forget(self)
+        self.close()
+
+
+class HTTPRequest(object):
+    '''
+    A single non-blocking HTTP POST, driven by an AsyncLoop over one of
+    its keep-alive connections
+    '''
+
+    def __init__(self, loop, url, body, headers, timeout, callback):
+        self.loop = loop
+        self.callback = callback
+        self.response = HTTPResponse()
+        self.deadline = time.time() + timeout
+        self.finished = False
+        self.connection = None
+        self.reused = False
+        # Bytes of the request handed to the socket
+        self.sent = 0
+
+        url = urlparse.urlsplit(url)
+        if url.scheme != 'http':
+            raise ONVIFError('Unsupported scheme for asynchronous calls: %s'
+                             % url.scheme)
+        host, port = url.hostname, url.port or 80
+        self.key = (host, port)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+
+        lines = ['POST %s HTTP/1.1' % path,
+                 'Host: %s:%d' % (host, port),
+                 'Content-Length: %d' % len(body)]
+        for key, value in headers.items():
+            lines.append('%s: %s' % (key, value))
+        self.outbuf = '\r\n'.join(lines) + '\r\n\r\n' + body
+
+        loop.requests.add(self)
+        connection = loop.idle_connection(self.key)
+        if connection is not None:
+            self.start(connection, True)
+        else:
+            self.connect()
+
+    def connect(self):
+        self.loop.resolve(self.key[0], self.key[1], self.resolved)
+
+    def resolved(self, address, error):
+        if self.finished:
+            return
+        if error is not None:
+            return self.finish(error)
+        connection = HTTPConnection(self.loop, self.key)
+        try:
+            connection.open(*address)
+        except Exception as err:
+            connection.close()
+            return self.finish(err)
+        self.loop.created += 1
+        self.start(connection, False)
+
+    def start(self, connection, reused):
+        self.connection = connection
+        self.reused = reused
+        connection.request = self
+        connection.outbuf = self.outbuf
+
+    def failed(self, error):
+        '''The connection failed, retried on a new one if harmless'''
+        self.connection = None
+        if self.finished:
+            return
+        if self.reused and not self.sent and not self.response.buffer \
+           and self.response.status is None:
+            # An idle connection dropped before the request went out
+            self.response = HTTPResponse()
+            self.connect()
+            return
+        self.finish(error)
+
+    def handle_timeout(self):
+        self.finish(socket.timeout('timed out'))
+
+    def finish(self, error=None):
+        if self.finished:
+            return
+        self.finished = True
+        self.loop.requests.discard(self)
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            connection.request = None
+            if error is None and self.response.keep_alive():
+                self.loop.release(connection)
+            else:
+                connection.drop()
+        self.callback(self.response, error)
+
+
+class AsyncLoop(object):
+    '''
+    Event loop multiplexing the sockets of many asynchronous calls
+    in the calling thread. A loop must only be driven by one thread.
+
+    Connections are kept alive between calls, at most `maxsize` idle
+    ones per host:port, for `idle_timeout` seconds. Host names are
+    resolved by a few threads, and kept `dns_ttl` seconds, so that a
+    slow DNS server doesn't stall the calls to the other cameras.
+    '''
+
+    def __init__(self, maxsize=4, idle_timeout=30, dns_ttl=300):
+        self.map = { }
+        self.requests = set()
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.dns_ttl = dns_ttl
+        # (host, port) => idle HTTPConnections, most recently used last
+        self.idle = { }
+        # (host, port) => ((family, address), expiry)
+        self.addresses = { }
+        self.resolver = None
+        # (callback, address, error) of the resolutions done, appended
+        # by the resolver threads
+        self.resolved = deque()
+        self.created = 0
+        self.reused = 0
+
+    def poll(self, timeout=0.1):
+        if self.map:
+            asyncore.poll2(timeout, self.map)
+        else:
+            time.sleep(timeout)
+        while self.resolved:
+            callback, address, error = self.resolved.popleft()
+            callback(address, error)
+        now = time.time()
+        for request in [ r for r in self.requests if r.deadline < now ]:
+            request.handle_timeout()
+
+    def resolve(self, host, port, callback):
+        '''Calls `callback((family, address), error)` from the loop'''
+        if ip_address(host):
+            family = socket.AF_INET6 if ':' in host else socket.AF_INET
+            return callback((family, (host, port)), None)
+        entry = self.addresses.get((host, port))
+        if entry is not None and entry[1] > time.time():
+            return callback(entry[0], None)
+        if self.resolver is None:
+            self.resolver = ThreadPoolExecutor(max_workers=4)
+
+        def resolve():
+            try:
+                family, _, _, _, address = socket.getaddrinfo(
+                        host, port, 0, socket.SOCK_STREAM)[0]
+                self.addresses[(host, port)] = ((family, address),
+                                                time.time() + self.dns_ttl)
+                self.resolved.append((callback, (family, address), None))
+            except Exception as err:
+                self.resolved.append((callback, None, err))
+        self.resolver.submit(resolve)
+
+    def idle_connection(self, key):
+        '''An idle connection to `key` still open, None if none'''
+        idle = self.idle.get(key)
+        now = time.time()
+        while idle:
+            connection = idle.pop()
+            if now - connection.last_used < self.idle_timeout:
+                try:
+                    # Readable while idle: closed by the peer
+                    dropped = select.select([ connection.socket ], [ ], [ ],
+                                            0)[0]
+                except (select.error, socket.error):
+                    dropped = True
+                if not dropped:
+                    self.reused += 1
+                    return connection
+            connection.close()
+        return None
+
+    def release(self, connection):
+        '''Keeps a connection whose response has been fully read'''
+        idle = self.idle.setdefault(connection.key, [ ])
+        if len(idle) >= self.maxsize:
+            connection.close()
+            return
+        connection.last_used = time.time()
+        idle.append(connection)
+
+    def forget(self, connection):
+        idle = self.idle.get(connection.key)
+        if idle and connection in idle:
+            idle.remove(connection)
+
+    def stats(self):
+        return {'created': self.created, 'reused': self.reused,
+                'idle': sum(len(idle) for idle in self.idle.values())}
+
+    def close(self):
+        '''Closes the idle connections and the resolver threads'''
+        for idle in self.idle.values():
+            for connection in idle:
+                connection.close()
+        self.idle.clear()
+        if self.resolver is not None:
+            self.resolver.shutdown(wait=False)
+            self.resolver = None
+
+    def run(self):
+        '''Runs until all pending calls have completed'''
+        while self.requests:
+            self.poll()
+
+    def run_until_complete(self, result, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while not result.done():
+            if deadline is not None and time.time() > deadline:
+                raise ONVIFError(socket.timeout('timed out'))
+            if not self.requests:
+                raise ONVIFError('Nothing left to wait for')
+            self.poll()
+
+    def gather(self, results):
+        '''Returns an AsyncResult of the list of results of `results`'''
+        results = list(results)
+        gathered = AsyncResult(self)
+        remaining = [len(results)]
+
+        def done(pending):
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                gathered.set_result([ r._exception or r._result
+                                      for r in results ])
+
+        if not results:
+            gathered.set_result([ ])
+        for result in results:
+            result.add_done_callback(done)
+        return gathered
+
+# Default loop of AsyncONVIFService and AsyncONVIFCamera
+default_loop = AsyncLoop()
+
+
+class AsyncONVIFService(ONVIFService):
+    '''
+    ONVIFService whose operations return an AsyncResult instead of
+    blocking, the HTTP exchange is driven by an AsyncLoop.
+
+    >>> from onvif import AsyncONVIFService
+    >>> device_service = AsyncONVIFService('http://192.168.0.112/onvif/device_service',
+    ...                           'admin', 'foscam',
+    ...                           '/etc/onvif/wsdl/devicemgmt.wsdl')
+    >>> pending = device_service.GetHostname()
+    >>> print pending.result().Name
+    '''
+
+    loop = default_loop
+
+    def service_wrapper(self, func):
+        def wrapped(params=None, callback=None):
+            if params is None:
+                params = {}
+            elif isinstance(params, suds.sudsobject.Object):
+                params = Client.dict(params)
+            if self.response_cache is not None:
+                result = self.cached_call_async(func, params, callback)
+            else:
+                result = self.call_async(func.client, func.method, params,
+                                         callback)
+            result.add_done_callback(self.call_failed)
+            return result
+        return wrapped
+
+    def cached_call_async(self, func, params, callback=None):
+        '''
+        AsyncResult of `func`, from `response_cache` if cacheable. An
+        identical request already in flight on the loop is waited for
+        rather than sent again.
+        '''
+        cache = self.response_cache
+        name = func.method.name
+        if cache.mutating(name):
+            result = self.call_async(func.client, func.method, params,
+                                     callback)
+            result.add_done_callback(
+                    lambda ret: cache.invalidate(self.xaddr))
+            return result
+        ttl = cache.operation_ttl(name)
+        if not ttl:
+            return self.call_async(func.client, func.method, params,
+                                   callback)
+
+        key = cache.make_key(self.xaddr, name, params, self.user,
+                             self.passwd)
+        entry, flight, leader = cache.begin(key, cache.async_flights)
+        if leader:
+            result = flight.pending = self.call_async(
+                    func.client, func.method, params, callback)
+            result.add_done_callback(lambda ret: cache.finish(
+                    key, ttl, flight, getattr(ret, 'reply', None),
+                    ret._exception, cache.async_flights))
+            return result
+        if entry is None and flight.pending.loop is not self.loop:
+            # Waited for on another loop, sent on this one
+            return self.call_async(func.client, func.method, params,
+                                   callback)
+
+        result = AsyncResult(self.loop)
+
+        def answer(body):
+            try:
+                result.set_result(self.decode_body(func, body))
+            except Exception as err:
+                result.set_exception(err)
+
+        if entry is not None:
+            answer(entry.body)
+        else:
+            # Every caller gets its own decoded reply
+            flight.pending.add_done_callback(
+                    lambda ret: result.set_exception(ret._exception)
+                                if ret._exception is not None
+                                else answer(getattr(ret, 'reply', None)))
+        if callable(callback):
+            result.add_done_callback(lambda r: r._exception is None
+                                               and callback(r._result))
+        return result
+
+    def call_failed(self, result):
+        # As the synchronous services, failures go through `error_handler`
+        if result._exception is not None and self.error_handler is not None:
+            self.error_handler(self, result._exception)
+
+    def call_async(self, client, method, params, callback=None):
+        result = AsyncResult(self.loop)
+        if self.metrics is not None:
+            soap_client = ReplyRecorder(client, method)
+            start = time.time()
+            result.add_done_callback(lambda r: self.record_call(
+                    method.name, soap_client, start, r._exception))
+        else:
+            soap_client = ServiceSoapClient(client, method)
+        binding = soap_client.binding
+
+        def replied(response, error):
+            if response is not None:
+                # Body of the reply, kept by `response_cache`
+                result.reply = response.body
+            if self.metrics is not None:
+                soap_client.received = time.time()
+                if response is not None:
+                    soap_client.reply = response.body
+            self.handle_reply(soap_client, binding, result, response, error,
+                              self.fast_decode)
+
+        try:
+            soapenv = None
+            if self.compile_requests:
+                soapenv = envelope_compiler.render(method, client.options,
+                                                   params)
+            if soapenv is None:
+                soapenv = binding.get_message(method, (), params)
+            body = soapenv.plain()
+            soap_client.request_size = len(body)
+            HTTPRequest(self.loop, soap_client.location(),
+                        body.encode('utf-8'), soap_client.headers(),
+                        client.options.timeout, replied)
+        except Exception as err:
+            result.set_exception(err)
+
+        if callable(callback):
+            result.add_done_callback(lambda r: r._exception is None
+                                               and callback(r._result))
+        return result
+
+    @staticmethod
+    def handle_reply(soap_client, binding, result, response, error,
+                     fast_decode=False):
+        try:
+            if error is not None:
+                raise error
+            if response.status in (202, 204):
+                ret = None
+            elif response.status == 200 and fast_decode:
+                ret = decode_reply(soap_client.method, response.body)
+            elif response.status == 200:
+                ret = soap_client.succeeded(binding, response.body)
+            else:
+                ret = soap_client.failed(binding, TransportError(
+                        response.reason, response.status,
+                        StringIO(response.body)))
+        except Exception as err:
+            result.set_exception(err)
+        else:
+            result.set_result(ret)
+
+
+class AsyncONVIFCamera(ONVIFCamera):
+    '''
+    ONVIFCamera creating AsyncONVIFService clients.
+
+    The construction does no network I/O, services are discovered by
+    `update_xaddrs`, which returns an AsyncResult, so that many cameras
+    can be discovered concurrently.
+
+    >>> from onvif import AsyncONVIFCamera
+    >>> from onvif.asyncclient import default_loop
+    >>> cams = [ AsyncONVIFCamera(host, 80, 'admin', '12345')
+    ...          for host in hosts ]
+    >>> default_loop.gather([ cam.update_xaddrs() for cam in cams ]).result()
+    >>> pendings = [ cam.create_media_service().GetProfiles() for cam in cams ]
+    >>> profiles = default_loop.gather(pendings).result()
+    '''
+
+    service_class = AsyncONVIFService
+
+    def __init__(self, host, port, user, passwd, *args, **kwargs):
+        self.loop = kwargs.pop('loop', default_loop)
+        kwargs['lazy'] = True
+        ONVIFCamera.__init__(self, host, port, user, passwd, *args, **kwargs)
+
+    def build_service(self, *args, **kwargs):
+        service = ONVIFCamera.build_service(self, *args, **kwargs)
+        service.loop = self.loop
+        return service
+
+    def update_xaddrs(self, subscribe=True):
+        '''
+        Discovers the xaddrs of the services, returns an AsyncResult.
+        As with ONVIFCamera, they are swapped in once gathered.
+        '''
+        devicemgmt = self.build_service('devicemgmt')
+        if self.adjust_time:
+            def adjusted(system_date_time):
+                devicemgmt.dt_diff = clock_offset(system_date_time)
+                devicemgmt.set_wsse()
+            pending = devicemgmt.GetSystemDateAndTime().then(adjusted)
+        else:
+            pending = AsyncResult(self.loop)
+            pending.set_result(None)
+
+        pending = pending.then(lambda ret: devicemgmt.GetCapabilities(
+                                                    {'Category': 'All'}))
+        pending = pending.then(lambda capabilities: self.swap_capabilities(
+                devicemgmt, devicemgmt.dt_diff, parse_xaddrs(capabilities)))
+        if self.store is not None:
+            pending = pending.then(
+                    lambda ret: devicemgmt.GetDeviceInformation().catch(
+                        lambda err: logger.warning(
+                            'GetDeviceInformation of %s:%s failed: %s',
+                            self.host, self.port, err)))
+            pending = pending.then(self.store_capabilities)
+        if subscribe:
+            pending = pending.then(lambda ret: self.create_pullpoint_subscription())
+        return pending.then(lambda ret: self.xaddrs)
+
+    def revalidate(self):
+        '''Checks the stored capabilities, returns an AsyncResult'''
+        return self.update_xaddrs(subscribe=False).then(
+                lambda ret: self.revalidated())
+
+    def start_revalidation(self):
+        '''
+        Revalidates on the loop along with the other calls to the
+        camera, returns the AsyncResult of the revalidation, of the one
+        already running if any
+        '''
+        if not self.revalidate_lock.acquire(False):
+            return self.revalidation
+        self.revalidation = self.revalidate().catch(lambda err: logger.warning(
+                'Revalidating the capabilities of %s:%s failed: %s',
+                self.host, self.port, err))
+        self.revalidation.add_done_callback(
+                lambda ret: self.revalidate_lock.release())
+        return self.revalidation
+
+    def service_failed(self, service, err):
+        # Called from the loop, which the revalidation mustn't block
+        if self.validated:
+            return
+        logger.info('%s:%s failed with stored capabilities (%s), revalidating',
+                    self.host, self.port, err)
+        self.start_revalidation()
+
+    def subscribe_pullpoint(self, params=None):
+        '''
+        Creates a pull-point subscription, returns an AsyncResult of the
+        CreatePullPointSubscription response.
+        '''
+        def done(subscription):
+            address = subscription.SubscriptionReference.Address
+            self.xaddrs[SERVICES['pullpoint']['ns']] = address
+            self.xaddrs[SERVICES['subscription']['ns']] = address
+            return subscription
+
+        with self.services_lock:
+            self.event = self.create_events_service()
+            return self.event.CreatePullPointSubscription(params).then(done)
+
+    def create_pullpoint_subscription(self):
+        '''Creates a pull-point subscription, returns an AsyncResult'''
+        return self.subscribe_pullpoint().then(
+                lambda ret: self.xaddrs[SERVICES['pullpoint']['ns']])
+
+    def get_definition(self, name):
+        if name != 'devicemgmt' and self.xaddrs is None:
+            # Not discovered yet, run the discovery to completion
+            with self.discovery_lock:
+                if self.xaddrs is None:
+                    self.update_xaddrs(subscribe=False).result()
+        if name == 'pullpoint' and \
+           SERVICES['pullpoint']['ns'] not in self.xaddrs:
+            self.create_pullpoint_subscription().result()
+        return ONVIFCamera.get_definition(self, name)
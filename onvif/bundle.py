@@ -0,0 +1,189 @@
+''' Precompiled WSDL bundle, built by `python -m onvif.compile_wsdl` '''
+
+import os
+import os.path
+import gc
+import mmap
+import struct
+import hashlib
+import cPickle as pickle
+import urlparse
+import urllib
+
+import suds
+from suds.cache import Cache, NoCache
+from suds.client import Client
+
+from onvif.definition import SERVICES
+
+import logging
+logger = logging.getLogger('onvif')
+
+# Default bundle file name, looked up in the WSDL directory
+BUNDLE_NAME = 'onvif.bundle'
+# Bump whenever the layout below changes
+BUNDLE_FORMAT = 1
+MAGIC = 'ONVIFWSDL\n'
+HEADER = struct.Struct('>I')
+
+
+def wsdl_files(wsdl_dir):
+    '''Paths of all documents in `wsdl_dir`, the bundle itself excluded'''
+    for root, dirs, files in os.walk(wsdl_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name == BUNDLE_NAME or name.endswith('.bundle'):
+                continue
+            yield os.path.join(root, name)
+
+
+def wsdl_digest(wsdl_dir):
+    '''Digest of all documents in `wsdl_dir`, the bundle itself excluded'''
+    sha = hashlib.sha1()
+    for path in wsdl_files(wsdl_dir):
+        sha.update(os.path.relpath(path, wsdl_dir))
+        with open(path, 'rb') as fp:
+            sha.update(fp.read())
+    return sha.hexdigest()
+
+
+def wsdl_stats(wsdl_dir):
+    '''{relative path: (mtime, size)} of the documents in `wsdl_dir`'''
+    stats = { }
+    for path in wsdl_files(wsdl_dir):
+        st = os.stat(path)
+        stats[os.path.relpath(path, wsdl_dir)] = (st.st_mtime, st.st_size)
+    return stats
+
+
+class PreloadedCache(Cache):
+    '''
+    suds cache serving a single, already loaded WSDL definitions object,
+    so that `suds.client.Client` skips the XML parsing entirely.
+    '''
+
+    def __init__(self, definitions):
+        self.definitions = definitions
+
+    def get(self, id):
+        if id.endswith('-wsdl'):
+            return self.definitions
+        return None
+
+    def getf(self, id):
+        return None
+
+    def put(self, id, object):
+        return object
+
+    def putf(self, id, fp):
+        pass
+
+    def purge(self, id):
+        pass
+
+    def clear(self):
+        pass
+
+
+class WSDLBundle(object):
+    '''
+    Read-only view of a precompiled WSDL bundle.
+
+    The file starts with a small header (format, suds version, digest,
+    modification times and sizes of the WSDL documents, entry offsets)
+    followed by one pickled suds `Definitions` object per WSDL document.
+    The file is memory-mapped and an entry is only unpickled when a
+    service asks for it. Unpickling copies the definitions into the
+    heap of every process, only the file pages are shared.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fp:
+            self.mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not an ONVIF WSDL bundle' % path)
+        start = len(MAGIC) + HEADER.size
+        size, = HEADER.unpack(self.mmap[len(MAGIC):start])
+        self.header = pickle.loads(self.mmap[start:start + size])
+        self.offset = start + size
+
+    @property
+    def entries(self):
+        return self.header['entries']
+
+    def is_valid(self, wsdl_dir=None):
+        '''Checks the bundle was built by this suds for these documents'''
+        if self.header.get('format') != BUNDLE_FORMAT:
+            return False
+        if self.header.get('suds') != suds.__version__:
+            return False
+        if wsdl_dir is not None:
+            # Same times and sizes, the documents are only read and
+            # hashed when they don't match, e.g. copied elsewhere
+            if self.header.get('stats') == wsdl_stats(wsdl_dir):
+                return True
+            return self.header.get('digest') == wsdl_digest(wsdl_dir)
+        return True
+
+    def load(self, name):
+        '''Returns the `Definitions` of WSDL document `name`, or None'''
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        start, size = entry
+        start += self.offset
+        # Unpickling creates hundred thousands of objects, and the garbage
+        # collector would otherwise run over and over on the growing graph
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return pickle.loads(self.mmap[start:start + size])
+        finally:
+            if enabled:
+                gc.enable()
+
+    def close(self):
+        self.mmap.close()
+
+    @staticmethod
+    def write(path, wsdl_dir, names=None):
+        '''Parses WSDL documents `names` of `wsdl_dir` into a bundle at `path`'''
+        if names is None:
+            names = sorted(set([ item['wsdl'] for item in SERVICES.values() ]))
+
+        blobs = [ ]
+        entries = { }
+        offset = 0
+        for name in names:
+            wsdlpath = os.path.abspath(os.path.join(wsdl_dir, name))
+            url = urlparse.urljoin('file:', urllib.pathname2url(wsdlpath))
+            try:
+                client = Client(url, cache=NoCache())
+            except Exception:
+                # suds can't parse it either, services will fail anyway
+                logger.exception('Skip WSDL document %s', name)
+                continue
+            blob = pickle.dumps(client.wsdl, pickle.HIGHEST_PROTOCOL)
+            entries[name] = (offset, len(blob))
+            blobs.append(blob)
+            offset += len(blob)
+
+        header = pickle.dumps({'format': BUNDLE_FORMAT,
+                               'suds': suds.__version__,
+                               'digest': wsdl_digest(wsdl_dir),
+                               'stats': wsdl_stats(wsdl_dir),
+                               'entries': entries}, pickle.HIGHEST_PROTOCOL)
+
+        # Write aside and rename, readers may have the old bundle mapped
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as fp:
+            fp.write(MAGIC)
+            fp.write(HEADER.pack(len(header)))
+            fp.write(header)
+            for blob in blobs:
+                fp.write(blob)
+        os.rename(tmp, path)
+        return entries
@@ -0,0 +1,241 @@
+''' Response cache of the idempotent operations '''
+
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from threading import Lock, Event
+
+from onvif.serialize import to_dict
+
+# Seconds the replies of the Get operations are kept by default
+DEFAULT_TTL = 30
+
+# Get operations whose reply changes on its own, not cached by default
+VOLATILE_TTLS = {'GetStatus': 0, 'GetSystemDateAndTime': 0,
+                 'GetCurrentPreset': 0, 'GetEventProperties': 0}
+
+# Operations changing the state of the device, the replies cached for
+# the service are dropped once they have gone through
+MUTATING_PREFIXES = ('Set', 'Add', 'Remove', 'Create', 'Delete', 'Modify',
+                     'SystemReboot', 'Upgrade', 'Restore')
+
+# Estimated bytes of an entry besides its reply body
+ENTRY_OVERHEAD = 256
+
+
+class CacheEntry(object):
+
+    __slots__ = ('key', 'xaddr', 'body', 'expires', 'size')
+
+    def __init__(self, key, xaddr, body, expires):
+        self.key = key
+        self.xaddr = xaddr
+        self.body = body
+        self.expires = expires
+        self.size = len(body or '') + len(key[2]) + ENTRY_OVERHEAD
+
+
+class Flight(object):
+    '''A request in flight, whose reply concurrent identical requests wait for'''
+
+    def __init__(self):
+        self.done = Event()
+        self.body = None
+        self.error = None
+        # Service invalidated while in flight, the reply isn't cached
+        self.stale = False
+        # AsyncResult of the request of an asynchronous service
+        self.pending = None
+
+    def set(self, body=None, error=None):
+        self.body = body
+        self.error = error
+        self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.body
+
+
+class ResponseCache(object):
+    '''
+    Cache of the replies of the Get operations, for ONVIFService
+    instances (synchronous, running on an executor or asynchronous)
+    sharing it.
+
+    Entries are keyed by (xaddr, operation, parameters, credentials),
+    users allowed different replies not getting each other's, and kept
+    `ttl` seconds, or `ttls[operation]`, 0 not to cache an operation. The
+    least recently used entries are evicted past `max_bytes` of reply
+    bodies. Concurrent identical requests are sent once, the others
+    wait for its reply. A Set, Add, Remove, ... operation going through
+    a service drops all the entries of the service, its configurations
+    being intertwined (e.g. SetVideoEncoderConfiguration changes the
+    GetProfiles reply).
+
+    The reply bodies are kept, every hit decodes a new reply which the
+    caller may modify.
+
+    AsyncONVIFService instances use it through `begin` and `finish`
+    without blocking, their identical requests coalesced with each
+    other rather than with those of the synchronous services.
+
+    >>> from onvif.cache import ResponseCache
+    >>> cache = ResponseCache(ttl=10, ttls={'GetStreamUri': 60})
+    >>> mycam = ONVIFCamera('192.168.0.112', 80, 'admin', '12345',
+    ...                     response_cache=cache)
+    >>> mycam.create_media_service().GetProfiles()
+    >>> cache.stats()['hits']
+    '''
+
+    def __init__(self, ttl=DEFAULT_TTL, ttls=None, max_bytes=16 << 20):
+        self.ttl = ttl
+        self.ttls = dict(VOLATILE_TTLS)
+        self.ttls.update(ttls or { })
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        # key => Flight
+        self.flights = { }
+        # key => Flight of an asynchronous service
+        self.async_flights = { }
+        # xaddr => keys of its entries
+        self.xaddr_keys = { }
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def operation_ttl(self, operation):
+        '''Seconds the reply of `operation` is kept, 0 if not cached'''
+        if not operation.startswith('Get'):
+            return 0
+        return self.ttls.get(operation, self.ttl)
+
+    @staticmethod
+    def mutating(operation):
+        return operation.startswith(MUTATING_PREFIXES)
+
+    @staticmethod
+    def make_key(xaddr, operation, params, user=None, passwd=None):
+        # Parameters normalized: suds objects as dicts, keys sorted. The
+        # credentials only kept as a digest.
+        credentials = None
+        if user is not None:
+            credentials = hashlib.sha1(
+                    u'%s:%s' % (user, passwd or '')).hexdigest()
+        return (xaddr, operation,
+                json.dumps(to_dict(params), sort_keys=True, default=unicode),
+                credentials)
+
+    def fetch(self, key, ttl, send, decode):
+        '''
+        Returns the reply to the request of `key`. `send()` sends it and
+        returns (reply body, decoded reply), its body is cached unless
+        the service was invalidated meanwhile. The bodies from the cache
+        or from a concurrent identical request are decoded by `decode`.
+        '''
+        entry, flight, leader = self.begin(key)
+        if entry is not None:
+            return decode(entry.body)
+        if not leader:
+            return decode(flight.wait())
+
+        try:
+            body, reply = send()
+        except Exception as err:
+            self.finish(key, ttl, flight, error=err)
+            raise
+        self.finish(key, ttl, flight, body)
+        return reply
+
+    def begin(self, key, flights=None):
+        '''
+        Looks the request of `key` up, returns (entry, flight, leader):
+        the cached entry, or the Flight of the request in `flights`
+        (`self.flights` by default) and whether the caller sends it
+        '''
+        if flights is None:
+            flights = self.flights
+        now = time.time()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry.expires <= now:
+                self.forget(entry)
+                entry = None
+            if entry is not None:
+                # Most recently used last
+                self.entries[key] = entry
+                self.hits += 1
+                return entry, None, False
+            if key in flights:
+                self.coalesced += 1
+                return None, flights[key], False
+            flight = flights[key] = Flight()
+            self.misses += 1
+            return None, flight, True
+
+    def finish(self, key, ttl, flight, body=None, error=None, flights=None):
+        '''Ends the `flight` begun for `key`, caching `body` on success'''
+        if flights is None:
+            flights = self.flights
+        with self.lock:
+            if error is None and not flight.stale:
+                self.store(CacheEntry(key, key[0], body, time.time() + ttl))
+            del flights[key]
+        flight.set(body, error)
+
+    def store(self, entry):
+        old = self.entries.pop(entry.key, None)
+        if old is not None:
+            self.forget(old)
+        self.entries[entry.key] = entry
+        self.xaddr_keys.setdefault(entry.xaddr, set()).add(entry.key)
+        self.size += entry.size
+        while self.size > self.max_bytes and self.entries:
+            key, evicted = self.entries.popitem(last=False)
+            self.forget(evicted)
+            self.evictions += 1
+
+    def forget(self, entry):
+        '''Accounts for an entry already removed from `entries`'''
+        self.size -= entry.size
+        keys = self.xaddr_keys.get(entry.xaddr)
+        if keys is not None:
+            keys.discard(entry.key)
+            if not keys:
+                del self.xaddr_keys[entry.xaddr]
+
+    def invalidate(self, xaddr):
+        '''Drops the entries of the service at `xaddr`'''
+        with self.lock:
+            for flights in (self.flights, self.async_flights):
+                for key, flight in flights.iteritems():
+                    if key[0] == xaddr:
+                        flight.stale = True
+            self.invalidations += 1
+            for key in list(self.xaddr_keys.get(xaddr, ())):
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    self.forget(entry)
+
+    def clear(self):
+        with self.lock:
+            for flights in (self.flights, self.async_flights):
+                for flight in flights.itervalues():
+                    flight.stale = True
+            self.entries.clear()
+            self.xaddr_keys.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size,
+                    'hits': self.hits, 'misses': self.misses,
+                    'coalesced': self.coalesced, 'evictions': self.evictions,
+                    'invalidations': self.invalidations}
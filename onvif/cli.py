@@ -2,6 +2,7 @@
 '''ONVIF Client Command Line Interface'''
 
 import re
+import logging
 from cmd import Cmd
 from ast import literal_eval
 from json import dumps
@@ -145,6 +146,7 @@ def create_parser():
 
 def main():
     INTRO = __doc__
+    logging.basicConfig(level=logging.INFO)
 
     # Create argument parser
     parser = create_parser()
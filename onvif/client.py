@@ -1,13 +1,18 @@
 __version__ = '0.0.1'
 
 import os.path
+import time
 import urlparse
 import urllib
-from threading import Thread, RLock
+from threading import RLock, Lock
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, Future, wait, \
+        FIRST_COMPLETED
 
 import logging
 logger = logging.getLogger('onvif')
-logging.basicConfig(level=logging.INFO)
+# Configuring the logging is left to the application
+logger.addHandler(logging.NullHandler())
 logging.getLogger('suds.client').setLevel(logging.CRITICAL)
 
 import suds.sudsobject
@@ -19,9 +24,36 @@ from suds.bindings import binding
 binding.envns = ('SOAP-ENV', 'http://www.w3.org/2003/05/soap-envelope')
 
 from onvif.exceptions import ONVIFError
+from onvif.registry import wsdl_registry, ServiceSoapClient
+from onvif.transport import KeepAliveTransport, ConnectionPool
+from onvif.decode import decode_reply, field
+from onvif.serialize import to_dict
+from onvif.store import device_key
+from onvif.snapshot import SnapshotClient
+from onvif.wsse import DigestSecurity
+from onvif.envelope import EnvelopeCompiler, RawDocument
+from onvif.metrics import CallSample
+from onvif.search import paged_search
 from definition import SERVICES, NSMAP
 from suds.sax.date import UTC
 import datetime as dt
+
+# Request templates, shared by all the services of the process
+envelope_compiler = EnvelopeCompiler()
+
+# Xaddrs of the subscriptions, which don't outlive them
+TRANSIENT_XADDRS = (SERVICES['pullpoint']['ns'], SERVICES['subscription']['ns'])
+
+# Playable streams of a media profile, see `resolve_stream_uris`. The
+# URIs are None when the device failed to give them.
+StreamRecord = namedtuple('StreamRecord',
+                          'token name encoding width height '
+                          'stream_uri snapshot_uri')
+
+# RTSP, RTP unicast: the stream every ONVIF device serves
+DEFAULT_STREAM_SETUP = {'Stream': 'RTP-Unicast',
+                        'Transport': {'Protocol': 'RTSP'}}
+
 # Ensure methods to raise an ONVIFError Exception
 # when some thing was wrong
 def safe_func(func):
@@ -33,6 +65,114 @@ def safe_func(func):
     return wrapped
 
 
+# Size of the pool shared by `daemon` services without an executor
+DEFAULT_MAX_WORKERS = 16
+default_executor = None
+default_executor_lock = Lock()
+
+def get_default_executor():
+    '''Returns the bounded thread pool shared by `daemon` services'''
+    global default_executor
+    with default_executor_lock:
+        if default_executor is None:
+            default_executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS)
+        return default_executor
+
+# Size of the pool revalidating the cameras warm started from a store.
+# Not the executor of a camera: a revalidation waits for calls running
+# on it.
+REVALIDATION_MAX_WORKERS = 4
+revalidation_executor = None
+
+def get_revalidation_executor():
+    '''Returns the bounded thread pool running the revalidations'''
+    global revalidation_executor
+    with default_executor_lock:
+        if revalidation_executor is None:
+            revalidation_executor = ThreadPoolExecutor(
+                    max_workers=REVALIDATION_MAX_WORKERS)
+        return revalidation_executor
+
+def resolve_future(ret):
+    '''Waits for `ret` if it is the future of an operation'''
+    if isinstance(ret, Future):
+        return ret.result()
+    return ret
+
+def clock_offset(system_date_time):
+    '''Offset of the clock of the device from a GetSystemDateAndTime response'''
+    cdate = system_date_time.UTCDateTime
+    cam_date = dt.datetime(cdate.Date.Year, cdate.Date.Month, cdate.Date.Day, cdate.Time.Hour, cdate.Time.Minute, cdate.Time.Second)
+    return cam_date - dt.datetime.utcnow()
+
+def parse_xaddrs(capabilities):
+    '''namespace => xaddr of the services from a GetCapabilities response'''
+    xaddrs = { }
+    capabilities = list(capabilities)
+    for name, capability in list(capabilities):
+        if name == 'Extension' and capability is not None:
+            # DeviceIO, Recording, Search, Replay, ... of ONVIF 2.x
+            capabilities.extend(capability)
+    for name, capability in capabilities:
+        try:
+            if name.lower() in SERVICES:
+                ns = SERVICES[name.lower()]['ns']
+                # Parsed as lists when matched by the xs:any of the
+                # extension
+                if isinstance(capability, list):
+                    capability = capability[0]
+                xaddr = capability['XAddr']
+                if isinstance(xaddr, list):
+                    xaddr = xaddr[0]
+                xaddrs[ns] = xaddr
+        except Exception:
+            logger.exception('Unexcept service type')
+    return xaddrs
+
+
+class ReplyRecorder(ServiceSoapClient):
+    '''
+    ServiceSoapClient keeping the raw reply, for the response cache, and
+    the sizes of the envelopes and the times the request was sent and
+    the reply received, for the metrics
+    '''
+
+    reply = None
+    request_size = None
+    sent = None
+    received = None
+
+    def send(self, soapenv):
+        if not self.options.plugins:
+            # Rendered here to be measured, plugins need the Document
+            if self.options.prettyxml:
+                soapenv = RawDocument(soapenv.str())
+            else:
+                soapenv = RawDocument(soapenv.plain())
+            self.request_size = len(soapenv.text)
+        ret = ServiceSoapClient.send(self, soapenv)
+        if self.received is None:
+            # retxml, the raw reply is returned
+            self.received = time.time()
+            if isinstance(ret, basestring):
+                self.reply = ret
+        return ret
+
+    def headers(self):
+        # Called once the request is rendered, just before it is sent
+        self.sent = time.time()
+        return ServiceSoapClient.headers(self)
+
+    def succeeded(self, binding, reply):
+        self.received = time.time()
+        self.reply = reply
+        return ServiceSoapClient.succeeded(self, binding, reply)
+
+    def failed(self, binding, error):
+        self.received = time.time()
+        return ServiceSoapClient.failed(self, binding, error)
+
+
 class UsernameDigestTokenDtDiff(UsernameDigestToken):
     '''
     UsernameDigestToken class, with a time offset parameter that can be adjusted;
@@ -44,6 +184,18 @@ class UsernameDigestTokenDtDiff(UsernameDigestToken):
 #        Old Style class ... sigh ...
         UsernameDigestToken.__init__(self, user, passw)
         self.dt_diff = dt_diff
+        # The nonce and creation time of a request are kept on the token
+        # until its xml is built, one request of the token at a time
+        self.xml_lock = Lock()
+
+    def __deepcopy__(self, memo):
+        # Copied with the options of the clients, locks can't be
+        return UsernameDigestTokenDtDiff(self.username, self.password,
+                                         self.dt_diff)
+
+    def xml(self):
+        with self.xml_lock:
+            return UsernameDigestToken.xml(self)
         
     def setcreated(self, *args, **kwargs):
         dt_adjusted = None
@@ -82,12 +234,48 @@ class ONVIFService(object):
         params = device_service.create_type('SetHostname')
         params.Hostname = 'NewHostName'
         device_service.SetHostname(params)
+
+    With an `executor` (or `daemon`, which uses a bounded pool shared by
+    the whole process), operations return a `concurrent.futures.Future`
+    >>> from concurrent.futures import ThreadPoolExecutor, Future
+    >>> pool = ThreadPoolExecutor(max_workers=32)
+    >>> device_service = ONVIFService(..., executor=pool)
+    >>> future = device_service.GetHostname()
+    >>> print future.result(timeout=10).Name
+
+    With `fast_decode`, replies are parsed straight into dicts and lists,
+    skipping suds objects, attributes being '_' prefixed keys as in
+    `to_dict`. Worth it for high-volume operations (PullMessages,
+    GetStatus, GetProfiles, ...)
+    >>> ptz_service = ONVIFService(..., fast_decode=True)
+    >>> print ptz_service.GetStatus({'ProfileToken': 'profile_1'})['Position']
+
+    With a `response_cache` (see `onvif.cache.ResponseCache`), replies
+    of the Get operations are reused until they expire or a Set, Add,
+    Remove, ... operation goes through the service
+    >>> media_service = ONVIFService(..., response_cache=ResponseCache())
+
+    With `compile_requests`, the request envelopes are rendered from
+    templates compiled on the first call of an operation (see
+    `onvif.envelope`) instead of being built by suds on every call.
+    Worth it for operations sent at a high rate (ContinuousMove, ...)
+    >>> ptz_service = ONVIFService(..., compile_requests=True)
+
+    With `metrics` (see `onvif.metrics.OperationMetrics`, or any object
+    with a `record` method), every operation reports a CallSample: its
+    duration split into serialize, network and parse, the sizes of the
+    envelopes and the class of the error raised. `device` and `name`
+    label the samples, default to the host of `xaddr` and the WSDL name.
+    >>> ptz_service = ONVIFService(..., metrics=OperationMetrics())
     '''
 
     @safe_func
     def __init__(self, xaddr, user, passwd, url,
                  cache_location='/tmp/suds', cache_duration=None,
-                 encrypt=True, daemon=False, ws_client=None, no_cache=False, portType=None, dt_diff = None):
+                 encrypt=True, daemon=False, ws_client=None, no_cache=False, portType=None, dt_diff = None,
+                 from_registry=True, executor=None, transport=None,
+                 fast_decode=False, response_cache=None,
+                 compile_requests=False, metrics=None):
 
         if not os.path.isfile(url):
             raise ONVIFError('%s doesn`t exist!' % url)
@@ -107,8 +295,14 @@ class ONVIFService(object):
         # Convert pathname to url
         self.url = urlparse.urljoin('file:', urllib.pathname2url(url))
         self.xaddr = xaddr
+        self.portType = portType
+        self.from_registry = from_registry and not ws_client
         # Create soap client
-        if not ws_client:
+        if self.from_registry:
+            # Share the parsed WSDL with every other service of the process
+            self.ws_client = wsdl_registry.get_client(url, portType, cache)
+            self.ws_client.set_options(location=self.xaddr)
+        elif not ws_client:
             self.ws_client = Client(url=self.url,
                                     location=self.xaddr,
                                     cache=cache,
@@ -118,6 +312,18 @@ class ONVIFService(object):
             self.ws_client = ws_client
             self.ws_client.set_options(location=self.xaddr)
 
+        # E.g. a KeepAliveTransport sharing its pool with other services
+        if transport is not None:
+            self.ws_client.set_options(transport=transport)
+
+        # Names of the operation wrappers cached in the instance, swapped
+        # for a new set by `clear_operations`
+        self.operations_lock = Lock()
+        self.operations = set()
+
+        self.set_fast_decode(fast_decode)
+        self.compile_requests = compile_requests
+
         # Set soap header for authentication
         self.user = user
         self.passwd = passwd
@@ -125,9 +331,22 @@ class ONVIFService(object):
         self.encrypt = encrypt
 
         self.daemon = daemon
+        # Pool running the operations, which then return futures
+        self.executor = executor
 
         self.dt_diff = dt_diff
 
+        # Called with (service, exception) when an operation fails
+        self.error_handler = None
+
+        # ResponseCache of the Get operations, possibly shared
+        self.response_cache = response_cache
+
+        # Recorder of the CallSamples, and their labels
+        self.metrics = metrics
+        self.device = urlparse.urlparse(xaddr).netloc
+        self.name = portType or os.path.splitext(os.path.basename(url))[0]
+
         if self.user is not None and self.passwd is not None:
             self.set_wsse()
 
@@ -142,37 +361,64 @@ class ONVIFService(object):
         if passwd:
             self.passwd = passwd
 
-        security = Security()
-
         if self.encrypt:
-            token = UsernameDigestTokenDtDiff(self.user, self.passwd, dt_diff=self.dt_diff)
+            # Rendered from precomputed strings, see `onvif.wsse`
+            security = DigestSecurity(self.user, self.passwd,
+                                      dt_diff=self.dt_diff)
         else:
+            security = Security()
             token = UsernameToken(self.user, self.passwd)
             token.setnonce()
             token.setcreated()
+            security.tokens.append(token)
 
-        security.tokens.append(token)
         self.ws_client.set_options(wsse=security)
+        self.clear_operations()
+
+    def set_xaddr(self, xaddr):
+        '''Sends the requests of the service to `xaddr`'''
+        self.xaddr = xaddr
+        self.ws_client.set_options(location=xaddr)
+        self.clear_operations()
+
+    def set_fast_decode(self, enabled=True):
+        '''Decodes the replies into dicts and lists instead of suds objects'''
+        self.fast_decode = enabled
+        # suds then hands over the raw reply
+        self.ws_client.set_options(retxml=enabled)
+        self.clear_operations()
+
+    def set_compile_requests(self, enabled=True):
+        '''Renders the requests from compiled templates'''
+        self.compile_requests = enabled
+
+    def clear_operations(self):
+        '''Drops the cached operation wrappers, rebuilt on next access'''
+        operations = set()
+        with self.operations_lock:
+            operations, self.operations = self.operations, operations
+            for name in operations:
+                self.__dict__.pop(name, None)
 
     @classmethod
     @safe_func
     def clone(cls, service, *args, **kwargs):
+        if service.from_registry:
+            # The parsed WSDL lives in the registry, no need to keep
+            # a reference to `service`
+            return cls(*args, **kwargs)
         clone_service = service.ws_client.clone()
         kwargs['ws_client'] = clone_service
         return ONVIFService(*args, **kwargs)
 
     @staticmethod
     @safe_func
-    def to_dict(sudsobject):
-        # Convert a WSDL Type instance into a dictionary
+    def to_dict(sudsobject, attr_prefix='_', text=None):
+        # Convert a WSDL Type instance into a dictionary, nested
+        # instances included, see `onvif.serialize.to_dict`
         if sudsobject is None:
             return { }
-        elif isinstance(sudsobject, list):
-            ret = [ ]
-            for item in sudsobject:
-                ret.append(Client.dict(item))
-            return ret
-        return Client.dict(sudsobject)
+        return to_dict(sudsobject, attr_prefix, text)
 
     def service_wrapper(self, func):
         @safe_func
@@ -183,21 +429,123 @@ class ONVIFService(object):
                 if params is None:
                     params = {}
                 elif isinstance(params, suds.sudsobject.Object):
-                    params = ONVIFService.to_dict(params)
-                ret = func(**params)
+                    # Nested instances keep their type for suds
+                    params = Client.dict(params)
+                recorder = None
+                if self.metrics is not None:
+                    recorder = ReplyRecorder(func.client, func.method)
+                    start = time.time()
+                try:
+                    if self.response_cache is not None:
+                        ret = self.cached_call(func, params, recorder)
+                    else:
+                        ret = self.send_request(func, params, recorder)
+                except Exception as err:
+                    if recorder is not None:
+                        self.record_call(func.method.name, recorder, start,
+                                         err)
+                    if self.error_handler is not None:
+                        self.error_handler(self, err)
+                    raise
+                if self.fast_decode and ret is not None and \
+                   self.response_cache is None:
+                    try:
+                        ret = decode_reply(func.method, ret)
+                    except Exception as err:
+                        if recorder is not None:
+                            self.record_call(func.method.name, recorder,
+                                             start, err)
+                        raise
+                if recorder is not None:
+                    self.record_call(func.method.name, recorder, start)
                 if callable(callback):
                     callback(ret)
                 return ret
 
-            if self.daemon:
-                th = Thread(target=call, args=(params, callback))
-                th.daemon = True
-                th.start()
+            if self.executor is not None or self.daemon:
+                executor = self.executor or get_default_executor()
+                return executor.submit(safe_func(call), params, callback)
             else:
                 return call(params, callback)
         return wrapped
 
 
+    def cached_call(self, func, params, recorder=None):
+        '''
+        Decoded reply of `func`, from `response_cache` if cacheable. The
+        request, if sent, goes through `recorder` (a ReplyRecorder).
+        '''
+        cache = self.response_cache
+        name = func.method.name
+        if cache.mutating(name):
+            try:
+                ret = self.send_request(func, params, recorder)
+            finally:
+                cache.invalidate(self.xaddr)
+        elif cache.operation_ttl(name):
+            def send():
+                if self.fast_decode:
+                    body = self.send_request(func, params, recorder)
+                    return body, self.decode_body(func, body)
+                soap_client = recorder or ReplyRecorder(func.client,
+                                                        func.method)
+                reply = self.send_request(func, params, soap_client)
+                return soap_client.reply, reply
+
+            key = cache.make_key(self.xaddr, name, params,
+                                 self.user, self.passwd)
+            return cache.fetch(key, cache.operation_ttl(name), send,
+                               lambda body: self.decode_body(func, body))
+        else:
+            ret = self.send_request(func, params, recorder)
+        if self.fast_decode and ret is not None:
+            ret = decode_reply(func.method, ret)
+        return ret
+
+    def decode_body(self, func, body):
+        '''Reply of `func` decoded from the cached `body`'''
+        if body is None:
+            return None
+        if self.fast_decode:
+            return decode_reply(func.method, body)
+        soap_client = ServiceSoapClient(func.client, func.method)
+        return soap_client.succeeded(None, body)
+
+    def send_request(self, func, params, soap_client=None):
+        '''
+        Reply of `func` called with `params`, through `soap_client`
+        (a new ServiceSoapClient by default) and, with
+        `compile_requests`, an envelope rendered from a template
+        '''
+        options = func.client.options
+        if soap_client is None:
+            soap_client = ServiceSoapClient(func.client, func.method)
+        if self.compile_requests and options.faults:
+            document = envelope_compiler.render(func.method, options, params)
+            if document is not None:
+                return soap_client.send(document)
+        return soap_client.invoke((), params)
+
+    def record_call(self, operation, recorder, start, error=None):
+        '''Reports the CallSample of a call to `metrics`'''
+        end = time.time()
+        serialize = network = parse = None
+        if recorder.sent is not None:
+            received = recorder.received or end
+            serialize = recorder.sent - start
+            network = received - recorder.sent
+            parse = end - received
+        reply_size = len(recorder.reply) if recorder.reply is not None \
+                     else None
+        sample = CallSample(self.device, self.name, operation, end - start,
+                            serialize, network, parse, recorder.request_size,
+                            reply_size,
+                            None if error is None else type(error).__name__)
+        try:
+            self.metrics.record(sample)
+        except Exception:
+            logger.exception('Failed to record the metrics of %s', operation)
+
     def __getattr__(self, name):
         '''
         Call the real onvif Service operations,
@@ -209,7 +557,16 @@ class ONVIFService(object):
         if builtin:
             return self.__dict__[name]
         else:
-            return self.service_wrapper(getattr(self.ws_client.service, name))
+            operations = self.operations
+            operation = self.service_wrapper(getattr(self.ws_client.service, name))
+            # Later lookups are plain attribute hits, until
+            # `clear_operations`. Not kept if cleared meanwhile: it may
+            # use the former binding.
+            with self.operations_lock:
+                if self.operations is operations:
+                    self.__dict__[name] = operation
+                    operations.add(name)
+            return operation
 
 class ONVIFCamera(object):
     '''
@@ -221,6 +578,34 @@ class ONVIFCamera(object):
     this should only be used in "safe" environements.
     Also, this cannot be used on AXIS camera, as every request is authenticated, contrary to ONVIF standard		
 
+    lazy parameter makes the construction free of any network I/O:
+    capabilities are fetched the first time a service other than
+    devicemgmt is created, and the pull-point subscription only when
+    create_pullpoint_service is called.
+
+    executor parameter is a `concurrent.futures.Executor` shared by the
+    services of the camera, which then return futures. A single pool
+    can be shared by many cameras.
+
+    pool parameter is the `onvif.transport.ConnectionPool` of persistent
+    HTTP connections used by all the services of the camera, default
+    to a pool of its own.
+
+    store parameter is an `onvif.store.CapabilityStore` keeping the
+    xaddrs and clock offset of the device across restarts. A camera
+    found in the store starts without any network I/O, then checks the
+    stored capabilities against the device, in a background thread if
+    revalidate is True, else on the first failed operation.
+
+    response_cache parameter is an `onvif.cache.ResponseCache` of the
+    replies of the Get operations, possibly shared by many cameras.
+
+    metrics parameter is the recorder of the CallSamples of the services,
+    e.g. an `onvif.metrics.OperationMetrics` shared by many cameras.
+
+    snapshots attribute is the `onvif.snapshot.SnapshotClient` fetching
+    the JPEG snapshots of the media profiles.
+
     >>> from onvif import ONVIFCamera
     >>> mycam = ONVIFCamera('192.168.0.112', 80, 'admin', '12345')
     >>> mycam.devicemgmt.GetServices(False)
@@ -232,11 +617,18 @@ class ONVIFCamera(object):
     >>> ptz_service.GetConfiguration()
     '''
 
+    # Class of the service clients created by `create_onvif_service`
+    service_class = ONVIFService
+
     def __init__(self, host, port ,user, passwd, wsdl_dir=os.path.join(os.path.dirname(os.path.dirname(__file__)), "wsdl"),
                  cache_location=None, cache_duration=None,
-                 encrypt=True, daemon=False, no_cache=False, adjust_time=False):
-        self.services_template = {'devicemgmt': None, 'ptz': None, 'media': None,
-                         'imaging': None, 'events': None, 'analytics': None }
+                 encrypt=True, daemon=False, no_cache=False, adjust_time=False,
+                 lazy=False, executor=None, pool=None, timeout=None,
+                 store=None, revalidate=True, response_cache=None,
+                 metrics=None):
+        # Whether services are created from the process-wide WSDL
+        # registry, the services missing here are as well: set one to
+        # False to parse its WSDL for every service created
         self.use_services_template = {'devicemgmt': True, 'ptz': True, 'media': True,
                          'imaging': True, 'events': True, 'analytics': True }
         self.host = host
@@ -248,46 +640,334 @@ class ONVIFCamera(object):
         self.cache_duration = cache_duration
         self.encrypt = encrypt
         self.daemon = daemon
+        self.executor = executor
+        # Keep-alive connections shared by all the services of the camera
+        self.pool = pool or ConnectionPool()
+        # Snapshots of the media profiles, over the same connections
+        self.snapshots = SnapshotClient(self)
+        # Timeout in seconds of the HTTP requests, default to suds' one
+        self.timeout = timeout
         self.no_cache = no_cache
         self.adjust_time = adjust_time
+        self.lazy = lazy
+        self.store = store
+        # ResponseCache of the services, see `onvif.cache`
+        self.response_cache = response_cache
+        # Recorder of the CallSamples of the services, see `onvif.metrics`
+        self.metrics = metrics
+        # (serial number, firmware version) of the device once known
+        self.device_info = None
+        # Whether the xaddrs come from the device, not from the store
+        self.validated = True
+        self.revalidate_lock = Lock()
+        # Future of the last revalidation started
+        self.revalidation = None
 
         # Active service client container
         self.services = { }
         self.services_lock = RLock()
+        # Held while the services of a lazy camera are discovered, not
+        # `services_lock`: the other services keep working meanwhile
+        self.discovery_lock = RLock()
 
         # Set xaddrs
-        self.update_xaddrs()
+        self.xaddrs = None
+        self.dt_diff = None
+        if self.store is not None and self.warm_start():
+            if revalidate:
+                self.start_revalidation()
+        elif self.lazy:
+            # Discovered on first `get_definition` miss
+            self.devicemgmt = self.create_devicemgmt_service()
+        else:
+            self.update_xaddrs()
 
         self.to_dict = ONVIFService.to_dict
 
-    def update_xaddrs(self):
-        # Establish devicemgmt service first
-        self.dt_diff = None
-        self.devicemgmt  = self.create_devicemgmt_service()
+    def update_xaddrs(self, subscribe=True):
+        '''
+        Discovers the xaddrs of the services, and the clock offset with
+        `adjust_time`. They are gathered with a devicemgmt service of
+        their own, then swapped in at once: concurrent calls keep using
+        the current ones meanwhile.
+        '''
+        devicemgmt = self.build_service('devicemgmt')
+        dt_diff = None
         if self.adjust_time :
-            cdate = self.devicemgmt.GetSystemDateAndTime().UTCDateTime
-            cam_date = dt.datetime(cdate.Date.Year, cdate.Date.Month, cdate.Date.Day, cdate.Time.Hour, cdate.Time.Minute, cdate.Time.Second)
-            self.dt_diff = cam_date - dt.datetime.utcnow()
-            self.devicemgmt.dt_diff = self.dt_diff
-            self.devicemgmt.set_wsse()
+            dt_diff = clock_offset(resolve_future(devicemgmt.GetSystemDateAndTime()))
+            devicemgmt.dt_diff = dt_diff
+            devicemgmt.set_wsse()
         # Get XAddr of services on the device
-        self.xaddrs = { }
-        capabilities = self.devicemgmt.GetCapabilities({'Category': 'All'})
-        for name, capability in capabilities:
+        xaddrs = parse_xaddrs(resolve_future(devicemgmt.GetCapabilities({'Category': 'All'})))
+        info = None
+        if self.store is not None:
             try:
-                if name.lower() in SERVICES:
-                    ns = SERVICES[name.lower()]['ns']
-                    self.xaddrs[ns] = capability['XAddr']
-            except Exception:
-                logger.exception('Unexcept service type')
+                info = resolve_future(devicemgmt.GetDeviceInformation())
+            except ONVIFError as err:
+                logger.warning('GetDeviceInformation of %s:%s failed: %s',
+                               self.host, self.port, err)
+        self.swap_capabilities(devicemgmt, dt_diff, xaddrs)
+        if self.store is not None:
+            self.store_capabilities(info)
+
+        if subscribe:
+            self.create_pullpoint_subscription()
+
+    def swap_capabilities(self, devicemgmt, dt_diff, xaddrs):
+        '''Makes the capabilities gathered by `update_xaddrs` current'''
+        with self.services_lock:
+            # The subscription outlives a discovery
+            xaddrs.update(self.transient_xaddrs())
+            self.dt_diff = dt_diff
+            self.xaddrs = xaddrs
+            self.validated = True
+            self.services['devicemgmt'] = self.devicemgmt = devicemgmt
+
+    def warm_start(self):
+        '''Restores the capabilities from the store, returns whether found'''
+        try:
+            record = self.store.get(device_key(self.host, self.port))
+        except Exception:
+            logger.exception('Reading the capabilities of %s:%s failed',
+                             self.host, self.port)
+            return False
+        if not record:
+            return False
+        self.xaddrs = dict(record['xaddrs'])
+        dt_diff = record.get('dt_diff')
+        self.dt_diff = None if dt_diff is None else dt.timedelta(seconds=dt_diff)
+        if record.get('serial') is not None:
+            self.device_info = (record['serial'], record.get('firmware'))
+        self.validated = False
+        # Subscribe on demand, as lazy cameras do
+        self.lazy = True
+        self.devicemgmt = self.create_devicemgmt_service()
+        return True
+
+    def capability_record(self):
+        xaddrs = dict([ (ns, xaddr) for ns, xaddr in self.xaddrs.items()
+                        if ns not in TRANSIENT_XADDRS ])
+        serial, firmware = self.device_info or (None, None)
+        return {'xaddrs': xaddrs,
+                'dt_diff': None if self.dt_diff is None
+                           else self.dt_diff.total_seconds(),
+                'services': sorted([ name for name, service in SERVICES.items()
+                                     if service['ns'] in xaddrs ]),
+                'serial': serial, 'firmware': firmware}
+
+    def store_capabilities(self, info=None):
+        '''
+        Writes the capabilities to the store, with the serial number and
+        firmware version of the GetDeviceInformation response `info`.
+        '''
+        if info is not None:
+            device_info = (unicode(field(info, 'SerialNumber')),
+                           unicode(field(info, 'FirmwareVersion')))
+            if self.device_info is not None and device_info != self.device_info:
+                logger.info('%s:%s is now serial %s firmware %s', self.host,
+                            self.port, device_info[0], device_info[1])
+                self.forget_device()
+            self.device_info = device_info
+        try:
+            self.store.put(device_key(self.host, self.port),
+                           self.capability_record())
+        except Exception:
+            logger.exception('Storing the capabilities of %s:%s failed',
+                             self.host, self.port)
+
+    def forget_device(self):
+        '''
+        Drops what is kept of the device at host:port, another device or
+        another firmware: its stored capabilities and cached replies
+        '''
+        try:
+            self.store.delete(device_key(self.host, self.port))
+        except Exception:
+            logger.exception('Deleting the capabilities of %s:%s failed',
+                             self.host, self.port)
+        if self.response_cache is not None:
+            with self.services_lock:
+                xaddrs = [ service.xaddr for service in self.services.values() ]
+            for xaddr in xaddrs:
+                self.response_cache.invalidate(xaddr)
+
+    def transient_xaddrs(self):
+        return dict([ (ns, xaddr) for ns, xaddr in (self.xaddrs or { }).items()
+                      if ns in TRANSIENT_XADDRS ])
+
+    def revalidate(self):
+        '''
+        Fetches the capabilities from the device, re-points the services
+        whose xaddr changed and updates the store.
+        '''
+        self.update_xaddrs(subscribe=False)
+        return self.revalidated()
 
+    def revalidated(self):
         with self.services_lock:
+            for name, service in self.services.items():
+                service.error_handler = None
+                xaddr = self.xaddrs.get(SERVICES[name]['ns'])
+                if name != 'devicemgmt' and xaddr and xaddr != service.xaddr:
+                    logger.info('%s service of %s:%s moved to %s',
+                                name, self.host, self.port, xaddr)
+                    service.set_xaddr(xaddr)
+                if service.dt_diff != self.dt_diff:
+                    service.dt_diff = self.dt_diff
+                    service.set_wsse()
+        return self.xaddrs
+
+    def try_revalidate(self):
+        '''Revalidates unless already done or running, errors are logged'''
+        if self.validated or not self.revalidate_lock.acquire(False):
+            return
+        try:
+            self.revalidate()
+        except ONVIFError as err:
+            logger.warning('Revalidating the capabilities of %s:%s failed: %s',
+                           self.host, self.port, err)
+        finally:
+            self.revalidate_lock.release()
+
+    def start_revalidation(self):
+        '''
+        Revalidates the stored capabilities on the shared revalidation
+        pool, returns the Future of the revalidation, of the one already
+        running if any
+        '''
+        with self.services_lock:
+            if self.revalidation is None or self.revalidation.done():
+                self.revalidation = get_revalidation_executor().submit(
+                        self.try_revalidate)
+            return self.revalidation
+
+    def service_failed(self, service, err):
+        # The stored xaddrs may be stale
+        logger.info('%s:%s failed with stored capabilities (%s), revalidating',
+                    self.host, self.port, err)
+        self.try_revalidate()
+
+    def subscribe_pullpoint(self, params=None):
+        '''
+        Creates a pull-point subscription, sets the pullpoint and
+        subscription xaddrs and returns the CreatePullPointSubscription
+        response.
+        '''
+        self.event = self.create_events_service()
+        subscription = resolve_future(self.event.CreatePullPointSubscription(params))
+        # The subscription reference is both the pull point and
+        # the subscription manager (Renew, Unsubscribe)
+        address = subscription.SubscriptionReference.Address
+        with self.services_lock:
+            self.xaddrs[SERVICES['pullpoint']['ns']] = address
+            self.xaddrs[SERVICES['subscription']['ns']] = address
+        return subscription
+
+    def create_pullpoint_subscription(self):
+        '''Creates a pull-point subscription, sets the pullpoint xaddr'''
+        try:
+            self.subscribe_pullpoint()
+        except:
+            pass
+
+    def resolve_stream_uris(self, stream_setup=None, snapshots=True,
+                            concurrency=4):
+        '''
+        Returns a StreamRecord per media profile. The profiles are fetched
+        once, then the GetStreamUri (and GetSnapshotUri) requests of all
+        of them are sent `concurrency` at a time. A URI the device fails
+        to give is None, failing to get the profiles raises ONVIFError.
+        With a `response_cache`, repeated calls are answered from it.
+
+        >>> for record in mycam.resolve_stream_uris():
+        ...     print record.token, record.width, record.stream_uri
+        '''
+        media = self.get_service('media')
+        profiles = resolve_future(media.GetProfiles()) or [ ]
+        tokens = [ field(profile, '_token') for profile in profiles ]
+        requests = [ ('GetStreamUri', {'StreamSetup': stream_setup or
+                                                      DEFAULT_STREAM_SETUP,
+                                       'ProfileToken': token})
+                     for token in tokens ]
+        if snapshots:
+            requests += [ ('GetSnapshotUri', {'ProfileToken': token})
+                          for token in tokens ]
+
+        def send(request):
+            operation, params = request
+            return getattr(media, operation)(params)
+
+        def get_uri(request, ret=None):
+            operation, params = request
             try:
-                self.event = self.create_events_service()
-                self.xaddrs['http://www.onvif.org/ver10/events/wsdl/PullPointSubscription'] = self.event.CreatePullPointSubscription().SubscriptionReference.Address
-            except:
-                pass                
+                if ret is None:
+                    ret = send(request)
+                ret = resolve_future(ret)
+            except ONVIFError as err:
+                logger.warning('%s:%s %s of profile %s failed: %s',
+                               self.host, self.port, operation,
+                               params['ProfileToken'], err)
+                return None
+            return field(ret, 'Uri')
+
+        if concurrency > 1 and len(requests) > 1:
+            # Calls of a service with an executor already run on it, the
+            # others run on the shared pool
+            if media.executor is not None or media.daemon:
+                submit = send
+            else:
+                executor = get_default_executor()
+                submit = lambda request: executor.submit(safe_func(send),
+                                                         request)
+            rets = [ ]
+            running = set()
+            for request in requests:
+                if len(running) >= concurrency:
+                    running = wait(running,
+                                   return_when=FIRST_COMPLETED).not_done
+                rets.append(submit(request))
+                running.add(rets[-1])
+            uris = [ get_uri(request, ret)
+                     for request, ret in zip(requests, rets) ]
+        else:
+            uris = [ get_uri(request) for request in requests ]
+
+        records = [ ]
+        for i, profile in enumerate(profiles):
+            encoder = field(profile, 'VideoEncoderConfiguration')
+            resolution = field(encoder, 'Resolution')
+            records.append(StreamRecord(
+                    tokens[i], field(profile, 'Name'),
+                    field(encoder, 'Encoding'), field(resolution, 'Width'),
+                    field(resolution, 'Height'), uris[i],
+                    uris[len(tokens) + i] if snapshots else None))
+        return records
+
+
+    def find_recordings(self, params=None, **kwargs):
+        '''
+        Generator of the RecordingInformation of the recordings matching
+        the FindRecordings `params`, see `onvif.search.paged_search`
+        >>> for info in mycam.find_recordings({'Scope': { }}):
+        ...     print info.RecordingToken, info.EarliestRecording
+        '''
+        return paged_search(self.get_service('search'), 'recordings',
+                            params, **kwargs)
 
+    def find_events(self, params, **kwargs):
+        '''Generator of the FindEventResults matching FindEvents `params`'''
+        return paged_search(self.get_service('search'), 'events', params,
+                            **kwargs)
+
+    def find_ptz_positions(self, params, **kwargs):
+        '''Generator of the FindPTZPositionResults of FindPTZPosition'''
+        return paged_search(self.get_service('search'), 'ptz_positions',
+                            params, **kwargs)
+
+    def find_metadata(self, params, **kwargs):
+        '''Generator of the FindMetadataResults matching FindMetadata'''
+        return paged_search(self.get_service('search'), 'metadata', params,
+                            **kwargs)
 
     def update_url(self, host=None, port=None):
         changed = False
@@ -302,12 +982,12 @@ class ONVIFCamera(object):
             return
 
         self.devicemgmt = self.create_devicemgmt_service()
-        self.capabilities = self.devicemgmt.GetCapabilities()
+        self.capabilities = resolve_future(self.devicemgmt.GetCapabilities())
 
         with self.services_lock:
             for sname in self.services.keys():
                 xaddr = getattr(self.capabilities, sname.capitalize).XAddr
-                self.services[sname].ws_client.set_options(location=xaddr)
+                self.services[sname].set_xaddr(xaddr)
 
     def update_auth(self, user=None, passwd=None):
         changed = False
@@ -350,7 +1030,17 @@ class ONVIFCamera(object):
             return xaddr, wsdlpath
 
         # Get other XAddr
+        if self.xaddrs is None:
+            with self.discovery_lock:
+                if self.xaddrs is None:
+                    self.update_xaddrs(subscribe=False)
         xaddr = self.xaddrs.get(ns)
+        if not xaddr and self.lazy and name == 'pullpoint':
+            with self.discovery_lock:
+                xaddr = self.xaddrs.get(ns)
+                if not xaddr:
+                    self.create_pullpoint_subscription()
+                    xaddr = self.xaddrs.get(ns)
         if not xaddr:
             raise ONVIFError('Device doesn`t support service: %s' % name)
 
@@ -360,35 +1050,40 @@ class ONVIFCamera(object):
         '''Create ONVIF service client'''
 
         name = name.lower()
-        xaddr, wsdl_file = self.get_definition(name)
-
+        service = self.build_service(name, from_template, portType,
+                                     self.dt_diff)
         with self.services_lock:
-            svt = self.services_template.get(name)
-            # Has a template, clone from it. Faster.
-            if svt and from_template and self.use_services_template.get(name):
-                service = ONVIFService.clone(svt, xaddr, self.user,
-                                             self.passwd, wsdl_file,
-                                             self.cache_location,
-                                             self.cache_duration,
-                                             self.encrypt,
-                                             self.daemon,
-                                             no_cache=self.no_cache, portType=portType, dt_diff=self.dt_diff)
-            # No template, create new service from wsdl document.
-            # A little time-comsuming
-            else:
-                service = ONVIFService(xaddr, self.user, self.passwd,
-                                       wsdl_file, self.cache_location,
-                                       self.cache_duration, self.encrypt,
-                                       self.daemon, no_cache=self.no_cache, portType=portType, dt_diff=self.dt_diff)
-
             self.services[name] = service
 
             setattr(self, name, service)
-            if not self.services_template.get(name):
-                self.services_template[name] = service
 
         return service
 
+    def build_service(self, name, from_template=True, portType=None,
+                      dt_diff=None):
+        '''Service client of the camera, not registered in `services`'''
+        xaddr, wsdl_file = self.get_definition(name)
+        # Parsed WSDL documents are shared by all cameras of the process
+        # through `wsdl_registry`, so this only pays for a clone.
+        from_registry = from_template and \
+                self.use_services_template.get(name, True)
+        service = self.service_class(xaddr, self.user, self.passwd,
+                                     wsdl_file, self.cache_location,
+                                     self.cache_duration, self.encrypt,
+                                     self.daemon, no_cache=self.no_cache, portType=portType, dt_diff=dt_diff,
+                                     from_registry=from_registry, executor=self.executor,
+                                     transport=KeepAliveTransport(self.pool),
+                                     response_cache=self.response_cache,
+                                     metrics=self.metrics)
+        # Labels of the metrics
+        service.device = device_key(self.host, self.port)
+        service.name = name
+        if self.timeout is not None:
+            service.ws_client.set_options(timeout=self.timeout)
+        if not self.validated:
+            service.error_handler = self.service_failed
+        return service
+
     def create_devicemgmt_service(self, from_template=True):
         # The entry point for devicemgmt service is fixed.
         return self.create_onvif_service('devicemgmt', from_template)
@@ -423,5 +1118,8 @@ class ONVIFCamera(object):
     def create_pullpoint_service(self, from_template=True):
         return self.create_onvif_service('pullpoint', from_template, portType='PullPointSubscription')
 
+    def create_subscription_service(self, from_template=True):
+        return self.create_onvif_service('subscription', from_template, portType='SubscriptionManager')
+
     def create_receiver_service(self, from_template=True):
         return self.create_onvif_service('receiver', from_template)
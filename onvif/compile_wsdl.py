@@ -0,0 +1,34 @@
+#!/usr/bin/python
+'''Precompile ONVIF WSDL documents into a bundle for fast cold start'''
+
+import os.path
+import time
+from argparse import ArgumentParser
+
+from onvif.bundle import WSDLBundle, BUNDLE_NAME
+
+DEFAULT_WSDL_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'wsdl')
+
+def create_parser():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-w', '--wsdl', default=DEFAULT_WSDL_DIR,
+                        help='directory of ONVIF WSDL documents')
+    parser.add_argument('-o', '--output',
+                        help='bundle file, default to <wsdl>/%s' % BUNDLE_NAME)
+    parser.add_argument('documents', nargs='*',
+                        help='WSDL documents to compile, default to all'
+                             ' documents of onvif.definition.SERVICES')
+    return parser
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    output = args.output or os.path.join(args.wsdl, BUNDLE_NAME)
+
+    start = time.time()
+    entries = WSDLBundle.write(output, args.wsdl, args.documents or None)
+    for name in sorted(entries):
+        print '%-20s %8d bytes' % (name, entries[name][1])
+    print 'Wrote %s in %.2fs' % (output, time.time() - start)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+''' Declarative configuration of many devices, writing only what differs '''
+
+import copy
+import time
+from collections import namedtuple
+from threading import Lock
+
+import logging
+logger = logging.getLogger('onvif')
+
+from onvif.exceptions import ONVIFError
+from onvif.client import resolve_future
+from onvif.decode import field
+from onvif.serialize import to_dict
+from onvif.store import device_key
+
+# A field of a configuration to change, `path` being dotted, e.g.
+# 'Resolution.Width', `old` None when the configuration lacks it
+ConfigChange = namedtuple('ConfigChange', 'kind token path old new')
+
+# Operations of a kind of configuration: service, Get of all of them,
+# Set of one, Get of its options, and the function returning the errors
+# of a configuration against its options
+ConfigurationKind = namedtuple('ConfigurationKind',
+                               'service get set options validate')
+
+# Seconds the options of a configuration are kept
+OPTIONS_TTL = 3600
+
+
+def one(value):
+    # Extension elements are parsed as lists by the xs:any
+    if isinstance(value, list) and len(value) == 1:
+        return value[0]
+    return value
+
+def get_path(obj, path):
+    for name in path:
+        obj = one(field(obj, name))
+    return obj
+
+def scalar(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return unicode(value)
+
+def same(old, new):
+    '''Whether the value `old` read from a device is the setting `new`'''
+    if isinstance(old, (dict, list)) or isinstance(new, (dict, list)):
+        return to_dict(old) == to_dict(new)
+    if old is None or new is None:
+        return old is new
+    try:
+        return float(old) == float(new)
+    except (TypeError, ValueError):
+        return scalar(old) == scalar(new)
+
+def flatten(settings, prefix=()):
+    '''(path, value) of the leaves of nested dicts of settings'''
+    for name, value in sorted(settings.items()):
+        if isinstance(value, dict):
+            for item in flatten(value, prefix + (name, )):
+                yield item
+        else:
+            yield prefix + (name, ), value
+
+def in_range(value, limits):
+    limits = one(limits)
+    low, high = one(field(limits, 'Min')), one(field(limits, 'Max'))
+    try:
+        value = float(value)
+        return (low is None or value >= float(low)) and \
+               (high is None or value <= float(high))
+    except (TypeError, ValueError):
+        return False
+
+def in_list(value, items):
+    if not isinstance(items, list):
+        items = [ items ]
+    return any(same(one(item), value) for item in items)
+
+
+# Fields of a video encoder configuration => element of the options
+# of its encoding giving their range
+VIDEO_ENCODER_RANGES = {
+    ('RateControl', 'FrameRateLimit'): 'FrameRateRange',
+    ('RateControl', 'EncodingInterval'): 'EncodingIntervalRange',
+    ('H264', 'GovLength'): 'GovLengthRange',
+    ('MPEG4', 'GovLength'): 'GovLengthRange',
+}
+ENCODINGS = ('JPEG', 'MPEG4', 'H264')
+
+def video_encoder_errors(config, options, paths):
+    '''
+    Errors of the fields `paths` of a VideoEncoderConfiguration against
+    its VideoEncoderConfigurationOptions, of all fields when the
+    encoding changes
+    '''
+    encoding = scalar(field(config, 'Encoding'))
+    codec = field(options, encoding) if encoding in ENCODINGS else None
+    if codec is None:
+        return [ 'Encoding %s not supported' % encoding ]
+    extension = one(field(field(options, 'Extension'), encoding))
+    if ('Encoding', ) in paths:
+        paths = None
+
+    def checked(path):
+        return (paths is None or path in paths) and \
+               get_path(config, path) is not None
+
+    errors = [ ]
+    if checked(('Resolution', 'Width')) or checked(('Resolution', 'Height')):
+        resolution = get_path(config, ('Resolution', ))
+        size = (scalar(field(resolution, 'Width')),
+                scalar(field(resolution, 'Height')))
+        available = [ (scalar(one(field(item, 'Width'))),
+                       scalar(one(field(item, 'Height'))))
+                      for item in field(codec, 'ResolutionsAvailable') or [ ] ]
+        if available and size not in available:
+            errors.append('Resolution %sx%s not available' % size)
+    if checked(('Quality', )) and \
+       not in_range(field(config, 'Quality'), field(options, 'QualityRange')):
+        errors.append('Quality %s out of range' % field(config, 'Quality'))
+    for path, name in sorted(VIDEO_ENCODER_RANGES.items()):
+        if path[0] in ENCODINGS and path[0] != encoding:
+            continue
+        limits = field(codec, name)
+        if checked(path) and limits is not None and \
+           not in_range(get_path(config, path), limits):
+            errors.append('%s %s out of range' % ('.'.join(path),
+                                                   get_path(config, path)))
+    bitrate = ('RateControl', 'BitrateLimit')
+    limits = field(extension, 'BitrateRange')
+    if checked(bitrate) and limits is not None and \
+       not in_range(get_path(config, bitrate), limits):
+        errors.append('BitrateLimit %s out of range'
+                      % get_path(config, bitrate))
+    for path, name in ((('H264', 'H264Profile'), 'H264ProfilesSupported'),
+                       (('MPEG4', 'Mpeg4Profile'), 'Mpeg4ProfilesSupported')):
+        supported = field(codec, name)
+        if path[0] == encoding and checked(path) and supported is not None \
+           and not in_list(get_path(config, path), supported):
+            errors.append('%s %s not supported' % (path[1],
+                                                   get_path(config, path)))
+    return errors
+
+def video_source_errors(config, options, paths):
+    '''Errors of the Bounds of a VideoSourceConfiguration'''
+    bounds = field(config, 'Bounds')
+    ranges = field(options, 'BoundsRange')
+    if bounds is None or ranges is None:
+        return [ ]
+    return [ 'Bounds %s %s out of range' % (name, field(bounds, '_' + name))
+             for name, limits in (('x', 'XRange'), ('y', 'YRange'),
+                                  ('width', 'WidthRange'),
+                                  ('height', 'HeightRange'))
+             if ('Bounds', '_' + name) in paths and
+                not in_range(field(bounds, '_' + name),
+                             field(ranges, limits)) ]
+
+def audio_encoder_errors(config, options, paths):
+    '''Errors of an AudioEncoderConfiguration against its options'''
+    encoding = scalar(field(config, 'Encoding'))
+    choices = field(options, 'Options') or [ ]
+    if not isinstance(choices, list):
+        choices = [ choices ]
+    matching = [ choice for choice in choices
+                 if scalar(field(choice, 'Encoding')) == encoding ]
+    if not matching:
+        return [ 'Encoding %s not supported' % encoding ] if choices else [ ]
+    errors = [ ]
+    for name, values in (('Bitrate', 'BitrateList'),
+                         ('SampleRate', 'SampleRateList')):
+        items = field(field(matching[0], values), 'Items')
+        if (name, ) in paths and items is not None and \
+           not in_list(field(config, name), items):
+            errors.append('%s %s not supported' % (name, field(config, name)))
+    return errors
+
+CONFIGURATIONS = {
+    'video_encoder': ConfigurationKind(
+            'media', 'GetVideoEncoderConfigurations',
+            'SetVideoEncoderConfiguration',
+            'GetVideoEncoderConfigurationOptions', video_encoder_errors),
+    'video_source': ConfigurationKind(
+            'media', 'GetVideoSourceConfigurations',
+            'SetVideoSourceConfiguration',
+            'GetVideoSourceConfigurationOptions', video_source_errors),
+    'audio_encoder': ConfigurationKind(
+            'media', 'GetAudioEncoderConfigurations',
+            'SetAudioEncoderConfiguration',
+            'GetAudioEncoderConfigurationOptions', audio_encoder_errors),
+}
+
+
+class ConfigApplier(object):
+    '''
+    Brings the configurations of devices to the `desired` settings,
+    with as few writes as possible: many devices restart their encoder
+    on every Set, whether anything changed or not.
+
+    `desired` maps kinds of configurations (see `CONFIGURATIONS`) to
+    nested dicts of the fields to set, applied to all configurations of
+    the kind, or to the ones whose token or name is in `tokens[kind]`.
+
+    For each device, the configurations are read and compared field by
+    field to the settings. Only the configurations which differ are
+    validated against their Get*ConfigurationOptions, kept for
+    `options_ttl` seconds, and written, one Set each. Nothing is written
+    when a change is invalid. A failed Set writes the original of the
+    configurations set before it back.
+
+    `plan` and `apply` take a camera, and run across a fleet with
+    `ONVIFFleet.map`, devices being configured in parallel.
+
+    >>> applier = ConfigApplier({'video_encoder': {
+    ...     'Resolution': {'Width': 1280, 'Height': 720},
+    ...     'RateControl': {'FrameRateLimit': 15, 'BitrateLimit': 2048}}})
+    >>> print format_plan(fleet.map(applier.plan))
+    >>> for ret in fleet.map(applier.apply):
+    ...     print ret.device, ret.error or len(ret.result)
+    '''
+
+    def __init__(self, desired, tokens=None, options_ttl=OPTIONS_TTL,
+                 force_persistence=True):
+        for kind in desired:
+            if kind not in CONFIGURATIONS:
+                raise ONVIFError('Unknown configuration kind %s' % kind)
+        self.desired = dict((kind, list(flatten(settings)))
+                            for kind, settings in desired.items())
+        self.tokens = tokens or { }
+        self.options_ttl = options_ttl
+        self.force_persistence = force_persistence
+        # (device, kind, configuration token) => (options, expiry)
+        self.options = { }
+        self.lock = Lock()
+        self.reads = 0
+        self.writes = 0
+        self.rollbacks = 0
+
+    def selected(self, kind, config):
+        tokens = self.tokens.get(kind)
+        return tokens is None or field(config, '_token') in tokens or \
+               field(config, 'Name') in tokens
+
+    def diff(self, camera):
+        '''
+        [ (kind, token, original, updated, ConfigChanges) ] of the
+        configurations of `camera` differing from the settings
+        '''
+        writes = [ ]
+        for kind in sorted(self.desired):
+            operations = CONFIGURATIONS[kind]
+            service = camera.get_service(operations.service)
+            configs = resolve_future(getattr(service, operations.get)())
+            with self.lock:
+                self.reads += 1
+            if configs is None:
+                configs = [ ]
+            elif not isinstance(configs, list):
+                configs = [ configs ]
+            for config in configs:
+                if not self.selected(kind, config):
+                    continue
+                original = to_dict(config)
+                token = original.get('_token')
+                updated = copy.deepcopy(original)
+                changes = [ ]
+                for path, value in self.desired[kind]:
+                    old = get_path(original, path)
+                    if same(old, value):
+                        continue
+                    changes.append(ConfigChange(kind, token, '.'.join(path),
+                                                old, value))
+                    parent = updated
+                    for name in path[:-1]:
+                        if not isinstance(parent.get(name), dict):
+                            parent[name] = { }
+                        parent = parent[name]
+                    parent[path[-1]] = value
+                if changes:
+                    writes.append((kind, token, original, updated, changes))
+        return writes
+
+    def get_options(self, camera, kind, token):
+        key = (device_key(camera.host, camera.port), kind, token)
+        with self.lock:
+            entry = self.options.get(key)
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+        operations = CONFIGURATIONS[kind]
+        service = camera.get_service(operations.service)
+        options = to_dict(resolve_future(getattr(service, operations.options)(
+                {'ConfigurationToken': token})))
+        with self.lock:
+            self.options[key] = (options, time.time() + self.options_ttl)
+        return options
+
+    def validate(self, camera, writes):
+        '''Raises ONVIFError listing the invalid changes of `writes`'''
+        errors = [ ]
+        for kind, token, original, updated, changes in writes:
+            options = self.get_options(camera, kind, token)
+            paths = set(tuple(change.path.split('.')) for change in changes)
+            errors.extend('%s %s: %s' % (kind, token, error) for error in
+                          CONFIGURATIONS[kind].validate(updated, options,
+                                                        paths))
+        if errors:
+            raise ONVIFError('Invalid configuration: %s' % '; '.join(errors))
+
+    def plan(self, camera):
+        '''ConfigChanges `apply` would write to `camera`, validated'''
+        writes = self.diff(camera)
+        self.validate(camera, writes)
+        return [ change for write in writes for change in write[4] ]
+
+    def set_configuration(self, camera, kind, configuration):
+        operations = CONFIGURATIONS[kind]
+        service = camera.get_service(operations.service)
+        resolve_future(getattr(service, operations.set)(
+                {'Configuration': configuration,
+                 'ForcePersistence': self.force_persistence}))
+
+    def apply(self, camera):
+        '''
+        Writes the configurations of `camera` which differ from the
+        settings, returns the ConfigChanges written. Raises ONVIFError
+        when a change is invalid, nothing being written, or when a Set
+        fails, the configurations written before being restored.
+        '''
+        writes = self.diff(camera)
+        self.validate(camera, writes)
+        done = [ ]
+        for write in writes:
+            kind, token, original, updated, changes = write
+            try:
+                self.set_configuration(camera, kind, updated)
+            except Exception as err:
+                restored = self.rollback(camera, done)
+                raise ONVIFError('%s of %s failed: %s, %d of %d '
+                                 'configurations restored'
+                                 % (CONFIGURATIONS[kind].set, token, err,
+                                    restored, len(done)))
+            with self.lock:
+                self.writes += 1
+            done.append(write)
+        return [ change for write in writes for change in write[4] ]
+
+    def rollback(self, camera, done):
+        '''Writes the originals of `done` back, returns how many were'''
+        restored = 0
+        for kind, token, original, updated, changes in reversed(done):
+            try:
+                self.set_configuration(camera, kind, original)
+                restored += 1
+            except Exception as err:
+                logger.error('Restoring %s %s of %s:%s failed: %s', kind,
+                             token, camera.host, camera.port, err)
+        with self.lock:
+            self.rollbacks += 1
+        return restored
+
+    def run(self, fleet, dry_run=False, devices=None):
+        '''FleetResults of `apply`, or of `plan` if `dry_run`'''
+        return fleet.map(self.plan if dry_run else self.apply, devices)
+
+    def stats(self):
+        return {'reads': self.reads, 'writes': self.writes,
+                'rollbacks': self.rollbacks, 'options': len(self.options)}
+
+
+def format_plan(results):
+    '''Text of the FleetResults of `ConfigApplier.plan`, one line a change'''
+    lines = [ ]
+    for ret in sorted(results, key=lambda ret: ret.device):
+        if ret.error is not None:
+            lines.append('%s: %s' % (ret.device, ret.error))
+        elif not ret.result:
+            lines.append('%s: up to date' % ret.device)
+        else:
+            lines.append('%s:' % ret.device)
+            lines.extend('  %s %s %s: %s -> %s' % change
+                         for change in ret.result)
+    return '\n'.join(lines)
@@ -0,0 +1,246 @@
+''' Decoding of SOAP replies into plain dicts and lists '''
+
+import datetime as dt
+import weakref
+from threading import Lock
+from xml.parsers import expat
+
+from suds.xsd.sxbasic import Element, Attribute, Any, Simple
+
+# Builtin XML schema types converted from text
+NUMBERS = ('int', 'integer', 'long', 'short', 'byte', 'unsignedInt',
+           'unsignedLong', 'unsignedShort', 'unsignedByte',
+           'nonNegativeInteger', 'positiveInteger', 'negativeInteger',
+           'nonPositiveInteger')
+
+def to_bool(text):
+    return text in ('true', '1')
+
+def to_datetime(text):
+    '''Naive UTC datetime of an xs:dateTime, None if it can't be parsed'''
+    try:
+        value = dt.datetime.strptime(text[:19], '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
+    tz = text[19:].lstrip('.0123456789')
+    if tz[:1] in ('+', '-') and len(tz) >= 6:
+        offset = dt.timedelta(hours=int(tz[1:3]), minutes=int(tz[4:6]))
+        value = value - offset if tz[0] == '+' else value + offset
+    return value
+
+CONVERTERS = dict([ (name, int) for name in NUMBERS ])
+CONVERTERS.update({'float': float, 'double': float, 'decimal': float,
+                   'boolean': to_bool, 'dateTime': to_datetime})
+
+
+def local_name(name):
+    return name[name.find(':') + 1:]
+
+
+class Plan(object):
+    '''
+    How to decode the elements of a schema type: the plans of its child
+    elements, which of them repeat, and the converters of its text and
+    attributes. Elements without a plan (xs:any) are decoded generically.
+    '''
+
+    __slots__ = ('children', 'attributes', 'convert', 'leaf', '__weakref__')
+
+    def __init__(self):
+        # local name => (plan, repeated)
+        self.children = { }
+        # '_' + local name => converter
+        self.attributes = { }
+        self.convert = None
+        self.leaf = True
+
+
+def builtin_converter(resolved):
+    if resolved.builtin():
+        return CONVERTERS.get(resolved.name)
+    if isinstance(resolved, Simple):
+        # Restriction of a builtin type, e.g. an enumeration
+        for child in resolved.rawchildren:
+            ref = getattr(child, 'ref', None)
+            if ref:
+                return CONVERTERS.get(ref[0])
+    return None
+
+
+class PlanCache(object):
+    '''Plans of the schema types, shared by all clients of a parsed WSDL'''
+
+    def __init__(self):
+        self.types = weakref.WeakKeyDictionary()
+        self.methods = weakref.WeakKeyDictionary()
+        self.lock = Lock()
+
+    def type_plan(self, schema_type):
+        resolved = schema_type.resolve()
+        plan = self.types.get(resolved)
+        if plan is not None:
+            return plan
+        plan = Plan()
+        # Registered before its children for recursive types
+        self.types[resolved] = plan
+        plan.convert = builtin_converter(resolved)
+        if resolved.builtin():
+            return plan
+        for child, ancestry in resolved:
+            if isinstance(child, Attribute):
+                plan.attributes['_' + child.name] = \
+                        builtin_converter(child.resolve())
+                plan.leaf = False
+            elif isinstance(child, Any):
+                plan.leaf = False
+            elif isinstance(child, Element):
+                repeated = child.unbounded() or \
+                           any([ a.unbounded() for a in ancestry ])
+                plan.children[child.name] = (self.type_plan(child), repeated)
+                plan.leaf = False
+        return plan
+
+    def method_plan(self, method):
+        '''Returns (plan of the reply element, returned values) of `method`'''
+        ret = self.methods.get(method)
+        if ret is not None:
+            return ret
+        with self.lock:
+            binding = method.binding.output
+            parts = binding.bodypart_types(method, input=False)
+            plan = self.type_plan(parts[0]) if parts else Plan()
+            # Same unwrapping as suds: one returned type is returned
+            # alone, a list if it is unbounded.
+            returned = [ (t.name, t.unbounded())
+                         for t in binding.returned_types(method) ]
+            wrapped = method.soap.output.body.wrapped
+            ret = self.methods[method] = (plan, returned, wrapped)
+        return ret
+
+plan_cache = PlanCache()
+
+
+class ReplyDecoder(object):
+    '''Builds dicts and lists from the expat events of a SOAP envelope'''
+
+    def __init__(self, plan):
+        self.plan = plan
+        # Open elements of the body:
+        # [plan, dict, text parts, local name, repeated]
+        self.stack = [ ]
+        self.depth = 0
+        self.body_depth = None
+        self.fault = False
+        self.reply = None
+
+    def start(self, name, attrs):
+        self.depth += 1
+        local = local_name(name)
+        if self.body_depth is None:
+            if local == 'Body':
+                self.body_depth = self.depth
+            return
+        if self.depth == self.body_depth + 1:
+            if local == 'Fault':
+                self.fault = True
+            plan, repeated = self.plan, False
+        else:
+            parent = self.stack[-1][0]
+            plan, repeated = parent.children.get(local, (None, False)) \
+                             if parent is not None else (None, False)
+        values = None
+        if attrs:
+            converters = plan.attributes if plan is not None else { }
+            for key, value in attrs.iteritems():
+                if key.startswith('xmlns'):
+                    continue
+                key = '_' + local_name(key)
+                convert = converters.get(key)
+                if values is None:
+                    values = { }
+                values[key] = convert(value) if convert else value
+        self.stack.append([plan, values, [ ], local, repeated])
+
+    def end(self, name):
+        depth = self.depth
+        self.depth -= 1
+        if self.body_depth is None or depth <= self.body_depth:
+            return
+        plan, values, text, local, repeated = self.stack.pop()
+        text = u''.join(text).strip()
+        if values is not None:
+            if text:
+                values['value'] = text
+            value = values
+        elif text:
+            convert = plan.convert if plan is not None else None
+            value = convert(text) if convert else text
+        elif plan is not None and not plan.leaf:
+            value = { }
+        else:
+            value = None
+
+        if not self.stack:
+            self.reply = value
+            return
+        parent = self.stack[-1]
+        if parent[1] is None:
+            parent[1] = { }
+        siblings = parent[1]
+        if repeated:
+            siblings.setdefault(local, [ ]).append(value)
+        elif local in siblings:
+            # Undeclared repeated element
+            previous = siblings[local]
+            if isinstance(previous, list):
+                previous.append(value)
+            else:
+                siblings[local] = [previous, value]
+        else:
+            siblings[local] = value
+
+    def data(self, text):
+        if self.stack:
+            self.stack[-1][2].append(text)
+
+
+def decode_reply(method, body):
+    '''
+    Decodes the SOAP reply `body` of suds `method` into dicts and lists,
+    unwrapped like suds does. Faults are left to suds to raise.
+    '''
+    if not body:
+        # 202 or 204, as suds returns None
+        return None
+    plan, returned, wrapped = plan_cache.method_plan(method)
+    decoder = ReplyDecoder(plan)
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = decoder.start
+    parser.EndElementHandler = decoder.end
+    parser.CharacterDataHandler = decoder.data
+    parser.Parse(body, True)
+    if decoder.fault:
+        return method.binding.output.get_reply(method, body)[1]
+
+    reply = decoder.reply
+    if not wrapped:
+        return reply
+    if len(returned) == 1:
+        name, unbounded = returned[0]
+        value = reply.get(name) if isinstance(reply, dict) else None
+        if unbounded:
+            if value is None:
+                return [ ]
+            return value if isinstance(value, list) else [value]
+        return value
+    if not returned:
+        return None
+    return reply if isinstance(reply, dict) else { }
+
+
+def field(obj, name, default=None):
+    '''`name` of a suds object or of a decoded dict'''
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
@@ -0,0 +1,307 @@
+''' WS-Discovery of ONVIF devices '''
+
+import time
+import uuid
+import errno
+import select
+import socket
+import struct
+from urlparse import urlparse
+from xml.etree import cElementTree as etree
+
+import logging
+logger = logging.getLogger('onvif')
+
+from onvif.client import ONVIFCamera
+
+MULTICAST_ADDRESS = ('239.255.255.250', 3702)
+DISCOVERY_PORT = 3702
+
+# Types of the ONVIF devices, the NVTs of remotediscovery.wsdl
+NVT_TYPES = 'dn:NetworkVideoTransmitter'
+
+# Probe of ws-discovery.xsd, built once and only formatted per probe
+PROBE = '''<?xml version="1.0" encoding="UTF-8"?>\
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" \
+xmlns:a="http://schemas.xmlsoap.org/ws/2004/08/addressing" \
+xmlns:d="http://schemas.xmlsoap.org/ws/2005/04/discovery" \
+xmlns:dn="http://www.onvif.org/ver10/network/wsdl">\
+<s:Header>\
+<a:Action s:mustUnderstand="1">\
+http://schemas.xmlsoap.org/ws/2005/04/discovery/Probe</a:Action>\
+<a:MessageID>%(message_id)s</a:MessageID>\
+<a:ReplyTo><a:Address>\
+http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous\
+</a:Address></a:ReplyTo>\
+<a:To s:mustUnderstand="1">urn:schemas-xmlsoap-org:ws:2005:04:discovery</a:To>\
+</s:Header>\
+<s:Body><d:Probe>%(types)s%(scopes)s</d:Probe></s:Body>\
+</s:Envelope>'''
+
+# Replies read between two probes sent by a sweep
+BURST = 256
+
+
+def probe_message(message_id, types=NVT_TYPES, scopes=None):
+    types = '<d:Types>%s</d:Types>' % types if types else ''
+    if scopes:
+        scopes = '<d:Scopes>%s</d:Scopes>' % ' '.join(scopes)
+    return PROBE % {'message_id': message_id, 'types': types,
+                    'scopes': scopes or ''}
+
+
+def iter_hosts(network):
+    '''
+    IPv4 addresses of `network`, '192.168.0.0/24' (network and broadcast
+    addresses excluded), a single address or an iterable of addresses.
+    '''
+    if not isinstance(network, basestring):
+        for host in network:
+            yield host
+        return
+    address, _, prefix = network.partition('/')
+    prefix = int(prefix) if prefix else 32
+    base, = struct.unpack('!I', socket.inet_aton(address))
+    mask = (0xffffffff << (32 - prefix)) & 0xffffffff
+    first = base & mask
+    last = first | (~mask & 0xffffffff)
+    if prefix < 31:
+        first += 1
+        last -= 1
+    for addr in xrange(first, last + 1):
+        yield socket.inet_ntoa(struct.pack('!I', addr))
+
+
+def local_name(tag):
+    return tag[tag.rfind('}') + 1:]
+
+
+class ProbeMatch(object):
+    '''
+    A device answering a Probe. `endpoint` is its endpoint reference,
+    stable across address changes, `address` the IP it answered from.
+
+    >>> mycam = match.camera('admin', '12345')
+    '''
+
+    def __init__(self, endpoint, types, scopes, xaddrs, metadata_version,
+                 address):
+        self.endpoint = endpoint
+        self.types = types
+        self.scopes = scopes
+        self.xaddrs = xaddrs
+        self.metadata_version = metadata_version
+        self.address = address
+
+    def __repr__(self):
+        return '<ProbeMatch %s %s>' % (self.endpoint, ' '.join(self.xaddrs))
+
+    def xaddr(self):
+        '''The XAddr on the address the device answered from, else the first'''
+        for xaddr in self.xaddrs:
+            if urlparse(xaddr).hostname == self.address:
+                return xaddr
+        return self.xaddrs[0] if self.xaddrs else None
+
+    @property
+    def host(self):
+        xaddr = self.xaddr()
+        return urlparse(xaddr).hostname if xaddr else self.address
+
+    @property
+    def port(self):
+        xaddr = self.xaddr()
+        return (urlparse(xaddr).port or 80) if xaddr else 80
+
+    def camera(self, user, passwd, **kwargs):
+        '''ONVIFCamera of the device, keyword arguments are passed along'''
+        return ONVIFCamera(self.host, self.port, user, passwd, **kwargs)
+
+
+def parse_probe_matches(data, address=None):
+    '''Returns (RelatesTo, [ProbeMatch]) of a ProbeMatches datagram'''
+    try:
+        root = etree.fromstring(data)
+    except SyntaxError:
+        return None, [ ]
+    relates_to = None
+    matches = [ ]
+    for node in root.iter():
+        name = local_name(node.tag)
+        if name == 'RelatesTo':
+            relates_to = (node.text or '').strip()
+        elif name == 'ProbeMatch':
+            values = { }
+            for child in node.iter():
+                values[local_name(child.tag)] = (child.text or '').strip()
+            version = values.get('MetadataVersion')
+            matches.append(ProbeMatch(values.get('Address'),
+                                      values.get('Types', '').split(),
+                                      values.get('Scopes', '').split(),
+                                      values.get('XAddrs', '').split(),
+                                      int(version) if version and
+                                      version.isdigit() else None,
+                                      address))
+    return relates_to, matches
+
+
+class WSDiscovery(object):
+    '''
+    Finds ONVIF devices with WS-Discovery Probes, multicast on the local
+    network or unicast to every address of a range. Matches are yielded
+    as they arrive, once per endpoint reference: the endpoints already
+    seen are kept in `seen`, pass the same set to several searches to
+    skip the devices found by the previous ones.
+
+    >>> from onvif.discovery import WSDiscovery
+    >>> discovery = WSDiscovery()
+    >>> for match in discovery.probe(timeout=3):
+    ...     print match.endpoint, match.host, match.port
+    >>> for match in discovery.sweep('10.1.0.0/16', rate=2000):
+    ...     mycam = match.camera('admin', '12345', lazy=True)
+    '''
+
+    def __init__(self, types=NVT_TYPES, scopes=None, interface=None, ttl=1,
+                 seen=None):
+        self.types = types
+        self.scopes = scopes
+        self.interface = interface
+        self.ttl = ttl
+        self.seen = set() if seen is None else seen
+        self.sent = 0
+        self.received = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    def socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
+        if self.interface:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                            socket.inet_aton(self.interface))
+        sock.bind((self.interface or '', 0))
+        sock.setblocking(0)
+        return sock
+
+    def message(self):
+        message_id = 'urn:uuid:%s' % uuid.uuid4()
+        return message_id, probe_message(message_id, self.types, self.scopes)
+
+    def receive(self, sock, message_id):
+        '''New matches of the datagrams waiting on `sock`'''
+        matches = [ ]
+        for _ in xrange(BURST):
+            try:
+                data, (address, port) = sock.recvfrom(65536)
+            except socket.error as err:
+                if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.errors += 1
+                    logger.debug('WS-Discovery receive error: %s', err)
+                break
+            relates_to, found = parse_probe_matches(data, address)
+            if relates_to != message_id:
+                continue
+            self.received += 1
+            for match in found:
+                if match.endpoint in self.seen:
+                    self.duplicates += 1
+                    continue
+                self.seen.add(match.endpoint)
+                matches.append(match)
+        return matches
+
+    def send(self, sock, data, target):
+        '''Returns False if the socket is full and `data` must be resent'''
+        try:
+            sock.sendto(data, target)
+        except socket.error as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                return False
+            self.errors += 1
+            logger.debug('WS-Discovery probe to %s failed: %s', target[0], err)
+        self.sent += 1
+        return True
+
+    def probe(self, timeout=3, repeat=2, address=MULTICAST_ADDRESS):
+        '''
+        Multicasts a Probe, sent `repeat` times as UDP may lose it,
+        and yields the matches received within `timeout` seconds.
+        '''
+        sock = self.socket()
+        try:
+            message_id, data = self.message()
+            deadline = time.time() + timeout
+            interval = min(0.25, timeout / max(repeat, 1))
+            next_send = time.time()
+            while True:
+                now = time.time()
+                if repeat and now >= next_send:
+                    if self.send(sock, data, address):
+                        repeat -= 1
+                    next_send = now + interval
+                wait = deadline - now
+                if wait <= 0:
+                    return
+                if repeat:
+                    wait = min(wait, max(0, next_send - now))
+                readable, _, _ = select.select([sock], [ ], [ ], wait)
+                if readable:
+                    for match in self.receive(sock, message_id):
+                        yield match
+        finally:
+            sock.close()
+
+    def sweep(self, network, port=DISCOVERY_PORT, rate=1000, timeout=2):
+        '''
+        Sends a unicast Probe to every address of `network` (see
+        `iter_hosts`), at most `rate` per second (unlimited if None),
+        and yields the matches until `timeout` seconds after the last
+        probe. Replies are read while probing, a /16 at 10000 probes/s
+        takes under 10 seconds.
+        '''
+        sock = self.socket()
+        try:
+            message_id, data = self.message()
+            interval = 1.0 / rate if rate else 0
+            hosts = iter_hosts(network)
+            host = next(hosts, None)
+            next_send = time.time()
+            deadline = None
+            while True:
+                now = time.time()
+                burst = 0
+                blocked = False
+                while host is not None and next_send <= now and \
+                      burst < BURST:
+                    if not self.send(sock, data, (host, port)):
+                        blocked = True
+                        break
+                    host = next(hosts, None)
+                    next_send += interval
+                    burst += 1
+                if host is None and deadline is None:
+                    deadline = now + timeout
+                if host is None:
+                    wait = deadline - now
+                    if wait <= 0:
+                        return
+                else:
+                    # Catch up at once after a slow iteration, but not
+                    # by bursting more than the rate over a whole second
+                    next_send = max(next_send, now - 1)
+                    wait = max(0, next_send - now)
+                # Full send buffer: wait for room, or for replies
+                readable, _, _ = select.select([sock],
+                                               [sock] if blocked else [ ],
+                                               [ ], 0.1 if blocked else wait)
+                if readable:
+                    for match in self.receive(sock, message_id):
+                        yield match
+        finally:
+            sock.close()
+
+    def stats(self):
+        return {'sent': self.sent, 'received': self.received,
+                'devices': len(self.seen), 'duplicates': self.duplicates,
+                'errors': self.errors}
@@ -0,0 +1,250 @@
+''' Request envelopes rendered from templates compiled by suds '''
+
+import re
+from threading import Lock
+from collections import OrderedDict
+
+from suds.sudsobject import Object, items
+from suds.sax.enc import Encoder
+from suds.wsse import Security
+
+from onvif.wsse import DigestSecurity, RawElement
+from onvif.registry import call_binding
+
+# Stands for the leaves of the parameters, and for the WS-Security
+# header, in the envelopes rendered to compile a template
+SLOT = 'ONVIFSLOT%dX'
+SECURITY_SLOT = 'ONVIFSLOTWSSEX'
+SLOTS = re.compile(r'(ONVIFSLOT(?:\d+|WSSE)X)')
+
+# Parameter leaves a template can be filled with
+LEAF_TYPES = (basestring, bool, int, long, float)
+
+encoder = Encoder()
+
+# Marks the (operation, shape) which couldn't be compiled
+UNCOMPILABLE = object()
+
+
+def shape(params, leaves):
+    '''
+    Shape of `params`: their structure without the values of the leaves,
+    appended to `leaves`. None if a leaf can't be templated.
+    '''
+    if isinstance(params, Object):
+        params = dict(items(params))
+    if isinstance(params, dict):
+        shapes = [ ]
+        for key in sorted(params):
+            value = shape(params[key], leaves)
+            if value is None:
+                return None
+            shapes.append((key, value))
+        return ('dict', tuple(shapes))
+    if isinstance(params, (list, tuple)):
+        shapes = [ ]
+        for item in params:
+            value = shape(item, leaves)
+            if value is None:
+                return None
+            shapes.append(value)
+        return ('list', tuple(shapes))
+    if params is None:
+        return 'none'
+    if params == '':
+        # suds leaves out the empty attributes, a slot would be rendered
+        return 'empty'
+    if isinstance(params, LEAF_TYPES):
+        leaves.append(params)
+        return type(params).__name__
+    return None
+
+
+def mark(params, counter):
+    '''Copy of `params` as dicts and lists, the leaves replaced by slots'''
+    if isinstance(params, Object):
+        params = dict(items(params))
+    if isinstance(params, dict):
+        return dict((key, mark(params[key], counter))
+                    for key in sorted(params))
+    if isinstance(params, (list, tuple)):
+        return [ mark(item, counter) for item in params ]
+    if params is None or params == '':
+        return params
+    counter.append(None)
+    return SLOT % (len(counter) - 1)
+
+
+def to_text(value):
+    return value if isinstance(value, basestring) else str(value)
+
+
+def xsd_boolean(value):
+    return 'true' if value else 'false'
+
+
+class SecuritySlot(Security):
+    '''Header rendered as the slot of the WS-Security header'''
+
+    def xml(self):
+        return RawElement(SECURITY_SLOT)
+
+
+class CompileOptions(object):
+    '''Options of a client, with the WS-Security header as a slot'''
+
+    def __init__(self, options):
+        self.__dict__['options'] = options
+
+    def __getattr__(self, name):
+        value = getattr(self.options, name)
+        if name == 'wsse' and value is not None:
+            return SecuritySlot()
+        return value
+
+
+class RawDocument(object):
+    '''Rendered envelope, sent by suds in place of its Document'''
+
+    def __init__(self, text):
+        self.text = text
+
+    def root(self):
+        return None
+
+    def plain(self):
+        return self.text
+
+    def str(self):
+        return self.text
+
+    def __str__(self):
+        return self.text
+
+
+class EnvelopeTemplate(object):
+    '''
+    Envelope of an operation called with parameters of a given shape:
+    the literal `pieces` around its slots, each slot being the index of
+    a leaf and the function formatting it, or None for the WS-Security
+    header.
+    '''
+
+    def __init__(self, pieces, slots):
+        self.pieces = pieces
+        self.slots = slots
+
+    def render(self, leaves, security):
+        pieces = self.pieces
+        parts = [ pieces[0] ]
+        for i, (index, format) in enumerate(self.slots):
+            if index is None:
+                parts.append(security)
+            else:
+                text = format(leaves[index])
+                parts.append(encoder.encode(text)
+                             if encoder.needsEncoding(text) else text)
+            parts.append(pieces[i + 1])
+        return ''.join(parts)
+
+
+class EnvelopeCompiler(object):
+    '''
+    Renders the request envelopes of the operations from templates.
+
+    On the first call of an operation with parameters of a new shape
+    (same keys, lists of same lengths, leaves of same types), suds
+    renders the envelope twice: with a slot in place of every leaf, and
+    with the actual values. The first gives the template, the second
+    checks it and how suds formats every leaf (an xsd:boolean True as
+    'true', an xsd:string one as 'True'). Later calls only format and
+    escape the leaves, and render the WS-Security header.
+
+    Shapes whose leaves aren't strings, numbers or booleans (dates, ...),
+    or whose check fails, are left to suds, as are the clients with
+    plugins, SOAP headers or pretty printed XML.
+
+    At most `maxsize` templates are kept, the least recently used
+    dropped first.
+    '''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        # (suds method, with WS-Security, shape) => EnvelopeTemplate or
+        # UNCOMPILABLE, in order of use
+        self.templates = OrderedDict()
+        self.lock = Lock()
+        self.compiled = 0
+        self.uncompilable = 0
+
+    def compile(self, method, options, params, leaves):
+        counter = [ ]
+        marked = mark(params, counter)
+        binding = call_binding(method.binding.input, CompileOptions(options))
+        template = binding.get_message(method, (), marked).plain()
+        actual = binding.get_message(method, (), params).plain()
+
+        parts = SLOTS.split(template)
+        pieces = parts[0::2]
+        names = parts[1::2]
+        pattern = '(.*?)'.join(re.escape(piece) for piece in pieces)
+        match = re.match(pattern + '$', actual, re.S)
+        if match is None:
+            return UNCOMPILABLE
+        slots = [ ]
+        for name, text in zip(names, match.groups()):
+            if name == SECURITY_SLOT:
+                if text != SECURITY_SLOT:
+                    return UNCOMPILABLE
+                slots.append((None, None))
+                continue
+            index = int(name[9:-1])
+            value = leaves[index]
+            if isinstance(value, bool) and text in ('true', 'false'):
+                format = xsd_boolean
+            else:
+                format = to_text
+            if encoder.encode(format(value)) != text:
+                return UNCOMPILABLE
+            slots.append((index, format))
+        return EnvelopeTemplate(pieces, slots)
+
+    def render(self, method, options, params):
+        '''Envelope of `method` called with `params`, None if left to suds'''
+        if options.plugins or options.soapheaders or options.prettyxml:
+            return None
+        leaves = [ ]
+        key = (method, options.wsse is not None, shape(params, leaves))
+        if key[2] is None:
+            return None
+        with self.lock:
+            template = self.templates.pop(key, None)
+            if template is not None:
+                self.templates[key] = template
+        if template is None:
+            template = self.compile(method, options, params, leaves)
+            with self.lock:
+                self.templates[key] = template
+                while len(self.templates) > self.maxsize:
+                    self.templates.popitem(last=False)
+                if template is UNCOMPILABLE:
+                    self.uncompilable += 1
+                else:
+                    self.compiled += 1
+        if template is UNCOMPILABLE:
+            return None
+
+        wsse = options.wsse
+        if wsse is None:
+            security = ''
+        elif isinstance(wsse, DigestSecurity):
+            security = wsse.render()
+        else:
+            security = wsse.xml().plain()
+        return RawDocument(template.render(leaves, security))
+
+    def stats(self):
+        with self.lock:
+            return {'compiled': self.compiled,
+                    'uncompilable': self.uncompilable,
+                    'templates': len(self.templates)}
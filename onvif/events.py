@@ -0,0 +1,328 @@
+''' Streaming consumer of ONVIF pull-point events '''
+
+import time
+import datetime as dt
+
+import logging
+logger = logging.getLogger('onvif')
+
+from onvif.exceptions import ONVIFError
+from onvif.client import resolve_future
+from onvif.asyncclient import AsyncResult
+from onvif.decode import field
+
+
+# Seconds an Unsubscribe is given, not as long as a long poll
+UNSUBSCRIBE_TIMEOUT = 5
+
+
+def isoduration(seconds):
+    return 'PT%dS' % seconds
+
+
+def remaining_seconds(response, default):
+    '''
+    Seconds left on a subscription from the TerminationTime and
+    CurrentTime of a response, both on the camera clock.
+    '''
+    current = field(response, 'CurrentTime')
+    termination = field(response, 'TerminationTime')
+    if not isinstance(current, dt.datetime) or \
+       not isinstance(termination, dt.datetime):
+        return default
+    delta = termination - current
+    return delta.days * 86400 + delta.seconds
+
+
+class EventStream(object):
+    '''
+    Iterates over the events of a camera through a pull-point subscription.
+
+    The subscription is created on first use, renewed ahead of its
+    termination time and created again whenever a pull fails (camera
+    reboot, subscription dropped by the camera, network errors), so
+    iterating never ends until `close` is called.
+
+    MessageLimit doubles while pulls return full batches, up to
+    `max_limit`, and shrinks back when the event rate drops. Timeout
+    (the long-poll duration) doubles while pulls come back empty, up
+    to `max_timeout`, and is reset to `timeout` on the first event.
+
+    Only one batch of messages is alive at a time, memory doesn't grow
+    with the number of events consumed. With `fast_decode`, messages are
+    decoded into dicts instead of suds objects, see ONVIFService.
+
+    >>> from onvif.events import EventStream
+    >>> stream = EventStream(mycam)
+    >>> for message in stream:
+    ...     print message.Topic.value, message.Message
+    >>> stream.close()
+    '''
+
+    def __init__(self, camera, message_limit=16, max_limit=1024,
+                 timeout=5, max_timeout=60, termination=60,
+                 retry_delay=1, max_retry_delay=60, params=None,
+                 fast_decode=False):
+        self.camera = camera
+        self.min_limit = message_limit
+        self.max_limit = max_limit
+        self.message_limit = message_limit
+        self.min_timeout = timeout
+        # Long polls past half the subscription would renew on every pull
+        self.max_timeout = max(min(max_timeout, termination // 2), timeout)
+        self.timeout = timeout
+        self.termination = termination
+        self.min_retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.retry_delay = retry_delay
+        # Extra arguments of CreatePullPointSubscription, e.g. a Filter
+        self.params = params
+        self.fast_decode = fast_decode
+
+        self.pullpoint = None
+        self.subscription = None
+        self.http_timeout = None
+        self.requested = message_limit
+        # time.time() at which the subscription terminates
+        self.expires = 0
+        self.closed = False
+
+        self.events = 0
+        self.pulls = 0
+        self.renewals = 0
+        self.subscriptions = 0
+        self.errors = 0
+
+    def subscribe_params(self):
+        params = dict(self.params or { })
+        params['InitialTerminationTime'] = isoduration(self.termination)
+        return params
+
+    def subscribe(self):
+        '''Creates a new pull-point subscription'''
+        self.subscribed(self.camera.subscribe_pullpoint(self.subscribe_params()))
+
+    def subscribed(self, response):
+        self.pullpoint = self.camera.create_pullpoint_service()
+        # Same PullMessages over and over
+        self.pullpoint.set_compile_requests()
+        if self.fast_decode:
+            self.pullpoint.set_fast_decode()
+        self.subscription = self.camera.create_subscription_service()
+        self.http_timeout = None
+        self.subscriptions += 1
+        self.set_expires(response)
+
+    def set_expires(self, response):
+        self.expires = time.time() + remaining_seconds(response,
+                                                       self.termination)
+
+    def renew_params(self):
+        return {'TerminationTime': isoduration(self.termination)}
+
+    def renew(self):
+        '''Extends the subscription, subscribes again if Renew fails'''
+        try:
+            response = resolve_future(self.subscription.Renew(self.renew_params()))
+        except ONVIFError as err:
+            self.renew_failed(err)
+            self.unsubscribe()
+            self.subscribe()
+            return
+        self.renewed(response)
+
+    def renew_failed(self, err):
+        logger.warning('Renew failed on %s: %s, resubscribing',
+                       self.camera.host, err)
+
+    def renewed(self, response):
+        self.renewals += 1
+        self.set_expires(response)
+
+    def should_renew(self):
+        # Renew before a long poll could outlast the subscription
+        return time.time() + self.timeout + 1 >= self.expires
+
+    def ensure_subscription(self):
+        if self.pullpoint is None:
+            self.subscribe()
+        elif self.should_renew():
+            self.renew()
+
+    def pull_params(self, limit=None):
+        # The HTTP request has to outlast the long poll
+        http_timeout = self.timeout + 10
+        if self.http_timeout != http_timeout:
+            self.pullpoint.ws_client.set_options(timeout=http_timeout)
+            self.subscription.ws_client.set_options(timeout=http_timeout)
+            self.http_timeout = http_timeout
+
+        self.requested = self.message_limit if limit is None \
+                         else max(1, min(self.message_limit, limit))
+        return {'Timeout': isoduration(self.timeout),
+                'MessageLimit': self.requested}
+
+    def adapt(self, count):
+        if count >= self.requested:
+            self.message_limit = min(self.message_limit * 2, self.max_limit)
+        elif count < self.message_limit // 4:
+            self.message_limit = max(self.message_limit // 2, self.min_limit)
+
+        if count:
+            self.timeout = self.min_timeout
+        else:
+            self.timeout = min(self.timeout * 2, self.max_timeout)
+
+    def pulled(self, response):
+        '''Returns the notification messages of a PullMessages response'''
+        # Don't keep the last sent/received documents around
+        if self.pullpoint is not None:
+            self.pullpoint.ws_client.messages.update(tx=None, rx=None)
+        # Cameras usually extend the subscription on every pull
+        self.set_expires(response)
+        messages = field(response, 'NotificationMessage') or [ ]
+        self.pulls += 1
+        self.events += len(messages)
+        self.adapt(len(messages))
+        return messages
+
+    def pull_failed(self, err):
+        '''Unsubscribes at best, the next pull subscribes again'''
+        self.errors += 1
+        self.unsubscribe()
+        if not isinstance(err, ONVIFError):
+            err = ONVIFError(err)
+        raise err
+
+    def pull(self, limit=None):
+        '''
+        Runs a single PullMessages and returns its notification messages,
+        at most `limit` of them. Errors drop the subscription, the next
+        pull subscribes again.
+        '''
+        try:
+            self.ensure_subscription()
+            response = resolve_future(self.pullpoint.PullMessages(
+                    self.pull_params(limit)))
+        except Exception as err:
+            self.pull_failed(err)
+        return self.pulled(response)
+
+    def __iter__(self):
+        while not self.closed:
+            try:
+                messages = self.pull()
+            except ONVIFError as err:
+                if self.closed:
+                    return
+                logger.warning('Pulling events from %s failed: %s, '
+                               'retrying in %ss', self.camera.host, err,
+                               self.retry_delay)
+                time.sleep(self.retry_delay)
+                self.retry_delay = min(self.retry_delay * 2,
+                                       self.max_retry_delay)
+                continue
+            self.retry_delay = self.min_retry_delay
+            for message in messages:
+                yield message
+            messages = None
+
+    def drop_subscription(self):
+        '''Forgets the subscription, returns its service, None if none'''
+        subscription, self.subscription = self.subscription, None
+        self.pullpoint = None
+        if subscription is not None:
+            subscription.ws_client.set_options(timeout=UNSUBSCRIBE_TIMEOUT)
+        return subscription
+
+    def unsubscribe(self):
+        '''
+        Drops the subscription and unsubscribes, so that the camera
+        doesn't keep it until its termination time. Errors are logged.
+        '''
+        subscription = self.drop_subscription()
+        if subscription is None:
+            return
+        try:
+            resolve_future(subscription.Unsubscribe())
+        except ONVIFError as err:
+            logger.debug('Unsubscribe failed on %s: %s',
+                         self.camera.host, err)
+
+    def close(self):
+        '''Stops the iteration and unsubscribes'''
+        self.closed = True
+        self.unsubscribe()
+
+    def stats(self):
+        return {'events': self.events, 'pulls': self.pulls,
+                'renewals': self.renewals,
+                'subscriptions': self.subscriptions, 'errors': self.errors,
+                'message_limit': self.message_limit,
+                'timeout': self.timeout}
+
+
+class AsyncEventStream(EventStream):
+    '''
+    EventStream of an AsyncONVIFCamera: `subscribe`, `renew` and `pull`
+    return an AsyncResult instead of blocking, so that the event loop of
+    the camera can long-poll many cameras at once.
+
+    >>> from onvif.events import AsyncEventStream
+    >>> stream = AsyncEventStream(AsyncONVIFCamera('192.168.0.112', 80,
+    ...                                            'admin', '12345'))
+    >>> messages = stream.pull().result()
+    '''
+
+    def subscribe(self):
+        if self.camera.xaddrs is None:
+            pending = self.camera.update_xaddrs(subscribe=False)
+        else:
+            pending = AsyncResult(self.camera.loop)
+            pending.set_result(None)
+        return pending.then(lambda ret: self.camera.subscribe_pullpoint(
+                                                self.subscribe_params())) \
+                      .then(self.subscribed)
+
+    def renew(self):
+        def failed(err):
+            self.renew_failed(err)
+            self.unsubscribe()
+            return self.subscribe()
+
+        return self.subscription.Renew(self.renew_params()) \
+                   .then(self.renewed).catch(failed)
+
+    def ensure_subscription(self):
+        if self.pullpoint is None:
+            return self.subscribe()
+        elif self.should_renew():
+            return self.renew()
+        pending = AsyncResult(self.camera.loop)
+        pending.set_result(None)
+        return pending
+
+    def pull(self, limit=None):
+        '''Returns an AsyncResult of the messages of a single PullMessages'''
+        return self.ensure_subscription() \
+                   .then(lambda ret: self.pullpoint.PullMessages(
+                                            self.pull_params(limit))) \
+                   .then(self.pulled).catch(self.pull_failed)
+
+    def unsubscribe(self):
+        '''Drops the subscription, its Unsubscribe isn't waited for'''
+        subscription = self.drop_subscription()
+        if subscription is not None:
+            subscription.Unsubscribe().catch(lambda err: logger.debug(
+                    'Unsubscribe failed on %s: %s', self.camera.host, err))
+
+    def close(self):
+        '''Returns an AsyncResult of the Unsubscribe, None if not subscribed'''
+        self.closed = True
+        subscription = self.drop_subscription()
+        if subscription is not None:
+            return subscription.Unsubscribe()
+
+    def __iter__(self):
+        raise TypeError('AsyncEventStream is not iterable, use pull() '
+                        'or onvif.multiplexer.EventMultiplexer')
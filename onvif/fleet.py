@@ -0,0 +1,250 @@
+''' Concurrent operations across many ONVIF cameras '''
+
+import time
+import socket
+import struct
+from collections import namedtuple
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import logging
+logger = logging.getLogger('onvif')
+
+from onvif.exceptions import ONVIFError
+from onvif.client import ONVIFCamera
+from onvif.transport import ConnectionPool
+from onvif.store import device_key
+
+
+# Result of an operation on one device of the fleet, exactly one of
+# `result` and `error` is set. `elapsed` is in seconds.
+FleetResult = namedtuple('FleetResult', 'device result error elapsed')
+
+# Seconds between checks of the deadlines while operations are queued
+DEADLINE_POLL = 0.1
+
+
+class SubnetRateLimiter(object):
+    '''
+    Spaces calls to the devices of a same subnet, at most `rate` calls
+    per second per subnet. Devices are grouped by their IPv4 `prefix`
+    (/24 by default), hosts which aren't IPv4 addresses by host name.
+    '''
+
+    def __init__(self, rate, prefix=24):
+        self.interval = 1.0 / rate
+        self.mask = (0xffffffff << (32 - prefix)) & 0xffffffff
+        self.next_slot = { }
+        self.lock = Lock()
+
+    def subnet(self, host):
+        try:
+            addr, = struct.unpack('!I', socket.inet_aton(host))
+        except (socket.error, struct.error):
+            return host
+        return addr & self.mask
+
+    def wait(self, host):
+        subnet = self.subnet(host)
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot.get(subnet, now))
+            self.next_slot[subnet] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ONVIFFleet(object):
+    '''
+    Runs a service operation across a whole inventory of cameras.
+
+    One lazy ONVIFCamera is kept per device, so the WSDL documents are
+    parsed once for the whole fleet and devices are only contacted when
+    an operation runs. Results are yielded in completion order, errors
+    are captured per device instead of raised.
+
+    `inventory` items are dicts of ONVIFCamera arguments (host, port,
+    user, passwd, ...) or (host, port, user, passwd) tuples.
+
+    `timeout` is the deadline in seconds of the whole operation on a
+    device, counted from when it starts, and the socket timeout of its
+    requests. A device past it is reported with an ONVIFError, the late
+    result is dropped.
+
+    >>> from onvif.fleet import ONVIFFleet
+    >>> fleet = ONVIFFleet([('192.168.0.112', 80, 'admin', '12345'),
+    ...                     ('192.168.0.113', 80, 'admin', '12345')],
+    ...                    concurrency=64, timeout=5, rate=10)
+    >>> for ret in fleet.run('devicemgmt', 'GetSystemDateAndTime'):
+    ...     print ret.device, ret.error or ret.result.TimeZone
+    '''
+
+    def __init__(self, inventory, concurrency=32, timeout=10, rate=None,
+                 prefix=24, max_idle=1024, **kwargs):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.limiter = SubnetRateLimiter(rate, prefix) if rate else None
+        # Keep-alive connections of the fleet, bounded so that 10k
+        # devices don't hold 10k idle sockets
+        self.pool = ConnectionPool(maxsize=1, max_idle=max_idle)
+        self.camera_kwargs = kwargs
+        self.devices = { }
+        self.cameras = { }
+        self.lock = Lock()
+        for item in inventory:
+            self.add_device(item)
+
+    def add_device(self, item):
+        if not isinstance(item, dict):
+            item = dict(zip(('host', 'port', 'user', 'passwd'), item))
+        key = device_key(item['host'], item['port'])
+        with self.lock:
+            self.devices[key] = item
+            self.cameras.pop(key, None)
+        return key
+
+    def remove_device(self, key):
+        with self.lock:
+            self.devices.pop(key, None)
+            self.cameras.pop(key, None)
+
+    def get_camera(self, key):
+        '''Returns the ONVIFCamera of device `key`, created on first use'''
+        with self.lock:
+            camera = self.cameras.get(key)
+            if camera is not None:
+                return camera
+            kwargs = dict(self.camera_kwargs)
+            kwargs.update(self.devices[key])
+        kwargs.setdefault('lazy', True)
+        kwargs.setdefault('pool', self.pool)
+        kwargs.setdefault('timeout', self.timeout)
+        camera = ONVIFCamera(**kwargs)
+        with self.lock:
+            return self.cameras.setdefault(key, camera)
+
+    def apply(self, key, func, started=None):
+        '''
+        Runs `func(camera)` on device `key`, returns a FleetResult. The
+        time it starts, once granted a slot by the rate limiter, is set
+        in `started`.
+        '''
+        start = time.time()
+        try:
+            if self.limiter:
+                self.limiter.wait(self.devices[key]['host'])
+            start = time.time()
+            if started is not None:
+                started[key] = start
+            ret = func(self.get_camera(key))
+        except Exception as err:
+            if not isinstance(err, ONVIFError):
+                err = ONVIFError(err)
+            return FleetResult(key, None, err, time.time() - start)
+        return FleetResult(key, ret, None, time.time() - start)
+
+    @staticmethod
+    def operation_caller(service, operation, params=None):
+        '''Function running `service`.`operation` on a camera'''
+        def call_operation(camera):
+            onvif_service = camera.get_service(service)
+            ret = getattr(onvif_service, operation)(params)
+            # Don't keep the last sent/received documents of every device
+            onvif_service.ws_client.messages.update(tx=None, rx=None)
+            return ret
+        return call_operation
+
+    def call(self, key, service, operation, params=None):
+        '''Runs `operation` on device `key`, returns a FleetResult'''
+        return self.apply(key, self.operation_caller(service, operation,
+                                                     params))
+
+    def map(self, func, devices=None):
+        '''
+        Runs `func(camera)` on `devices` (default to all), yields a
+        FleetResult per device in completion order.
+        '''
+        if devices is None:
+            devices = self.devices.keys()
+        # key => time the operation on the device started, not counting
+        # the wait for the rate limiter
+        started = { }
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        pending = { }
+        try:
+            for key in devices:
+                pending[executor.submit(self.apply, key, func,
+                                        started)] = key
+            while pending:
+                done, _ = wait(pending, self.next_deadline(pending, started),
+                               FIRST_COMPLETED)
+                for future in done:
+                    del pending[future]
+                    yield future.result()
+                for ret in self.expired(pending, started):
+                    yield ret
+        finally:
+            # The consumer may stop early, don't start pending calls
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def next_deadline(self, pending, started):
+        '''Seconds to wait for the operations `pending`, None for ever'''
+        if self.timeout is None:
+            return None
+        starts = [ started[key] for key in pending.values()
+                   if key in started ]
+        timeout = min(starts) + self.timeout - time.time() if starts \
+                  else DEADLINE_POLL
+        if len(starts) < len(pending):
+            # Queued or rate limited operations start without waking
+            # the wait
+            timeout = min(timeout, DEADLINE_POLL)
+        return max(timeout, 0)
+
+    def expired(self, pending, started):
+        '''
+        Removes the operations of `pending` past the deadline, returns a
+        FleetResult of each
+        '''
+        if self.timeout is None:
+            return [ ]
+        now = time.time()
+        results = [ ]
+        for future, key in pending.items():
+            start = started.get(key)
+            if start is not None and now - start >= self.timeout:
+                del pending[future]
+                logger.warning('%s timed out after %ss', key, self.timeout)
+                results.append(FleetResult(key, None, ONVIFError(
+                        'Timed out after %ss' % self.timeout), now - start))
+        return results
+
+    def run(self, service, operation, params=None, devices=None):
+        '''
+        Runs `service`.`operation` on `devices` (default to all), yields
+        a FleetResult per device in completion order.
+        '''
+        return self.map(self.operation_caller(service, operation, params),
+                        devices)
+
+    def resolve_stream_uris(self, devices=None, **kwargs):
+        '''
+        Yields a FleetResult per device, whose result is the list of
+        StreamRecord of `ONVIFCamera.resolve_stream_uris`, called with
+        `kwargs`. Pass a `response_cache` to the fleet for repeated
+        imports to be answered from it.
+
+        >>> fleet = ONVIFFleet(inventory, concurrency=64, response_cache=cache)
+        >>> for ret in fleet.resolve_stream_uris(concurrency=2):
+        ...     for record in ret.result or [ ]:
+        ...         print ret.device, record.token, record.stream_uri
+        '''
+        return self.map(lambda camera: camera.resolve_stream_uris(**kwargs),
+                        devices)
+
+    def stats(self):
+        return {'devices': len(self.devices), 'cameras': len(self.cameras),
+                'pool': self.pool.stats()}
@@ -0,0 +1,75 @@
+''' Latency histograms '''
+
+from threading import Lock
+
+# Upper bounds in seconds of the default buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    '''
+    Fixed-bucket histogram of durations in seconds. The counts are kept
+    per bucket, percentiles are the upper bound of the bucket they fall
+    in, which is accurate enough to watch latencies and cheap to update.
+
+    >>> latency = Histogram()
+    >>> latency.observe(0.012)
+    >>> latency.observe(0.030)
+    >>> latency.percentile(50)
+    0.025
+    '''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # The last count is for the values above the last bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = Lock()
+
+    def observe(self, value):
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, percent):
+        '''Upper bound of the bucket of the `percent` percentile, None if empty'''
+        with self.lock:
+            if not self.count:
+                return None
+            rank = self.count * percent / 100.0
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank and count:
+                    if index < len(self.buckets):
+                        return min(self.buckets[index], self.max)
+                    return self.max
+            return self.max
+
+    def cumulative(self):
+        '''[(upper bound, count of the values <= bound)], bound None for +Inf'''
+        with self.lock:
+            counts = list(self.counts)
+        ret = [ ]
+        seen = 0
+        for bound, count in zip(self.buckets + (None,), counts):
+            seen += count
+            ret.append((bound, seen))
+        return ret
+
+    def stats(self):
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'mean': self.sum / self.count if self.count else None,
+                'p50': self.percentile(50), 'p95': self.percentile(95),
+                'p99': self.percentile(99)}
@@ -0,0 +1,211 @@
+''' Per operation latency, payload and error metrics '''
+
+from threading import Lock, Thread
+from collections import namedtuple
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from onvif.histogram import Histogram, BUCKETS
+
+# An operation called on a service, reported to the `metrics` of the
+# service. Durations are in seconds, sizes in characters of the
+# envelopes. `serialize` is the time to build the request, `network`
+# the round trip, `parse` the time to decode the reply; they are None
+# when no request was sent (e.g. reply from a ResponseCache). `error`
+# is the class name of the exception raised, None on success.
+CallSample = namedtuple('CallSample',
+                        'device service operation duration serialize '
+                        'network parse request_size reply_size error')
+
+PHASES = ('serialize', 'network', 'parse')
+
+# Upper bounds in characters of the payload size buckets
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class OperationSeries(object):
+    '''Metrics of an operation of a service of a device'''
+
+    def __init__(self, buckets, size_buckets):
+        self.duration = Histogram(buckets)
+        self.phases = dict((phase, Histogram(buckets)) for phase in PHASES)
+        self.request_size = Histogram(size_buckets)
+        self.reply_size = Histogram(size_buckets)
+        # Exception class name => count
+        self.errors = { }
+
+    def record(self, sample):
+        self.duration.observe(sample.duration)
+        for phase in PHASES:
+            value = getattr(sample, phase)
+            if value is not None:
+                self.phases[phase].observe(value)
+        if sample.request_size is not None:
+            self.request_size.observe(sample.request_size)
+        if sample.reply_size is not None:
+            self.reply_size.observe(sample.reply_size)
+
+    def stats(self):
+        ret = self.duration.stats()
+        for phase in PHASES:
+            ret[phase] = self.phases[phase].stats()
+        ret['request_size'] = self.request_size.stats()
+        ret['reply_size'] = self.reply_size.stats()
+        ret['errors'] = dict(self.errors)
+        return ret
+
+
+class OperationMetrics(object):
+    '''
+    In-process aggregation of the CallSamples of many services, per
+    (device, service, operation): histograms of the durations, of their
+    serialize, network and parse phases and of the payload sizes, and
+    error counts per exception class. Thread-safe, one instance can be
+    shared by a whole fleet.
+
+    >>> metrics = OperationMetrics()
+    >>> mycam = ONVIFCamera(..., metrics=metrics)
+    >>> mycam.devicemgmt.GetHostname()
+    >>> metrics.stats()[('192.168.0.112:80', 'devicemgmt', 'GetHostname')]
+    >>> print metrics.prometheus()
+    '''
+
+    def __init__(self, buckets=BUCKETS, size_buckets=SIZE_BUCKETS):
+        self.buckets = buckets
+        self.size_buckets = size_buckets
+        # (device, service, operation) => OperationSeries
+        self.series = { }
+        self.lock = Lock()
+
+    def record(self, sample):
+        key = (sample.device, sample.service, sample.operation)
+        series = self.series.get(key)
+        if series is None:
+            with self.lock:
+                series = self.series.setdefault(key,
+                        OperationSeries(self.buckets, self.size_buckets))
+        series.record(sample)
+        if sample.error is not None:
+            with self.lock:
+                series.errors[sample.error] = \
+                        series.errors.get(sample.error, 0) + 1
+
+    def stats(self):
+        '''{(device, service, operation): stats}'''
+        with self.lock:
+            series = self.series.items()
+        return dict((key, value.stats()) for key, value in series)
+
+    def slowest(self, count=10, percent=95):
+        '''The `count` (key, percentile) with the highest durations'''
+        with self.lock:
+            series = self.series.items()
+        ranked = [ (key, value.duration.percentile(percent))
+                   for key, value in series ]
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked[:count]
+
+    def clear(self):
+        with self.lock:
+            self.series = { }
+
+    def prometheus(self, prefix='onvif'):
+        '''The metrics in the Prometheus text exposition format'''
+        with self.lock:
+            series = sorted(self.series.items())
+        lines = [ ]
+        def histograms(name, help, values):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help))
+            lines.append('# TYPE %s_%s histogram' % (prefix, name))
+            for label_text, histogram in values:
+                write_histogram(lines, '%s_%s' % (prefix, name), label_text,
+                                histogram)
+
+        histograms('request_duration_seconds',
+                   'Duration of the operations.',
+                   [ (labels(key), value.duration)
+                     for key, value in series ])
+        histograms('request_phase_seconds',
+                   'Duration of the serialize, network and parse phases.',
+                   [ (labels(key, phase=phase), value.phases[phase])
+                     for key, value in series for phase in PHASES ])
+        histograms('request_size_chars',
+                   'Size of the request envelopes.',
+                   [ (labels(key), value.request_size)
+                     for key, value in series ])
+        histograms('reply_size_chars',
+                   'Size of the reply envelopes.',
+                   [ (labels(key), value.reply_size)
+                     for key, value in series ])
+
+        name = '%s_request_errors_total' % prefix
+        lines.append('# HELP %s Failed operations, per error class.' % name)
+        lines.append('# TYPE %s counter' % name)
+        for key, value in series:
+            for error, count in sorted(value.errors.items()):
+                lines.append('%s{%s} %d' % (name, labels(key, error=error),
+                                            count))
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return unicode(value).replace('\\', r'\\').replace('"', r'\"') \
+                         .replace('\n', r'\n')
+
+def labels(key, **extra):
+    pairs = zip(('device', 'service', 'operation'), key) + \
+            sorted(extra.items())
+    return ','.join('%s="%s"' % (name, escape_label(value))
+                    for name, value in pairs)
+
+def write_histogram(lines, name, label_text, histogram):
+    for bound, count in histogram.cumulative():
+        le = '+Inf' if bound is None else repr(bound)
+        lines.append('%s_bucket{%s,le="%s"} %d' % (name, label_text, le,
+                                                    count))
+    lines.append('%s_sum{%s} %r' % (name, label_text, histogram.sum))
+    lines.append('%s_count{%s} %d' % (name, label_text, histogram.count))
+
+
+class ExporterServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ExporterHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = self.server.metrics.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PrometheusExporter(object):
+    '''
+    Serves the `prometheus` text of OperationMetrics over HTTP, from a
+    daemon thread.
+
+    >>> exporter = PrometheusExporter(metrics, port=9465).start()
+    '''
+
+    def __init__(self, metrics, port=9465, host=''):
+        self.server = ExporterServer((host, port), ExporterHandler)
+        self.server.metrics = metrics
+        self.port = self.server.server_address[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
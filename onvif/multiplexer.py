@@ -0,0 +1,271 @@
+''' Event ingestion from many cameras into a single queue '''
+
+import math
+import time
+import calendar
+import datetime as dt
+from Queue import Empty
+from collections import deque
+from threading import Condition, Lock, Thread
+
+import logging
+logger = logging.getLogger('onvif')
+
+from onvif.exceptions import ONVIFError
+from onvif.asyncclient import AsyncLoop, AsyncONVIFCamera
+from onvif.events import AsyncEventStream
+from onvif.store import device_key
+from onvif.decode import field
+
+# Time constant in seconds of the events/s moving average
+RATE_WINDOW = 10.0
+
+
+def message_time(message):
+    '''Seconds since the epoch of the UtcTime of a notification message'''
+    utc = field(field(field(message, 'Message'), 'Message'), '_UtcTime')
+    if utc is None:
+        return None
+    if isinstance(utc, dt.datetime):
+        return calendar.timegm(utc.timetuple())
+    try:
+        return calendar.timegm(time.strptime(str(utc)[:19],
+                                             '%Y-%m-%dT%H:%M:%S'))
+    except ValueError:
+        return None
+
+
+def async_camera(camera, loop):
+    '''AsyncONVIFCamera of the device of `camera`, sharing its discovery'''
+    twin = AsyncONVIFCamera(camera.host, camera.port, camera.user,
+                            camera.passwd, wsdl_dir=camera.wsdl_dir,
+                            encrypt=camera.encrypt, no_cache=camera.no_cache,
+                            adjust_time=camera.adjust_time, loop=loop)
+    if camera.xaddrs is not None:
+        twin.xaddrs = dict(camera.xaddrs)
+        twin.dt_diff = camera.dt_diff
+    return twin
+
+
+class CameraState(object):
+    '''Scheduling state and counters of a camera of an EventMultiplexer'''
+
+    def __init__(self, key, stream):
+        self.key = key
+        self.stream = stream
+        # AsyncResult of the running PullMessages
+        self.pending = None
+        self.next_pull = 0
+        self.queued = 0
+        self.events = 0
+        self.dropped = 0
+        self.throttled = 0
+        self.rate = 0.0
+        self.rate_time = time.time()
+        self.lag = None
+
+    def update_rate(self, count, now):
+        decay = math.exp(-(now - self.rate_time) / RATE_WINDOW)
+        self.rate = self.rate * decay + count / RATE_WINDOW
+        self.rate_time = now
+
+    def stats(self, now):
+        stats = {'events': self.events, 'queued': self.queued,
+                 'dropped': self.dropped, 'throttled': self.throttled,
+                 'events_per_sec': self.rate * math.exp(
+                         -(now - self.rate_time) / RATE_WINDOW),
+                 'lag': self.lag}
+        stats.update(self.stream.stats())
+        return stats
+
+
+class EventMultiplexer(object):
+    '''
+    Long-polls the pull points of many cameras from a single thread and
+    feeds their notification messages into one bounded queue.
+
+    Every camera has at most one PullMessages in flight, all of them
+    multiplexed on an AsyncLoop. A camera is only polled when the queue
+    has room for its batch and the camera holds less than its share of
+    the queue, `quota` messages (default to an even share of `maxsize`),
+    so a chatty camera can't starve the others. Events the consumer
+    doesn't keep up with wait on the cameras, the queue doesn't drop
+    them unless a camera answers with more messages than asked for.
+
+    ONVIFCamera instances, and AsyncONVIFCamera instances of another
+    loop, are polled through an AsyncONVIFCamera of the same device on
+    the loop of the multiplexer. Other keyword arguments are passed to the
+    AsyncEventStream of every camera.
+
+    >>> from onvif.multiplexer import EventMultiplexer
+    >>> mux = EventMultiplexer([cam1, cam2, cam3], maxsize=5000).start()
+    >>> for key, message in mux:
+    ...     print key, message.Topic.value
+    >>> mux.stats()['cameras']['192.168.0.112:80']['lag']
+    >>> mux.stop()
+    '''
+
+    def __init__(self, cameras=(), maxsize=10000, quota=None, loop=None,
+                 **kwargs):
+        self.loop = loop or AsyncLoop()
+        self.maxsize = maxsize
+        self.quota = quota
+        self.stream_kwargs = kwargs
+        self.items = deque()
+        self.condition = Condition()
+        self.cameras = { }
+        self.lock = Lock()
+        self.thread = None
+        self.running = False
+        for camera in cameras:
+            self.add_camera(camera)
+
+    def add_camera(self, camera, key=None):
+        if not isinstance(camera, AsyncONVIFCamera) or \
+           camera.loop is not self.loop:
+            camera = async_camera(camera, self.loop)
+        key = key or device_key(camera.host, camera.port)
+        stream = AsyncEventStream(camera, **self.stream_kwargs)
+        with self.lock:
+            self.cameras[key] = CameraState(key, stream)
+        return key
+
+    def remove_camera(self, key):
+        with self.lock:
+            state = self.cameras.pop(key, None)
+        if state is not None:
+            state.stream.close()
+
+    def camera_quota(self):
+        if self.quota:
+            return self.quota
+        return max(1, self.maxsize // max(1, len(self.cameras)))
+
+    def schedule(self):
+        '''Starts a PullMessages on every idle camera the queue has room for'''
+        now = time.time()
+        quota = self.camera_quota()
+        with self.lock:
+            states = self.cameras.values()
+        for state in states:
+            if state.pending is not None or state.next_pull > now:
+                continue
+            with self.condition:
+                room = min(self.maxsize - len(self.items),
+                           quota - state.queued)
+            if room <= 0:
+                state.throttled += 1
+                continue
+            state.pending = state.stream.pull(room)
+            state.pending.add_done_callback(
+                    lambda pending, state=state: self.pulled(state, pending))
+
+    def pulled(self, state, pending):
+        state.pending = None
+        stream = state.stream
+        err = pending.exception()
+        if err is not None:
+            logger.warning('Pulling events from %s failed: %s, retrying in %ss',
+                           state.key, err, stream.retry_delay)
+            state.next_pull = time.time() + stream.retry_delay
+            stream.retry_delay = min(stream.retry_delay * 2,
+                                     stream.max_retry_delay)
+            return
+        stream.retry_delay = stream.min_retry_delay
+        self.put(state, pending.result())
+
+    def put(self, state, messages):
+        now = time.time()
+        with self.condition:
+            room = self.maxsize - len(self.items)
+            if len(messages) > room:
+                state.dropped += len(messages) - room
+                messages = messages[:room]
+            for message in messages:
+                self.items.append((state, message))
+            state.queued += len(messages)
+            if messages:
+                self.condition.notify_all()
+        state.events += len(messages)
+        state.update_rate(len(messages), now)
+        if messages:
+            sent = message_time(messages[-1])
+            if sent is not None:
+                dt_diff = state.stream.camera.dt_diff
+                if dt_diff is not None:
+                    # Camera clock to local clock
+                    sent -= dt_diff.days * 86400 + dt_diff.seconds
+                state.lag = max(0, now - sent)
+
+    def get(self, block=True, timeout=None):
+        '''
+        Returns the next (camera key, notification message), raises
+        Queue.Empty if none is available within `timeout` seconds.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while not self.items:
+                if not block:
+                    raise Empty
+                remaining = None if deadline is None \
+                            else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise Empty
+                self.condition.wait(remaining)
+            state, message = self.items.popleft()
+            state.queued -= 1
+        return state.key, message
+
+    def __iter__(self):
+        while self.running or self.items:
+            try:
+                yield self.get(timeout=0.5)
+            except Empty:
+                continue
+
+    def poll(self, timeout=0.1):
+        '''Schedules the pulls and runs the loop once'''
+        self.schedule()
+        self.loop.poll(timeout)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Event multiplexer error')
+
+    def start(self):
+        '''Runs the multiplexer in a daemon thread'''
+        self.running = True
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        '''Stops polling and unsubscribes from all cameras'''
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            states = self.cameras.values()
+        pendings = [ pending for pending in
+                     (state.stream.close() for state in states)
+                     if pending is not None ]
+        try:
+            self.loop.gather(pendings).result(timeout)
+        except ONVIFError as err:
+            logger.debug('Unsubscribing failed: %s', err)
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            states = self.cameras.values()
+        cameras = dict([ (state.key, state.stats(now)) for state in states ])
+        return {'queued': len(self.items),
+                'events': sum([ s['events'] for s in cameras.values() ]),
+                'dropped': sum([ s['dropped'] for s in cameras.values() ]),
+                'cameras': cameras}
@@ -0,0 +1,225 @@
+''' Low-latency continuous PTZ control '''
+
+import time
+from threading import Condition, Thread
+
+import logging
+logger = logging.getLogger('onvif')
+
+from onvif.exceptions import ONVIFError
+from onvif.client import ONVIFService
+from onvif.transport import KeepAliveTransport, ConnectionPool
+from onvif.histogram import Histogram
+from onvif.store import device_key
+
+
+class PTZController(object):
+    '''
+    Continuous PTZ moves driven by a joystick, or anything else updating
+    the velocity faster than the camera answers.
+
+    The requests are sent by a worker thread over a persistent connection
+    of their own. `move` only records the velocity: while a ContinuousMove
+    is in flight, later updates replace each other and only the latest is
+    sent next, the camera never lags behind a backlog of stale velocities.
+    A Stop is never coalesced away: it is sent before any later move and
+    retried until the camera acknowledges it.
+
+    >>> from onvif.ptz import PTZController
+    >>> ptz = PTZController(mycam, media_profile._token)
+    >>> ptz.move(0.5, 0)
+    >>> ptz.move(0.8, -0.2)
+    >>> ptz.stop(wait=True)
+    >>> ptz.stats()['latency']['p95']
+    >>> ptz.close()
+
+    The latency histograms are the round trips of the ContinuousMove and
+    Stop requests, and `latency`, the time from an update to the reply to
+    the request that carried it.
+    '''
+
+    def __init__(self, camera, profile_token, timeout=5,
+                 stop_retry_delay=0.1, close_stop_retries=3):
+        xaddr, wsdl = camera.get_definition('ptz')
+        # A connection kept for the controller, not shared with the
+        # other requests to the camera
+        self.pool = ConnectionPool(maxsize=1)
+        self.ptz = ONVIFService(xaddr, camera.user, camera.passwd, wsdl,
+                                camera.cache_location, camera.cache_duration,
+                                camera.encrypt, no_cache=camera.no_cache,
+                                dt_diff=camera.dt_diff,
+                                transport=KeepAliveTransport(self.pool),
+                                compile_requests=True, metrics=camera.metrics)
+        self.ptz.device = device_key(camera.host, camera.port)
+        self.ptz.ws_client.set_options(timeout=timeout)
+        self.profile_token = profile_token
+        self.stop_retry_delay = stop_retry_delay
+        self.close_stop_retries = close_stop_retries
+
+        # Built once, only the velocity changes between requests
+        self.request = self.ptz.create_type('ContinuousMove')
+        self.request.ProfileToken = profile_token
+        self.stop_request = {'ProfileToken': profile_token,
+                             'PanTilt': True, 'Zoom': True}
+
+        self.condition = Condition()
+        # Latest velocity not sent yet, and time of the oldest update
+        # it replaced
+        self.velocity = None
+        self.velocity_time = None
+        # Stops requested and acknowledged
+        self.stop_requested = 0
+        self.stop_acked = 0
+        self.stop_time = None
+        self.closed = False
+
+        self.updates = 0
+        self.coalesced = 0
+        self.moves = 0
+        self.stops = 0
+        self.errors = 0
+        self.stop_failures = 0
+        self.latency = Histogram()
+        self.move_rtt = Histogram()
+        self.stop_rtt = Histogram()
+
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def move(self, x, y, zoom=None):
+        '''Sets the pan/tilt (and zoom) velocity, returns immediately'''
+        if self.closed:
+            raise ONVIFError('PTZ controller closed')
+        with self.condition:
+            self.updates += 1
+            if self.velocity is None:
+                self.velocity_time = time.time()
+            else:
+                self.coalesced += 1
+            self.velocity = (x, y, zoom)
+            self.condition.notify()
+
+    def stop(self, wait=False, timeout=None):
+        '''
+        Stops pan, tilt and zoom, cancelling the velocity not sent yet.
+        With `wait`, returns whether the camera acknowledged the Stop
+        within `timeout` seconds.
+        '''
+        with self.condition:
+            if self.velocity is not None:
+                self.coalesced += 1
+                self.velocity = None
+            self.stop_requested += 1
+            if self.stop_time is None:
+                self.stop_time = time.time()
+            requested = self.stop_requested
+            self.condition.notify()
+            if not wait:
+                return None
+            deadline = None if timeout is None else time.time() + timeout
+            while self.stop_acked < requested:
+                remaining = None if deadline is None \
+                            else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            return True
+
+    def send_move(self, velocity):
+        x, y, zoom = velocity
+        speed = self.request.Velocity
+        speed.PanTilt._x = x
+        speed.PanTilt._y = y
+        if zoom is None:
+            speed.Zoom = None
+        else:
+            if speed.Zoom is None:
+                speed.Zoom = self.ptz.create_type('Vector1D')
+            speed.Zoom._x = zoom
+        start = time.time()
+        self.ptz.ContinuousMove(self.request)
+        self.move_rtt.observe(time.time() - start)
+
+    def send_stop(self):
+        start = time.time()
+        self.ptz.Stop(self.stop_request)
+        self.stop_rtt.observe(time.time() - start)
+
+    def next_command(self):
+        '''
+        Waits for the next command, ('stop', stops requested, time) or
+        ('move', velocity, time), the time being of the oldest update.
+        '''
+        with self.condition:
+            while True:
+                if self.stop_acked < self.stop_requested:
+                    return 'stop', self.stop_requested, self.stop_time
+                if self.velocity is not None:
+                    velocity, since = self.velocity, self.velocity_time
+                    self.velocity = self.velocity_time = None
+                    return 'move', velocity, since
+                if self.closed:
+                    return None, None, None
+                self.condition.wait()
+
+    def run(self):
+        failures = 0
+        while True:
+            command, arg, since = self.next_command()
+            if command is None:
+                return
+            if command == 'move':
+                try:
+                    self.send_move(arg)
+                except ONVIFError as err:
+                    # Not retried, a newer velocity is likely on its way
+                    self.errors += 1
+                    logger.warning('PTZ ContinuousMove failed: %s', err)
+                    continue
+                self.moves += 1
+                self.latency.observe(time.time() - since)
+                continue
+
+            try:
+                self.send_stop()
+            except ONVIFError as err:
+                self.stop_failures += 1
+                failures += 1
+                logger.warning('PTZ Stop failed: %s, retrying', err)
+                if self.closed and failures >= self.close_stop_retries:
+                    logger.error('PTZ Stop failed %d times, giving up',
+                                 failures)
+                    with self.condition:
+                        self.stop_acked = arg
+                        self.condition.notify_all()
+                    return
+                time.sleep(self.stop_retry_delay)
+                continue
+            failures = 0
+            self.stops += 1
+            self.latency.observe(time.time() - since)
+            with self.condition:
+                self.stop_acked = arg
+                if self.stop_acked == self.stop_requested:
+                    self.stop_time = None
+                self.condition.notify_all()
+
+    def close(self, stop=True, timeout=None):
+        '''Stops the camera unless `stop` is False, and the worker thread'''
+        if stop:
+            self.stop()
+        with self.condition:
+            self.closed = True
+            self.velocity = None
+            self.condition.notify_all()
+        self.thread.join(timeout)
+        self.pool.close()
+
+    def stats(self):
+        return {'updates': self.updates, 'coalesced': self.coalesced,
+                'moves': self.moves, 'stops': self.stops,
+                'errors': self.errors, 'stop_failures': self.stop_failures,
+                'latency': self.latency.stats(),
+                'move_rtt': self.move_rtt.stats(),
+                'stop_rtt': self.stop_rtt.stats()}
@@ -0,0 +1,217 @@
+''' Incremental mirror of the recordings of an NVR '''
+
+import json
+import time
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+logger = logging.getLogger('onvif')
+
+from onvif.decode import field
+from onvif.serialize import to_dict
+from onvif.search import resolve
+
+# A change of the recordings of a device. `kind` is 'added', 'modified'
+# or 'removed', `track` the token of the track, None for the recording
+# itself. `information` is the RecordingInformation or TrackInformation
+# found by the search, `configuration` the RecordingConfiguration or
+# TrackConfiguration, only fetched when added or when the configuration
+# changed. Both are None for removals.
+RecordingChange = namedtuple('RecordingChange',
+                             'kind recording track information configuration')
+
+# Fields of the RecordingInformation and TrackInformation which tell a
+# changed configuration, and the ones which move with the recorded data
+RECORDING_FIELDS = ('Source', 'Content')
+RECORDING_DATA_FIELDS = ('EarliestRecording', 'LatestRecording',
+                         'RecordingStatus')
+TRACK_FIELDS = ('TrackType', 'Description')
+TRACK_DATA_FIELDS = ('DataFrom', 'DataTo')
+
+
+def fingerprint(obj, names):
+    '''Short digest of the fields `names` of `obj`'''
+    values = [ to_dict(field(obj, name)) for name in names ]
+    return hashlib.sha1(json.dumps(values, sort_keys=True,
+                                   default=unicode)).hexdigest()[:16]
+
+def as_list(value):
+    if value is None:
+        return [ ]
+    return value if isinstance(value, list) else [ value ]
+
+
+class RecordingSync(object):
+    '''
+    Mirrors the recordings and tracks of a device with the recording and
+    search services, reporting only what changed since the last cycle.
+
+    A cycle costs a GetRecordingSummary while the summary (number of
+    recordings, range of the recorded data) stays the same, for at most
+    `full_interval` seconds: configuration changes don't show in the
+    summary. Otherwise the RecordingInformation of all recordings are
+    searched, and
+    compared to their fingerprints: one for the configuration fields of
+    a recording or track, one for its data range. Configurations are
+    only fetched for the added recordings and tracks, and the ones whose
+    configuration fingerprint changed, with at most `concurrency`
+    requests at a time.
+
+    `state` holds the fingerprints, a dict of JSON values to be saved
+    between runs: a restarted sync only reports the changes since.
+
+    >>> sync = RecordingSync(nvr, state=json.load(open('nvr.json')))
+    >>> for change in sync.sync():
+    ...     print change.kind, change.recording, change.track
+    >>> json.dump(sync.state, open('nvr.json', 'w'))
+    '''
+
+    def __init__(self, camera, state=None, concurrency=4, full_interval=600,
+                 **search_kwargs):
+        self.camera = camera
+        self.state = state if state is not None else { }
+        self.state.setdefault('recordings', { })
+        self.concurrency = concurrency
+        self.full_interval = full_interval
+        self.last_search = time.time()
+        # Passed to `paged_search`, e.g. a bigger `batch`
+        self.search_kwargs = search_kwargs
+        self.cycles = 0
+        self.searches = 0
+        self.fetched = 0
+
+    def summary(self):
+        search = self.camera.get_service('search')
+        summary = resolve(search.GetRecordingSummary())
+        return fingerprint(summary, ('DataFrom', 'DataUntil',
+                                     'NumberRecordings'))
+
+    def sync(self, force=False):
+        '''
+        Returns the RecordingChanges since the last cycle, and records
+        the new fingerprints. The changes of a recording whose
+        configurations couldn't be fetched are left to the next cycle.
+        '''
+        self.cycles += 1
+        summary = self.summary()
+        if summary == self.state.get('summary') and not force and \
+           time.time() - self.last_search < self.full_interval:
+            return [ ]
+
+        self.searches += 1
+        self.last_search = time.time()
+        recordings = self.state['recordings']
+        found = { }
+        changes = [ ]
+        fetches = [ ]
+        for info in self.camera.find_recordings({'Scope': { }},
+                                                **self.search_kwargs):
+            token = field(info, 'RecordingToken')
+            record = {'config': fingerprint(info, RECORDING_FIELDS),
+                      'data': fingerprint(info, RECORDING_DATA_FIELDS),
+                      'tracks': { }}
+            found[token] = record
+            old = recordings.get(token)
+            if old is None:
+                fetches.append(('added', token, None, info))
+            elif old['config'] != record['config']:
+                fetches.append(('modified', token, None, info))
+            elif old['data'] != record['data']:
+                changes.append(RecordingChange('modified', token, None,
+                                               info, None))
+
+            old_tracks = old['tracks'] if old else { }
+            for track in as_list(field(info, 'Track')):
+                track_token = field(track, 'TrackToken')
+                track_record = {'config': fingerprint(track, TRACK_FIELDS),
+                                'data': fingerprint(track, TRACK_DATA_FIELDS)}
+                record['tracks'][track_token] = track_record
+                old_track = old_tracks.get(track_token)
+                if old_track is None:
+                    fetches.append(('added', token, track_token, track))
+                elif old_track['config'] != track_record['config']:
+                    fetches.append(('modified', token, track_token, track))
+                elif old_track['data'] != track_record['data']:
+                    changes.append(RecordingChange('modified', token,
+                                                   track_token, track, None))
+            for track_token in old_tracks:
+                if track_token not in record['tracks']:
+                    changes.append(RecordingChange('removed', token,
+                                                   track_token, None, None))
+
+        failed = self.fetch(fetches, changes)
+        # Reported with the next cycle, with their fingerprints
+        changes = [ change for change in changes
+                    if change.recording not in failed ]
+        for token in recordings.keys():
+            if token not in found:
+                changes.append(RecordingChange('removed', token, None,
+                                               None, None))
+                del recordings[token]
+        for token, record in found.iteritems():
+            if token not in failed:
+                recordings[token] = record
+        if not failed:
+            self.state['summary'] = summary
+        return changes
+
+    def fetch(self, fetches, changes):
+        '''
+        Appends the changes of `fetches` with their configuration to
+        `changes`, returns the tokens of the recordings which failed
+        '''
+        if not fetches:
+            return set()
+        recording = self.camera.get_service('recording')
+
+        def get_configuration(request):
+            kind, token, track, info = request
+            if track is None:
+                return recording.GetRecordingConfiguration(
+                        {'RecordingToken': token})
+            return recording.GetTrackConfiguration(
+                    {'RecordingToken': token, 'TrackToken': track})
+
+        failed = set()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            futures = [ executor.submit(get_configuration, request)
+                        for request in fetches ]
+            for (kind, token, track, info), future in zip(fetches, futures):
+                try:
+                    configuration = resolve(future.result())
+                except Exception as err:
+                    logger.warning('Configuration of recording %s %s '
+                                   'failed: %s', token, track or '', err)
+                    failed.add(token)
+                    continue
+                self.fetched += 1
+                changes.append(RecordingChange(kind, token, track, info,
+                                               configuration))
+        finally:
+            executor.shutdown(wait=False)
+        return failed
+
+    def watch(self, interval=60):
+        '''
+        Generator of the RecordingChanges, syncing every `interval`
+        seconds. Failed cycles are logged and retried.
+        '''
+        while True:
+            start = time.time()
+            try:
+                changes = self.sync()
+            except Exception as err:
+                logger.warning('Recording sync of %s:%s failed: %s',
+                               self.camera.host, self.camera.port, err)
+                changes = [ ]
+            for change in changes:
+                yield change
+            time.sleep(max(0, interval - (time.time() - start)))
+
+    def stats(self):
+        return {'cycles': self.cycles, 'searches': self.searches,
+                'fetched': self.fetched,
+                'recordings': len(self.state['recordings'])}
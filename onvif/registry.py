@@ -0,0 +1,189 @@
+''' Process-wide registry of parsed WSDL documents '''
+
+import os.path
+import copy
+import urlparse
+import urllib
+from threading import RLock
+
+import logging
+logger = logging.getLogger('onvif')
+
+from suds import WebFault
+from suds.client import Client, SoapClient
+from suds.bindings.multiref import MultiRef
+
+from onvif.bundle import WSDLBundle, PreloadedCache, BUNDLE_NAME
+
+
+def call_binding(binding, options):
+    '''
+    Copy of the `binding` of a parsed WSDL for one call, reading
+    `options` and processing the reply with a MultiRef of its own.
+
+    The bindings are parsed with the WSDL, hence shared by all its
+    clients: they read the options (wsse, soapheaders, ...) of the
+    client which parsed it, and concurrent replies would swap their
+    bodies through their MultiRef.
+    '''
+    bound = copy.copy(binding)
+    bound.options = lambda: options
+    bound.multiref = MultiRef()
+    return bound
+
+
+class ServiceSoapClient(SoapClient):
+    '''
+    SoapClient building the request and processing the reply with
+    copies of the bindings of the method, see `call_binding`
+    '''
+
+    def __init__(self, client, method):
+        SoapClient.__init__(self, client, method)
+        self.binding = call_binding(method.binding.input, client.options)
+
+    def invoke(self, args, kwargs):
+        soapenv = self.binding.get_message(self.method, args, kwargs)
+        if self.options.faults:
+            return self.send(soapenv)
+        try:
+            return self.send(soapenv)
+        except WebFault as err:
+            # As suds does without faults
+            return (500, err)
+
+    def succeeded(self, binding, reply):
+        return SoapClient.succeeded(self, self.binding, reply)
+
+    def failed(self, binding, error):
+        return SoapClient.failed(self, self.binding, error)
+
+
+class WSDLRegistry(object):
+    '''
+    Thread-safe registry of parsed suds clients shared by all
+    ONVIFService instances of the process.
+
+    Parsing a WSDL document (and the schemas it imports) is by far the
+    most expensive part of creating a service. The registry parses each
+    (wsdl path, portType, mtime) combination once and hands out cheap
+    clones that only share the parsed WSDL, so every service still owns
+    its options (location, wsse, ...).
+
+    If the WSDL directory holds a valid precompiled bundle (see
+    `onvif.compile_wsdl`), documents are loaded from it instead of parsed.
+
+    >>> from onvif.registry import wsdl_registry
+    >>> wsdl_registry.stats()
+    {'hits': 12, 'misses': 2, 'size': 2}
+    '''
+
+    def __init__(self):
+        self.templates = { }
+        self.hits = 0
+        self.misses = 0
+        self.lock = RLock()
+        # Per-key locks, so that two threads asking for the same WSDL
+        # parse it only once, while different WSDLs are parsed in parallel.
+        self.key_locks = { }
+        # WSDL directory => WSDLBundle, None if it has no (valid) bundle
+        self.bundles = { }
+
+    @staticmethod
+    def make_key(path, portType=None):
+        path = os.path.abspath(path)
+        return path, portType, os.path.getmtime(path)
+
+    def _key_lock(self, key):
+        with self.lock:
+            lock = self.key_locks.get(key)
+            if lock is None:
+                lock = self.key_locks[key] = RLock()
+            return lock
+
+    def load_bundle(self, path, wsdl_dir=None):
+        '''
+        Use the bundle at `path` for the documents of `wsdl_dir`
+        (default to the directory of the bundle).
+        '''
+        wsdl_dir = os.path.abspath(wsdl_dir or os.path.dirname(path))
+        bundle = WSDLBundle(path)
+        if not bundle.is_valid(wsdl_dir):
+            bundle.close()
+            raise ValueError('Bundle %s is outdated, rebuild it with '
+                             '`python -m onvif.compile_wsdl`' % path)
+        with self.lock:
+            self.bundles[wsdl_dir] = bundle
+        return bundle
+
+    def get_bundle(self, wsdl_dir):
+        with self.lock:
+            if wsdl_dir in self.bundles:
+                return self.bundles[wsdl_dir]
+            bundle = None
+            path = os.path.join(wsdl_dir, BUNDLE_NAME)
+            if os.path.isfile(path):
+                try:
+                    bundle = self.load_bundle(path, wsdl_dir)
+                except Exception:
+                    logger.warning('Ignore invalid WSDL bundle %s', path)
+            self.bundles[wsdl_dir] = bundle
+            return bundle
+
+    def get_template(self, path, portType=None, cache=None):
+        '''Returns the parsed suds client for `path`, parsing it if needed'''
+        key = self.make_key(path, portType)
+        with self._key_lock(key):
+            template = self.templates.get(key)
+            if template is not None:
+                with self.lock:
+                    self.hits += 1
+                return template
+
+            url = urlparse.urljoin('file:', urllib.pathname2url(key[0]))
+            wsdl_dir, name = os.path.split(key[0])
+            bundle = self.get_bundle(wsdl_dir)
+            definitions = bundle.load(name) if bundle else None
+            options = {'cache': cache}
+            if definitions is not None:
+                # Policy 1 makes suds take the definitions from the cache
+                options = {'cache': PreloadedCache(definitions),
+                           'cachingpolicy': 1}
+            template = Client(url=url, port=portType,
+                              headers={'Content-Type': 'application/soap+xml'},
+                              **options)
+            if definitions is not None:
+                # Clones deep-copy the options, don't drag the WSDL along
+                template.set_options(cache=cache, cachingpolicy=0)
+            with self.lock:
+                self.misses += 1
+                # Drop templates of older versions of the same document
+                for stale in [ k for k in self.templates
+                               if k[:2] == key[:2] ]:
+                    del self.templates[stale]
+                    self.key_locks.pop(stale, None)
+                self.templates[key] = template
+            return template
+
+    def get_client(self, path, portType=None, cache=None):
+        '''Returns a new suds client sharing the parsed WSDL of `path`'''
+        return self.get_template(path, portType, cache).clone()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self.templates)}
+
+    def clear(self):
+        with self.lock:
+            self.templates.clear()
+            self.key_locks.clear()
+            for bundle in self.bundles.values():
+                if bundle:
+                    bundle.close()
+            self.bundles.clear()
+            self.hits = 0
+            self.misses = 0
+
+# Default registry used by ONVIFService
+wsdl_registry = WSDLRegistry()
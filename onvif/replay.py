@@ -0,0 +1,223 @@
+''' Replay URIs of recordings, resolved in batches and ahead of playback '''
+
+import re
+import time
+from threading import Lock
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import logging
+logger = logging.getLogger('onvif')
+
+from onvif.client import DEFAULT_STREAM_SETUP
+from onvif.decode import field
+from onvif.search import resolve
+
+# Seconds a replay URI is kept when the device doesn't tell its session
+# timeout
+DEFAULT_TTL = 60
+
+DURATION = re.compile(r'^(-)?P(?:(\d+)Y)?(?:(\d+)M)?(?:(\d+)W)?(?:(\d+)D)?'
+                      r'(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d*)?)S)?)?$')
+# Seconds of the fields of an xs:duration, months and years approximated
+DURATION_UNITS = (365 * 86400, 30 * 86400, 7 * 86400, 86400, 3600, 60, 1)
+
+
+def duration_seconds(value):
+    '''Seconds of an xs:duration, e.g. 'PT1M30S', None if not one'''
+    if isinstance(value, (int, long, float)):
+        return value
+    match = DURATION.match(unicode(value or '').strip())
+    if match is None:
+        return None
+    seconds = sum(float(number) * unit for number, unit in
+                  zip(match.groups()[1:], DURATION_UNITS) if number)
+    return -seconds if match.group(1) else seconds
+
+
+class ReplayResolver(object):
+    '''
+    Replay URIs of the recordings of a device, resolved with GetReplayUri
+    before they are played: starting a playback doesn't wait for a SOAP
+    round trip.
+
+    A URI is kept for the RTSP session timeout the device gives with
+    GetReplayConfiguration (`ttl` overrides it), at most `maxsize` of
+    them. `resolve` gets the URIs of many recordings at once, `prefetch`
+    in the background, at most `concurrency` requests at a time. A
+    recording requested while its URI is being fetched waits for that
+    request rather than sending another one.
+
+    `follow` passes the results of a search through, prefetching the
+    URIs of the recordings of the next `ahead` results: those of the
+    recordings likely to be played next.
+
+    >>> replay = ReplayResolver(nvr)
+    >>> for event in replay.follow(nvr.find_events(params)):
+    ...     print event.Time, replay.uri(event.RecordingToken)
+    >>> replay.close()
+    '''
+
+    def __init__(self, camera, stream_setup=None, ttl=None, concurrency=4,
+                 maxsize=1024):
+        self.camera = camera
+        self.stream_setup = stream_setup or DEFAULT_STREAM_SETUP
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        # token => (uri, expiry), in order of resolution
+        self.uris = OrderedDict()
+        # token => Future of the URI being fetched
+        self.pending = { }
+        self.lock = Lock()
+        # Creating the service and asking the session timeout
+        self.setup_lock = Lock()
+        self.replay = None
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.errors = 0
+
+    def service(self):
+        '''
+        (replay service, seconds a URI is kept): `ttl`, or the
+        SessionTimeout of the GetReplayConfiguration, asked once
+        '''
+        with self.setup_lock:
+            if self.replay is None:
+                self.replay = self.camera.get_service('replay')
+            if self.ttl is None:
+                try:
+                    ret = resolve(self.replay.GetReplayConfiguration())
+                    timeout = duration_seconds(
+                            field(field(ret, 'Configuration', ret),
+                                  'SessionTimeout'))
+                except Exception as err:
+                    logger.warning('GetReplayConfiguration of %s:%s '
+                                   'failed: %s', self.camera.host,
+                                   self.camera.port, err)
+                    timeout = None
+                self.ttl = timeout if timeout and timeout > 0 \
+                           else DEFAULT_TTL
+            return self.replay, self.ttl
+
+    def cached(self, token, now=None):
+        '''URI of `token` if kept and not expired, None otherwise'''
+        entry = self.uris.get(token)
+        if entry is not None and entry[1] > (now or time.time()):
+            return entry[0]
+        return None
+
+    def request(self, token, background):
+        '''
+        (URI, None) when kept, (None, Future) of the URI otherwise. The
+        caller fetches the URI unless `background` or already pending.
+        '''
+        with self.lock:
+            uri = self.cached(token)
+            if uri is not None:
+                if not background:
+                    self.hits += 1
+                return uri, None
+            future = self.pending.get(token)
+            if future is not None:
+                return None, future
+            self.misses += 1
+            if background:
+                self.prefetched += 1
+            future = self.pending[token] = Future()
+        if background:
+            self.executor.submit(self.fetch, token, future)
+        else:
+            self.fetch(token, future)
+        return None, future
+
+    def fetch(self, token, future):
+        try:
+            replay, ttl = self.service()
+            ret = resolve(replay.GetReplayUri(
+                    {'StreamSetup': self.stream_setup,
+                     'RecordingToken': token}))
+            uri = ret if isinstance(ret, basestring) else field(ret, 'Uri')
+        except Exception as err:
+            with self.lock:
+                self.errors += 1
+                del self.pending[token]
+            future.set_exception(err)
+            return
+        with self.lock:
+            self.uris.pop(token, None)
+            self.uris[token] = (uri, time.time() + ttl)
+            while len(self.uris) > self.maxsize:
+                self.uris.popitem(last=False)
+            del self.pending[token]
+        future.set_result(uri)
+
+    def uri(self, token, timeout=None):
+        '''
+        Replay URI of the recording `token`, kept or fetched, raises
+        ONVIFError when the device fails to give it
+        '''
+        uri, future = self.request(token, False)
+        if future is None:
+            return uri
+        return future.result(timeout)
+
+    def prefetch(self, tokens):
+        '''Fetches the URIs of `tokens` not kept yet in the background'''
+        for token in tokens:
+            self.request(token, True)
+
+    def resolve(self, tokens):
+        '''
+        Dict of the replay URIs of the recordings `tokens`, fetched
+        concurrently. A URI the device fails to give is None.
+        '''
+        requests = [ (token, ) + self.request(token, True)
+                     for token in tokens ]
+        uris = { }
+        for token, uri, future in requests:
+            try:
+                uris[token] = uri if future is None else future.result()
+            except Exception as err:
+                logger.warning('%s:%s GetReplayUri of recording %s '
+                               'failed: %s', self.camera.host,
+                               self.camera.port, token, err)
+                uris[token] = None
+        return uris
+
+    def follow(self, results, ahead=8):
+        '''
+        Generator of the search `results` (RecordingInformation,
+        FindEventResult, ...), prefetching the replay URIs of the
+        recordings of the next `ahead` results. Those are read from the
+        search before the current result is yielded.
+        '''
+        window = deque()
+        for result in results:
+            token = field(result, 'RecordingToken')
+            if token is not None:
+                self.request(token, True)
+            window.append(result)
+            if len(window) > ahead:
+                yield window.popleft()
+        while window:
+            yield window.popleft()
+
+    def invalidate(self, token=None):
+        '''Drops the URI of `token`, or all of them'''
+        with self.lock:
+            if token is None:
+                self.uris.clear()
+            else:
+                self.uris.pop(token, None)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'prefetched': self.prefetched, 'errors': self.errors,
+                    'cached': len(self.uris), 'pending': len(self.pending),
+                    'session_timeout': self.ttl}
@@ -0,0 +1,93 @@
+''' Paged searches of the recordings, events, PTZ positions and metadata '''
+
+from concurrent.futures import Future
+
+import logging
+logger = logging.getLogger('onvif')
+
+from onvif.decode import field
+
+# Kind of search => (Find operation, operation getting its results,
+# element of the results)
+SEARCHES = {
+    'recordings': ('FindRecordings', 'GetRecordingSearchResults',
+                   'RecordingInformation'),
+    'events': ('FindEvents', 'GetEventSearchResults', 'Result'),
+    'ptz_positions': ('FindPTZPosition', 'GetPTZPositionSearchResults',
+                      'Result'),
+    'metadata': ('FindMetadata', 'GetMetadataSearchResults', 'Result'),
+}
+
+# Time a search session is kept by the device between two requests
+DEFAULT_KEEP_ALIVE = 'PT60S'
+# Time the device may wait for results before answering
+DEFAULT_WAIT_TIME = 'PT5S'
+# Bounds of the MaxResults of the result requests
+MIN_BATCH = 16
+MAX_BATCH = 1024
+
+
+def resolve(ret):
+    # Reply of an operation of a service, possibly running in an executor
+    if isinstance(ret, Future):
+        return ret.result()
+    return ret
+
+
+def paged_search(service, kind, params=None, batch=64, min_batch=MIN_BATCH,
+                 max_batch=MAX_BATCH, wait_time=DEFAULT_WAIT_TIME):
+    '''
+    Generator of the results of a search of `kind` (see `SEARCHES`) run
+    on the search `service` with the Find operation `params`, yielded
+    page by page as the device returns them: memory stays bounded by a
+    page whatever the number of results.
+
+    A page is at most `batch` results to start with. The size doubles
+    while the pages come back full and halves when they come back less
+    than a quarter full, within [`min_batch`, `max_batch`]. The device
+    answers as soon as a result is found, or after `wait_time`.
+
+    EndSearch is sent once the results are exhausted, the generator
+    closed (e.g. the consumer breaking out of its loop) or an error
+    raised.
+
+    >>> params = {'Scope': {'IncludedRecordings': ['rec_1']},
+    ...           'StartPoint': start, 'IncludeStartState': False}
+    >>> for event in paged_search(search_service, 'events', params):
+    ...     print event.Time, event.Event.Topic
+    '''
+    find, get_results, name = SEARCHES[kind]
+    params = dict(params or { })
+    params.setdefault('KeepAliveTime', DEFAULT_KEEP_ALIVE)
+    ret = resolve(getattr(service, find)(params))
+    token = ret if isinstance(ret, basestring) else field(ret, 'SearchToken')
+
+    size = max(min(batch, max_batch), min_batch)
+    try:
+        while True:
+            ret = resolve(getattr(service, get_results)(
+                    {'SearchToken': token, 'MinResults': 1,
+                     'MaxResults': size, 'WaitTime': wait_time}))
+            state = field(ret, 'SearchState')
+            results = field(ret, name) or [ ]
+            if not isinstance(results, list):
+                results = [ results ]
+            count = len(results)
+            for result in results:
+                yield result
+            # No new results once completed, but the found ones may not
+            # fit a page
+            if count < size and state in ('Completed', 'Unknown'):
+                break
+            if count >= size:
+                size = min(size * 2, max_batch)
+            elif count < size / 4:
+                size = max(size / 2, min_batch)
+            # Not kept while waiting for the next page
+            results = result = ret = None
+    finally:
+        try:
+            resolve(service.EndSearch({'SearchToken': token}))
+        except Exception as err:
+            # The device may have ended the session already
+            logger.debug('EndSearch %s failed: %s', token, err)
@@ -0,0 +1,142 @@
+''' Conversion of suds replies into dicts and JSON '''
+
+import datetime as dt
+from json.encoder import encode_basestring_ascii, FLOAT_REPR
+
+from suds.sudsobject import Object
+from suds.sax.text import Text
+
+# Bytes buffered by `dump_json` between writes
+CHUNK_SIZE = 65536
+
+
+def iter_fields(value, attr_prefix):
+    '''
+    (key, value) of a suds object or dict, attributes ('_' prefixed
+    keys) renamed with `attr_prefix`, or skipped if it is None.
+    '''
+    if isinstance(value, Object):
+        values = value.__dict__
+        items = ((key, values[key]) for key in value.__keylist__)
+    else:
+        items = value.iteritems()
+    for key, child in items:
+        if key[:1] == '_':
+            if attr_prefix is None:
+                continue
+            if attr_prefix != '_':
+                key = attr_prefix + key[1:]
+        yield key, child
+
+
+def to_dict(obj, attr_prefix='_', text=None):
+    '''
+    Converts a suds object into dicts and lists, nested objects
+    included. Iterative, deep replies don't hit the recursion limit.
+
+    `attr_prefix` replaces the '_' prefix of attributes, e.g. '@',
+    None drops the attributes. `text` converts the suds Text values,
+    e.g. `unicode` or `str`, they are kept as is by default.
+
+    >>> to_dict(media_service.GetProfiles(), attr_prefix='')[0]['token']
+    '''
+    root = [None]
+    stack = [(obj, root, 0)]
+    while stack:
+        value, parent, key = stack.pop()
+        if isinstance(value, (Object, dict)):
+            converted = { }
+            for name, child in iter_fields(value, attr_prefix):
+                if isinstance(child, (Object, dict, list, tuple)):
+                    stack.append((child, converted, name))
+                elif text is not None and isinstance(child, Text):
+                    converted[name] = text(child)
+                else:
+                    converted[name] = child
+            parent[key] = converted
+        elif isinstance(value, (list, tuple)):
+            converted = [None] * len(value)
+            for index, child in enumerate(value):
+                stack.append((child, converted, index))
+            parent[key] = converted
+        elif text is not None and isinstance(value, Text):
+            parent[key] = text(value)
+        else:
+            parent[key] = value
+    return root[0]
+
+
+def encode_scalar(value):
+    if isinstance(value, basestring):
+        return encode_basestring_ascii(value)
+    elif value is None:
+        return 'null'
+    elif value is True:
+        return 'true'
+    elif value is False:
+        return 'false'
+    elif isinstance(value, (int, long)):
+        return str(value)
+    elif isinstance(value, float):
+        if value != value or value in (float('inf'), float('-inf')):
+            return 'null'
+        return FLOAT_REPR(value)
+    elif isinstance(value, (dt.datetime, dt.date, dt.time)):
+        return '"%s"' % value.isoformat()
+    return encode_basestring_ascii(unicode(value))
+
+
+def dump_json(obj, fp, attr_prefix='_'):
+    '''
+    Writes a suds object (or decoded dicts and lists) as JSON to `fp`,
+    without building the intermediate dicts. `fp` only needs a `write`
+    method, for a socket use `sock.makefile('wb')`. Dates are written
+    as ISO 8601 strings.
+
+    >>> with open('profiles.json', 'wb') as fp:
+    ...     dump_json(media_service.GetProfiles(), fp)
+    '''
+    chunks = [ ]
+    size = 0
+    # Open containers: (iterator, is an object, no item written yet)
+    stack = [ ]
+    value = obj
+    while True:
+        if isinstance(value, (Object, dict)):
+            chunks.append('{')
+            stack.append([iter_fields(value, attr_prefix), True, True])
+        elif isinstance(value, (list, tuple)):
+            chunks.append('[')
+            stack.append([iter(value), False, True])
+        else:
+            token = encode_scalar(value)
+            chunks.append(token)
+            size += len(token)
+            if size >= CHUNK_SIZE:
+                fp.write(''.join(chunks))
+                chunks = [ ]
+                size = 0
+
+        # Next value to write
+        while stack:
+            frame = stack[-1]
+            try:
+                item = next(frame[0])
+            except StopIteration:
+                chunks.append('}' if frame[1] else ']')
+                stack.pop()
+                continue
+            if not frame[2]:
+                chunks.append(',')
+            frame[2] = False
+            if frame[1]:
+                key, value = item
+                token = encode_basestring_ascii(key)
+                chunks.append(token + ':')
+                size += len(token)
+            else:
+                value = item
+            break
+        else:
+            break
+    fp.write(''.join(chunks))
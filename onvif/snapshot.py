@@ -0,0 +1,461 @@
+''' JPEG snapshots of the media profiles '''
+
+import os
+import re
+import time
+import uuid
+import heapq
+import base64
+import socket
+import hashlib
+import httplib
+import urlparse
+from threading import Lock, Condition, Thread, local
+from concurrent.futures import Future
+
+import logging
+logger = logging.getLogger('onvif')
+
+from onvif.exceptions import ONVIFError
+from onvif.decode import field
+from onvif.histogram import Histogram
+
+# Initial size of the image buffers, grown to the largest image
+BUFFER_SIZE = 512 << 10
+# Bytes written to disk at once
+CHUNK_SIZE = 64 << 10
+
+AUTH_PARAM = re.compile(r'(\w+)=(?:"([^"]*)"|([^,\s]*))')
+
+# Image buffer of each thread, shared by all the cameras
+thread_buffers = local()
+
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+class HTTPAuth(object):
+    '''
+    Basic or Digest credentials of a host. Once the host challenged
+    them, they are sent with every request (the Digest nonce reused with
+    an increasing nonce count), later requests don't pay for a 401.
+    '''
+
+    def __init__(self, user, passwd):
+        self.user = user
+        self.passwd = passwd
+        self.scheme = None
+        self.params = { }
+        self.nc = 0
+        self.lock = Lock()
+
+    def challenge(self, header):
+        '''Takes the WWW-Authenticate header of a 401, False if unusable'''
+        if not header or self.user is None:
+            return False
+        index = header.lower().find('digest ')
+        with self.lock:
+            if index >= 0:
+                self.scheme = 'digest'
+                self.params = dict((name.lower(), quoted or token)
+                                   for name, quoted, token in
+                                   AUTH_PARAM.findall(header[index + 7:]))
+                self.nc = 0
+            elif header.lower().startswith('basic'):
+                self.scheme = 'basic'
+            else:
+                return False
+        return True
+
+    def header(self, method, path):
+        '''Authorization header of a request, None before any challenge'''
+        with self.lock:
+            if self.scheme == 'basic':
+                return 'Basic ' + base64.b64encode('%s:%s' % (self.user,
+                                                              self.passwd))
+            if self.scheme != 'digest':
+                return None
+            self.nc += 1
+            nc = '%08x' % self.nc
+            params = self.params
+        realm = params.get('realm', '')
+        nonce = params.get('nonce', '')
+        cnonce = uuid.uuid4().hex[:16]
+        ha1 = md5('%s:%s:%s' % (self.user, realm, self.passwd))
+        if params.get('algorithm', '').lower() == 'md5-sess':
+            ha1 = md5('%s:%s:%s' % (ha1, nonce, cnonce))
+        ha2 = md5('%s:%s' % (method, path))
+        qop = 'auth' if 'qop' in params else None
+        if qop:
+            response = md5(':'.join((ha1, nonce, nc, cnonce, qop, ha2)))
+        else:
+            response = md5('%s:%s:%s' % (ha1, nonce, ha2))
+        value = 'Digest username="%s", realm="%s", nonce="%s", uri="%s", ' \
+                'response="%s"' % (self.user, realm, nonce, path, response)
+        if 'algorithm' in params:
+            value += ', algorithm=%s' % params['algorithm']
+        if qop:
+            value += ', qop=%s, nc=%s, cnonce="%s"' % (qop, nc, cnonce)
+        if 'opaque' in params:
+            value += ', opaque="%s"' % params['opaque']
+        return value
+
+
+def read_into(response, buf):
+    '''
+    Reads the body of `response` into the bytearray `buf`, returns
+    (buffer, length), the buffer being a new one if `buf` is too small.
+    '''
+    length = response.length
+    if length is None:
+        # Chunked, or until the connection closes
+        data = response.read()
+        length = len(data)
+        if len(buf) < length:
+            buf = bytearray(length)
+        buf[:length] = data
+        return buf, length
+    if len(buf) < length:
+        buf = bytearray(length)
+    view = memoryview(buf)
+    # httplib reads the status line and headers unbuffered, the whole
+    # body is still in the socket
+    sock = response.fp._sock
+    read = 0
+    while read < length:
+        count = sock.recv_into(view[read:length], length - read)
+        if not count:
+            raise httplib.IncompleteRead(str(view[:read]), length - read)
+        read += count
+    response.length = 0
+    response.close()
+    return buf, length
+
+
+def write_to(response, fileobj, buf):
+    '''Writes the body of `response` to `fileobj` through `buf`'''
+    written = 0
+    if response.length is None:
+        while True:
+            data = response.read(CHUNK_SIZE)
+            if not data:
+                return written
+            fileobj.write(data)
+            written += len(data)
+    view = memoryview(buf)
+    sock = response.fp._sock
+    length = response.length
+    while written < length:
+        count = sock.recv_into(view, min(len(view), length - written))
+        if not count:
+            raise httplib.IncompleteRead('', length - written)
+        fileobj.write(view[:count])
+        written += count
+    response.length = 0
+    response.close()
+    return written
+
+
+class SnapshotClient(object):
+    '''
+    Snapshots of the media profiles of a camera.
+
+    The snapshot URI of each profile is resolved once (GetSnapshotUri)
+    and resolved again only if the camera stops serving it. The images
+    are fetched over the keep-alive connections of the camera's pool,
+    with the camera's credentials (Basic or Digest, sent up front once
+    challenged), and read straight from the socket into a reusable
+    buffer, or to disk.
+
+    >>> snapshots = mycam.snapshots
+    >>> image = snapshots.fetch(media_profile._token)
+    >>> image.tobytes()[:2]
+    '\\xff\\xd8'
+    >>> snapshots.save(media_profile._token, '/var/lib/snapshots/cam1.jpg')
+
+    `fetch` returns a memoryview of a buffer of the calling thread,
+    shared by all the cameras and valid until its next `fetch`. Pass
+    your own bytearray as `buf` to keep an image: it is used if large
+    enough.
+    '''
+
+    def __init__(self, camera, pool=None, timeout=10):
+        self.camera = camera
+        self.pool = pool or camera.pool
+        self.timeout = timeout
+        # Profile token => snapshot URI
+        self.uris = { }
+        # (scheme, host, port) => HTTPAuth
+        self.auths = { }
+        self.lock = Lock()
+        self.fetched = 0
+        self.bytes = 0
+        self.resolved = 0
+        self.challenges = 0
+
+    def snapshot_uri(self, token, refresh=False):
+        '''Snapshot URI of profile `token`, resolved on first use'''
+        with self.lock:
+            uri = None if refresh else self.uris.get(token)
+        if uri is not None:
+            return uri
+        media = self.camera.get_service('media')
+        ret = media.GetSnapshotUri({'ProfileToken': token})
+        if isinstance(ret, Future):
+            ret = ret.result()
+        uri = field(ret, 'Uri')
+        if not uri:
+            raise ONVIFError('No snapshot URI for profile %s' % token)
+        with self.lock:
+            self.uris[token] = uri
+            self.resolved += 1
+        return uri
+
+    @staticmethod
+    def buffer():
+        '''Image buffer of the calling thread'''
+        buf = getattr(thread_buffers, 'buf', None)
+        if buf is None:
+            buf = thread_buffers.buf = bytearray(BUFFER_SIZE)
+        return buf
+
+    def get_auth(self, key, url):
+        with self.lock:
+            auth = self.auths.get(key)
+            if auth is None:
+                # Credentials in the URI take precedence
+                if url.username is not None:
+                    auth = HTTPAuth(urlparse.unquote(url.username),
+                                    urlparse.unquote(url.password or ''))
+                else:
+                    auth = HTTPAuth(self.camera.user, self.camera.passwd)
+                self.auths[key] = auth
+            return auth
+
+    def get(self, uri, read):
+        '''GETs `uri`, returns `read(response)` of its 200 response'''
+        url = urlparse.urlsplit(uri)
+        scheme = url.scheme or 'http'
+        key = (scheme, url.hostname,
+               url.port or (443 if scheme == 'https' else 80))
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        auth = self.get_auth(key, url)
+
+        challenged = False
+        while True:
+            try:
+                conn, reused = self.pool.acquire(key, self.timeout)
+            except (httplib.HTTPException, socket.error) as err:
+                # Unreachable camera
+                raise ONVIFError(err)
+            try:
+                headers = { }
+                authorization = auth.header('GET', path)
+                if authorization:
+                    headers['Authorization'] = authorization
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                if response.status == 200:
+                    ret = read(response)
+                else:
+                    response.read()
+            except (httplib.HTTPException, socket.error) as err:
+                self.pool.discard(conn)
+                # The camera may have closed an idle connection,
+                # retry on a new one.
+                if reused and not isinstance(err, socket.timeout):
+                    continue
+                raise ONVIFError(err)
+            except Exception:
+                # e.g. failing to write the image, the response may be
+                # left unread
+                self.pool.discard(conn)
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self.pool.release(key, conn)
+
+            if response.status == 200:
+                return ret
+            if response.status == 401 and not challenged and \
+               auth.challenge(response.getheader('www-authenticate')):
+                challenged = True
+                with self.lock:
+                    self.challenges += 1
+                continue
+            err = ONVIFError('Snapshot %s: HTTP %d %s' % (uri, response.status,
+                                                        response.reason))
+            err.status = response.status
+            raise err
+
+    def request(self, token, read):
+        uri = self.snapshot_uri(token)
+        try:
+            return self.get(uri, read)
+        except ONVIFError as err:
+            if getattr(err, 'status', None) not in (403, 404):
+                raise
+        # The URI may have changed, e.g. after a reboot
+        logger.info('Snapshot URI of %s:%s profile %s failed, resolving it again',
+                    self.camera.host, self.camera.port, token)
+        return self.get(self.snapshot_uri(token, refresh=True), read)
+
+    def fetch_into(self, token, buf):
+        '''
+        Reads the image of profile `token` into the bytearray `buf`,
+        returns (buffer, length), the buffer being a new one if `buf`
+        is too small.
+        '''
+        buf, length = self.request(token, lambda response:
+                                          read_into(response, buf))
+        with self.lock:
+            self.fetched += 1
+            self.bytes += length
+        return buf, length
+
+    def fetch(self, token, buf=None):
+        '''Image of profile `token`, a memoryview of `buf` or of a buffer'''
+        if buf is None:
+            image, length = self.fetch_into(token, self.buffer())
+            # Grown, kept for the next images
+            thread_buffers.buf = image
+        else:
+            image, length = self.fetch_into(token, buf)
+        return memoryview(image)[:length]
+
+    def save(self, token, path):
+        '''Writes the image of profile `token` to `path`, returns its size'''
+        # Written aside and renamed, readers never see a partial image
+        tmp = '%s.%s.tmp' % (path, uuid.uuid4().hex[:8])
+        def write(response):
+            with open(tmp, 'wb') as fileobj:
+                return write_to(response, fileobj, self.buffer())
+        try:
+            length = self.request(token, write)
+            os.rename(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self.lock:
+            self.fetched += 1
+            self.bytes += length
+        return length
+
+    def stats(self):
+        with self.lock:
+            return {'fetched': self.fetched, 'bytes': self.bytes,
+                    'resolved': self.resolved, 'challenges': self.challenges}
+
+
+class SnapshotPoller(object):
+    '''
+    Fetches the snapshots of many (camera, profile token) targets every
+    `interval` seconds with `workers` threads, each target fetched by a
+    single worker at a time. Targets start staggered over the interval,
+    and a period missed by a slow camera is skipped, not caught up.
+
+    `callback(camera, token, image)` gets the image as a memoryview of
+    the worker's buffer, valid only during the call.
+
+    >>> from onvif.snapshot import SnapshotPoller
+    >>> def store(camera, token, image):
+    ...     archive.write(camera.host, token, image)
+    >>> poller = SnapshotPoller([ (cam, 'profile_1') for cam in cameras ],
+    ...                         interval=5, callback=store, workers=32)
+    >>> poller.start()
+    >>> poller.stats()['latency']['p95']
+    >>> poller.stop()
+    '''
+
+    def __init__(self, targets, interval, callback, workers=8):
+        self.interval = interval
+        self.callback = callback
+        self.workers = workers
+        now = time.time()
+        targets = list(targets)
+        # (due time, index, (camera, token))
+        self.schedule = [ (now + interval * i / max(len(targets), 1), i, target)
+                          for i, target in enumerate(targets) ]
+        heapq.heapify(self.schedule)
+        self.condition = Condition()
+        self.stopped = False
+        self.threads = [ ]
+        self.fetched = 0
+        self.errors = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.latency = Histogram()
+        self.lateness = Histogram()
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = Thread(target=self.run)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def next_target(self):
+        '''Waits for the next target due, None once stopped'''
+        with self.condition:
+            while not self.stopped:
+                wait = None
+                if self.schedule:
+                    wait = self.schedule[0][0] - time.time()
+                    if wait <= 0:
+                        return heapq.heappop(self.schedule)
+                self.condition.wait(wait)
+            return None
+
+    def run(self):
+        buf = bytearray(BUFFER_SIZE)
+        while True:
+            item = self.next_target()
+            if item is None:
+                return
+            due, index, target = item
+            camera, token = target
+            start = time.time()
+            self.lateness.observe(start - due)
+            try:
+                buf, length = camera.snapshots.fetch_into(token, buf)
+                self.latency.observe(time.time() - start)
+                with self.condition:
+                    self.fetched += 1
+                    self.bytes += length
+                self.callback(camera, token, memoryview(buf)[:length])
+            except ONVIFError as err:
+                with self.condition:
+                    self.errors += 1
+                logger.warning('Snapshot of %s:%s profile %s failed: %s',
+                               camera.host, camera.port, token, err)
+            except Exception:
+                logger.exception('Snapshot callback failed')
+
+            due += self.interval
+            now = time.time()
+            with self.condition:
+                if due < now:
+                    missed = int((now - due) / self.interval) + 1
+                    self.skipped += missed
+                    due += missed * self.interval
+                heapq.heappush(self.schedule, (due, index, target))
+                self.condition.notify()
+
+    def stop(self, timeout=None):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def stats(self):
+        with self.condition:
+            return {'fetched': self.fetched, 'errors': self.errors,
+                    'skipped': self.skipped, 'bytes': self.bytes,
+                    'latency': self.latency.stats(),
+                    'lateness': self.lateness.stats()}
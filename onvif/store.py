@@ -0,0 +1,108 @@
+''' Capabilities of the devices kept across process restarts '''
+
+import json
+import time
+import sqlite3
+from threading import Lock
+
+
+def device_key(host, port):
+    return '%s:%s' % (host, port)
+
+
+class MemoryCapabilityStore(object):
+    '''
+    Capability records kept in memory, e.g. shared by the cameras of a
+    process. Any object with the `get`, `put` and `delete` methods can
+    be used as the store of an ONVIFCamera.
+    '''
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self.records = { }
+        self.lock = Lock()
+
+    def get(self, device):
+        '''Record of `device` (host:port), None if unknown or too old'''
+        with self.lock:
+            record = self.records.get(device)
+        if record is None or self.expired(record):
+            return None
+        return dict(record)
+
+    def put(self, device, record):
+        record = dict(record, updated=time.time())
+        with self.lock:
+            self.records[device] = record
+
+    def delete(self, device):
+        with self.lock:
+            self.records.pop(device, None)
+
+    def expired(self, record):
+        return self.max_age is not None and \
+               time.time() - record.get('updated', 0) > self.max_age
+
+
+class CapabilityStore(MemoryCapabilityStore):
+    '''
+    Capability records of the devices in a SQLite database, so that a
+    restarted process finds the xaddrs, clock offset and supported
+    services of its cameras without asking them. A record is a dict:
+
+        xaddrs      namespace => xaddr of the services
+        dt_diff     clock offset of the device in seconds, or None
+        services    names of the supported services
+        serial      serial number of the device
+        firmware    firmware version of the device
+        updated     seconds since the epoch of the last update
+
+    Records are keyed by host:port, the serial number and firmware
+    version tell whether the device found there on revalidation is the
+    one recorded. Records older than `max_age` seconds are ignored.
+
+    >>> from onvif.store import CapabilityStore
+    >>> store = CapabilityStore('/var/lib/onvif/capabilities.db')
+    >>> mycam = ONVIFCamera('192.168.0.112', 80, 'admin', '12345', store=store)
+    '''
+
+    def __init__(self, path, max_age=None):
+        MemoryCapabilityStore.__init__(self, max_age)
+        self.path = path
+        # Shared by the threads of the process, serialized by the lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS capabilities ('
+                            'device TEXT PRIMARY KEY, serial TEXT, '
+                            'firmware TEXT, record TEXT, updated REAL)')
+
+    def get(self, device):
+        with self.lock:
+            row = self.db.execute('SELECT record, updated FROM capabilities '
+                                  'WHERE device = ?', (device,)).fetchone()
+        if row is None:
+            return None
+        record = json.loads(row[0])
+        record['updated'] = row[1]
+        if self.expired(record):
+            return None
+        return record
+
+    def put(self, device, record):
+        record = dict(record)
+        record.pop('updated', None)
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO capabilities '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (device, record.get('serial'),
+                             record.get('firmware'), json.dumps(record),
+                             time.time()))
+
+    def delete(self, device):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM capabilities WHERE device = ?',
+                            (device,))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,225 @@
+''' Keep-alive HTTP transport for the ONVIF services '''
+
+import time
+import errno
+import select
+import socket
+import httplib
+import urlparse
+from threading import Lock
+from cStringIO import StringIO
+
+from suds.properties import Unskin
+from suds.transport import Transport, TransportError, Reply
+from suds.transport.https import HttpAuthenticated
+
+# Errors of a connection closed by the peer
+CLOSED_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+def idempotent(request):
+    '''Whether the SOAP `request` only reads: a Get operation'''
+    action = request.headers.get('SOAPAction') or ''
+    return action.strip('"').rsplit('/', 1)[-1].startswith('Get')
+
+
+def nothing_received(err):
+    '''Whether `err` means the connection closed before the response'''
+    if isinstance(err, httplib.BadStatusLine):
+        # No status line at all, rather than a garbled one
+        return not err.line.strip("'") or \
+               err.line.startswith('No status line received')
+    return isinstance(err, socket.error) and \
+           not isinstance(err, socket.timeout) and err.errno in CLOSED_ERRNOS
+
+
+def dropped(conn):
+    '''Whether the idle connection `conn` was closed by the peer'''
+    if conn.sock is None:
+        return True
+    try:
+        # Readable while idle: end of file, or data nobody asked for
+        return bool(select.select([ conn.sock ], [ ], [ ], 0)[0])
+    except (select.error, socket.error):
+        return True
+
+
+class ConnectionPool(object):
+    '''
+    Thread-safe pool of persistent HTTP connections keyed by
+    (scheme, host, port).
+
+    `maxsize` is the number of idle connections kept per host, extra
+    connections opened by concurrent requests are closed once done.
+    Idle connections older than `idle_timeout` seconds are not reused,
+    cameras usually drop them silently. `max_idle` bounds the number of
+    idle connections of all hosts, for pools shared by many cameras.
+    '''
+
+    def __init__(self, maxsize=4, idle_timeout=30, max_idle=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.idle_count = 0
+        # (scheme, host, port) => [(connection, last used), ...]
+        self.idle = { }
+        self.lock = Lock()
+        self.requests = 0
+        self.created = 0
+        self.reused = 0
+        self.expired = 0
+        self.failed = 0
+
+    def acquire(self, key, timeout=None):
+        '''Returns (connection, reused) for `key`'''
+        now = time.time()
+        with self.lock:
+            self.requests += 1
+            idle = self.idle.get(key, [ ])
+            while idle:
+                conn, last_used = idle.pop()
+                self.idle_count -= 1
+                if now - last_used < self.idle_timeout and not dropped(conn):
+                    self.reused += 1
+                    conn.timeout = timeout
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    return conn, True
+                self.expired += 1
+                conn.close()
+            self.created += 1
+
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=timeout)
+        conn.connect()
+        # Small request/response exchanges, don't wait for delayed ACKs
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn, False
+
+    def release(self, key, conn):
+        '''Gives back a connection whose response has been fully read'''
+        with self.lock:
+            idle = self.idle.setdefault(key, [ ])
+            if len(idle) < self.maxsize and \
+               (self.max_idle is None or self.idle_count < self.max_idle):
+                idle.append((conn, time.time()))
+                self.idle_count += 1
+                return
+        conn.close()
+
+    def discard(self, conn):
+        with self.lock:
+            self.failed += 1
+        conn.close()
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'created': self.created,
+                    'reused': self.reused, 'expired': self.expired,
+                    'failed': self.failed,
+                    'idle': self.idle_count,
+                    'reuse_rate': float(self.reused) / self.requests
+                                  if self.requests else 0.0}
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, { }
+            self.idle_count = 0
+        for conns in idle.values():
+            for conn, last_used in conns:
+                conn.close()
+
+
+class KeepAliveTransport(Transport):
+    '''
+    suds transport sending SOAP requests over persistent connections.
+
+    suds links a transport to the options of a single client, so every
+    service gets its own transport, but ONVIFCamera shares one pool
+    between all of its services: devicemgmt, media, ptz, ... calls to
+    the same host:port reuse the same TCP (and TLS) connections.
+
+    A request failing on a reused connection is sent again on a new one
+    when it surely didn't reach the device (the connection failed while
+    sending it), or when it is a Get operation and the connection was
+    closed before any byte of the response: other operations may have
+    been applied.
+
+    With the `proxy` or HTTP authentication (`username`, `password`)
+    options of suds, requests go through suds' own transport instead,
+    without keep-alive.
+
+    >>> from onvif.transport import ConnectionPool
+    >>> mycam = ONVIFCamera('192.168.0.112', 80, 'admin', '12345',
+    ...                     pool=ConnectionPool(maxsize=2, idle_timeout=10))
+    >>> mycam.pool.stats()['reuse_rate']
+    '''
+
+    def __init__(self, pool=None, **kwargs):
+        Transport.__init__(self)
+        Unskin(self.options).update(kwargs)
+        self.pool = pool or ConnectionPool()
+
+    def __deepcopy__(self, memo):
+        # suds deep-copies the options when cloning a client,
+        # the clone must keep sharing the pool.
+        options = self.options
+        return KeepAliveTransport(self.pool, timeout=options.timeout,
+                                  proxy=dict(options.proxy),
+                                  username=options.username,
+                                  password=options.password)
+
+    def suds_transport(self):
+        '''suds' transport, honouring the proxy and authentication options'''
+        options = self.options
+        return HttpAuthenticated(timeout=options.timeout,
+                                 proxy=options.proxy,
+                                 username=options.username,
+                                 password=options.password)
+
+    def open(self, request):
+        # Only used to read documents (WSDL, schemas)
+        return self.suds_transport().open(request)
+
+    def send(self, request):
+        if self.options.proxy or self.options.username is not None:
+            return self.suds_transport().send(request)
+
+        url = urlparse.urlsplit(request.url)
+        key = (url.scheme, url.hostname,
+               url.port or (443 if url.scheme == 'https' else 80))
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+
+        while True:
+            conn, reused = self.pool.acquire(key, self.options.timeout)
+            sent = False
+            try:
+                conn.request('POST', path, request.message, request.headers)
+                sent = True
+                response = conn.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error) as err:
+                self.pool.discard(conn)
+                # The camera may have closed an idle connection, retry
+                # on a new one unless the request may have been applied
+                if reused and not isinstance(err, socket.timeout) and \
+                   (not sent or (idempotent(request) and
+                                 nothing_received(err))):
+                    continue
+                raise
+            break
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.release(key, conn)
+
+        if response.status >= 300:
+            raise TransportError(response.reason, response.status,
+                                 StringIO(body))
+        return Reply(response.status, dict(response.getheaders()), body)
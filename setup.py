@@ -5,7 +5,7 @@ here = os.path.abspath(os.path.dirname(__file__))
 version_path = os.path.join(here, 'onvif/version.txt')
 version = open(version_path).read().strip()
 
-requires = [ 'suds >= 0.4', 'suds-passworddigest' ]
+requires = [ 'suds >= 0.4', 'suds-passworddigest', 'futures' ]
 
 CLASSIFIERS = [
     'Development Status :: 3 - Alpha',
@@ -46,7 +46,8 @@ setup(
       include_package_data=True,
       data_files=[('wsdl', wsdl_files)],
       entry_points={
-          'console_scripts': ['onvif-cli = onvif.cli:main']
+          'console_scripts': ['onvif-cli = onvif.cli:main',
+                              'onvif-compile-wsdl = onvif.compile_wsdl:main']
           }
      )
 
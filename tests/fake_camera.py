@@ -0,0 +1,564 @@
+#-*-coding=utf-8
+''' Local fake ONVIF camera, answering SOAP requests with canned responses '''
+
+import re
+import socket
+import hashlib
+import time
+import threading
+import BaseHTTPServer
+import SocketServer
+
+ENVELOPE = '''<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://www.w3.org/2003/05/soap-envelope"
+ xmlns:tt="http://www.onvif.org/ver10/schema"
+ xmlns:tds="http://www.onvif.org/ver10/device/wsdl"
+ xmlns:trt="http://www.onvif.org/ver10/media/wsdl"
+ xmlns:tptz="http://www.onvif.org/ver20/ptz/wsdl"
+ xmlns:tev="http://www.onvif.org/ver10/events/wsdl"
+ xmlns:tse="http://www.onvif.org/ver10/search/wsdl"
+ xmlns:trc="http://www.onvif.org/ver10/recording/wsdl"
+ xmlns:trp="http://www.onvif.org/ver10/replay/wsdl"
+ xmlns:wsnt="http://docs.oasis-open.org/wsn/b-2"
+ xmlns:wsa5="http://www.w3.org/2005/08/addressing"
+ xmlns:tns1="http://www.onvif.org/ver10/topics">
+<SOAP-ENV:Body>%s</SOAP-ENV:Body></SOAP-ENV:Envelope>'''
+
+FAULT = '''<SOAP-ENV:Fault><SOAP-ENV:Code><SOAP-ENV:Value>SOAP-ENV:Sender</SOAP-ENV:Value></SOAP-ENV:Code>
+<SOAP-ENV:Reason><SOAP-ENV:Text xml:lang="en">%s</SOAP-ENV:Text></SOAP-ENV:Reason></SOAP-ENV:Fault>'''
+
+RESPONSES = {
+    'GetCapabilities': '''<tds:GetCapabilitiesResponse><tds:Capabilities>
+<tt:Device><tt:XAddr>%(base)s/onvif/device_service</tt:XAddr></tt:Device>
+<tt:Events><tt:XAddr>%(base)s/onvif/events</tt:XAddr></tt:Events>
+<tt:Media><tt:XAddr>%(base)s/onvif/media</tt:XAddr></tt:Media>
+<tt:PTZ><tt:XAddr>%(base)s/onvif/ptz</tt:XAddr></tt:PTZ>
+<tt:Extension><tt:Recording><tt:XAddr>%(base)s/onvif/recording</tt:XAddr>
+</tt:Recording><tt:Search><tt:XAddr>%(base)s/onvif/search</tt:XAddr>
+<tt:MetadataSearch>true</tt:MetadataSearch></tt:Search>
+<tt:Replay><tt:XAddr>%(base)s/onvif/replay</tt:XAddr></tt:Replay></tt:Extension>
+</tds:Capabilities></tds:GetCapabilitiesResponse>''',
+    'GetHostname': '''<tds:GetHostnameResponse><tds:HostnameInformation>
+<tt:FromDHCP>false</tt:FromDHCP><tt:Name>%(hostname)s</tt:Name>
+</tds:HostnameInformation></tds:GetHostnameResponse>''',
+    'GetDeviceInformation': '''<tds:GetDeviceInformationResponse>
+<tds:Manufacturer>Fake</tds:Manufacturer><tds:Model>FC-1</tds:Model>
+<tds:FirmwareVersion>%(firmware)s</tds:FirmwareVersion>
+<tds:SerialNumber>%(serial)s</tds:SerialNumber><tds:HardwareId>1</tds:HardwareId>
+</tds:GetDeviceInformationResponse>''',
+    'GetSystemDateAndTime': '''<tds:GetSystemDateAndTimeResponse><tds:SystemDateAndTime>
+<tt:DateTimeType>Manual</tt:DateTimeType><tt:DaylightSavings>false</tt:DaylightSavings>
+<tt:UTCDateTime><tt:Time><tt:Hour>%(hour)d</tt:Hour><tt:Minute>%(minute)d</tt:Minute><tt:Second>%(second)d</tt:Second></tt:Time>
+<tt:Date><tt:Year>%(year)d</tt:Year><tt:Month>%(month)d</tt:Month><tt:Day>%(day)d</tt:Day></tt:Date></tt:UTCDateTime>
+</tds:SystemDateAndTime></tds:GetSystemDateAndTimeResponse>''',
+    'CreatePullPointSubscription': '''<tev:CreatePullPointSubscriptionResponse>
+<tev:SubscriptionReference><wsa5:Address>%(base)s/onvif/pullpoint</wsa5:Address></tev:SubscriptionReference>
+<wsnt:CurrentTime>2026-01-01T00:00:00Z</wsnt:CurrentTime>
+<wsnt:TerminationTime>2026-01-01T00:01:00Z</wsnt:TerminationTime>
+</tev:CreatePullPointSubscriptionResponse>''',
+    'PullMessages': '''<tev:PullMessagesResponse>
+<tev:CurrentTime>2026-01-01T00:00:00Z</tev:CurrentTime>
+<tev:TerminationTime>2026-01-01T00:01:00Z</tev:TerminationTime>
+%(messages)s</tev:PullMessagesResponse>''',
+    'Renew': '''<wsnt:RenewResponse>
+<wsnt:TerminationTime>2026-01-01T00:01:00Z</wsnt:TerminationTime>
+<wsnt:CurrentTime>2026-01-01T00:00:00Z</wsnt:CurrentTime>
+</wsnt:RenewResponse>''',
+    'GetProfiles': '''<trt:GetProfilesResponse>
+<trt:Profiles token="profile_1" fixed="true"><tt:Name>main</tt:Name>
+<tt:VideoEncoderConfiguration token="encoder_1"><tt:Name>main</tt:Name><tt:UseCount>1</tt:UseCount>
+<tt:Encoding>H264</tt:Encoding><tt:Resolution><tt:Width>1920</tt:Width><tt:Height>1080</tt:Height></tt:Resolution>
+<tt:Quality>5</tt:Quality></tt:VideoEncoderConfiguration></trt:Profiles>
+<trt:Profiles token="profile_2" fixed="true"><tt:Name>sub</tt:Name></trt:Profiles>
+</trt:GetProfilesResponse>''',
+    'GetStreamUri': '''<trt:GetStreamUriResponse><trt:MediaUri>
+<tt:Uri>rtsp://%(host)s/%(token)s</tt:Uri><tt:InvalidAfterConnect>false</tt:InvalidAfterConnect>
+<tt:InvalidAfterReboot>false</tt:InvalidAfterReboot><tt:Timeout>PT0S</tt:Timeout>
+</trt:MediaUri></trt:GetStreamUriResponse>''',
+    'GetSnapshotUri': '''<trt:GetSnapshotUriResponse><trt:MediaUri>
+<tt:Uri>%(base)s/%(snapshot_path)s/%(token)s.jpg</tt:Uri><tt:InvalidAfterConnect>false</tt:InvalidAfterConnect>
+<tt:InvalidAfterReboot>false</tt:InvalidAfterReboot><tt:Timeout>PT0S</tt:Timeout>
+</trt:MediaUri></trt:GetSnapshotUriResponse>''',
+    'FindRecordings': '''<tse:FindRecordingsResponse>
+<tse:SearchToken>search_1</tse:SearchToken></tse:FindRecordingsResponse>''',
+    'FindEvents': '''<tse:FindEventsResponse>
+<tse:SearchToken>search_1</tse:SearchToken></tse:FindEventsResponse>''',
+    'GetRecordingSearchResults': '''<tse:GetRecordingSearchResultsResponse>
+<tse:ResultList><tt:SearchState>%(state)s</tt:SearchState>%(results)s
+</tse:ResultList></tse:GetRecordingSearchResultsResponse>''',
+    'GetEventSearchResults': '''<tse:GetEventSearchResultsResponse>
+<tse:ResultList><tt:SearchState>%(state)s</tt:SearchState>%(results)s
+</tse:ResultList></tse:GetEventSearchResultsResponse>''',
+    'EndSearch': '''<tse:EndSearchResponse>
+<tse:Endpoint>2026-01-01T00:00:00Z</tse:Endpoint></tse:EndSearchResponse>''',
+    'GetRecordingSummary': '''<tse:GetRecordingSummaryResponse><tse:Summary>
+<tt:DataFrom>2026-01-01T00:00:00Z</tt:DataFrom><tt:DataUntil>%(data_until)s</tt:DataUntil>
+<tt:NumberRecordings>%(recording_count)d</tt:NumberRecordings>
+</tse:Summary></tse:GetRecordingSummaryResponse>''',
+    'GetRecordingConfiguration': '''<trc:GetRecordingConfigurationResponse>
+<trc:RecordingConfiguration>%(source)s<tt:Content>%(content)s</tt:Content>
+<tt:MaximumRetentionTime>PT0S</tt:MaximumRetentionTime>
+</trc:RecordingConfiguration></trc:GetRecordingConfigurationResponse>''',
+    'GetTrackConfiguration': '''<trc:GetTrackConfigurationResponse>
+<trc:TrackConfiguration><tt:TrackType>Video</tt:TrackType>
+<tt:Description>%(description)s</tt:Description>
+</trc:TrackConfiguration></trc:GetTrackConfigurationResponse>''',
+    'GetVideoEncoderConfigurations': '''<trt:GetVideoEncoderConfigurationsResponse>
+%(encoders)s</trt:GetVideoEncoderConfigurationsResponse>''',
+    'GetVideoEncoderConfigurationOptions': '''<trt:GetVideoEncoderConfigurationOptionsResponse>
+<trt:Options><tt:QualityRange><tt:Min>1</tt:Min><tt:Max>10</tt:Max></tt:QualityRange>
+<tt:H264><tt:ResolutionsAvailable><tt:Width>1920</tt:Width><tt:Height>1080</tt:Height></tt:ResolutionsAvailable>
+<tt:ResolutionsAvailable><tt:Width>1280</tt:Width><tt:Height>720</tt:Height></tt:ResolutionsAvailable>
+<tt:ResolutionsAvailable><tt:Width>640</tt:Width><tt:Height>360</tt:Height></tt:ResolutionsAvailable>
+<tt:GovLengthRange><tt:Min>1</tt:Min><tt:Max>300</tt:Max></tt:GovLengthRange>
+<tt:FrameRateRange><tt:Min>1</tt:Min><tt:Max>30</tt:Max></tt:FrameRateRange>
+<tt:EncodingIntervalRange><tt:Min>1</tt:Min><tt:Max>10</tt:Max></tt:EncodingIntervalRange>
+<tt:H264ProfilesSupported>Baseline</tt:H264ProfilesSupported>
+<tt:H264ProfilesSupported>Main</tt:H264ProfilesSupported></tt:H264>
+<tt:Extension><tt:H264><tt:ResolutionsAvailable><tt:Width>1920</tt:Width><tt:Height>1080</tt:Height></tt:ResolutionsAvailable>
+<tt:GovLengthRange><tt:Min>1</tt:Min><tt:Max>300</tt:Max></tt:GovLengthRange>
+<tt:FrameRateRange><tt:Min>1</tt:Min><tt:Max>30</tt:Max></tt:FrameRateRange>
+<tt:EncodingIntervalRange><tt:Min>1</tt:Min><tt:Max>10</tt:Max></tt:EncodingIntervalRange>
+<tt:H264ProfilesSupported>Main</tt:H264ProfilesSupported>
+<tt:BitrateRange><tt:Min>64</tt:Min><tt:Max>8192</tt:Max></tt:BitrateRange></tt:H264></tt:Extension>
+</trt:Options></trt:GetVideoEncoderConfigurationOptionsResponse>''',
+    'GetReplayUri': '''<trp:GetReplayUriResponse>
+<trp:Uri>rtsp://%(host)s/replay/%(recording)s</trp:Uri></trp:GetReplayUriResponse>''',
+    'GetReplayConfiguration': '''<trp:GetReplayConfigurationResponse>
+<trp:Configuration><tt:SessionTimeout>%(session_timeout)s</tt:SessionTimeout>
+</trp:Configuration></trp:GetReplayConfigurationResponse>''',
+}
+
+# Video encoder configurations of `FakeCamera.encoders`
+ENCODER = '''<trt:Configurations token="%(token)s"><tt:Name>%(token)s</tt:Name>
+<tt:UseCount>1</tt:UseCount><tt:Encoding>H264</tt:Encoding>
+<tt:Resolution><tt:Width>%(Width)s</tt:Width><tt:Height>%(Height)s</tt:Height></tt:Resolution>
+<tt:Quality>%(Quality)s</tt:Quality><tt:RateControl><tt:FrameRateLimit>%(FrameRateLimit)s</tt:FrameRateLimit>
+<tt:EncodingInterval>1</tt:EncodingInterval><tt:BitrateLimit>%(BitrateLimit)s</tt:BitrateLimit></tt:RateControl>
+<tt:H264><tt:GovLength>%(GovLength)s</tt:GovLength><tt:H264Profile>Main</tt:H264Profile></tt:H264>
+<tt:Multicast><tt:Address><tt:Type>IPv4</tt:Type><tt:IPv4Address>0.0.0.0</tt:IPv4Address></tt:Address>
+<tt:Port>0</tt:Port><tt:TTL>1</tt:TTL><tt:AutoStart>false</tt:AutoStart></tt:Multicast>
+<tt:SessionTimeout>PT60S</tt:SessionTimeout></trt:Configurations>'''
+
+# Fields of the encoders changed by SetVideoEncoderConfiguration
+ENCODER_FIELDS = ('Width', 'Height', 'Quality', 'FrameRateLimit',
+                  'BitrateLimit', 'GovLength')
+
+SOURCE = '''<tt:Source><tt:SourceId>source_1</tt:SourceId><tt:Name>cam</tt:Name>
+<tt:Location>lobby</tt:Location><tt:Description>cam</tt:Description>
+<tt:Address>http://cam/onvif/device_service</tt:Address></tt:Source>'''
+
+# Recordings of `FakeCamera.recordings`, for the recording searches
+RECORDING = '''<tt:RecordingInformation><tt:RecordingToken>%(token)s</tt:RecordingToken>
+%(source)s<tt:EarliestRecording>2026-01-01T00:00:00Z</tt:EarliestRecording>
+<tt:LatestRecording>%(latest)s</tt:LatestRecording><tt:Content>%(content)s</tt:Content>
+%(tracks)s<tt:RecordingStatus>Recording</tt:RecordingStatus></tt:RecordingInformation>'''
+
+TRACK = '''<tt:Track><tt:TrackToken>%(token)s</tt:TrackToken><tt:TrackType>Video</tt:TrackType>
+<tt:Description>%(description)s</tt:Description><tt:DataFrom>2026-01-01T00:00:00Z</tt:DataFrom>
+<tt:DataTo>%(latest)s</tt:DataTo></tt:Track>'''
+
+# Results of the searches, numbered by %(index)d
+SEARCH_RESULTS = {
+    'GetRecordingSearchResults': '''<tt:RecordingInformation>
+<tt:RecordingToken>rec_%(index)d</tt:RecordingToken>
+<tt:Content>Recording %(index)d</tt:Content>
+<tt:RecordingStatus>Stopped</tt:RecordingStatus></tt:RecordingInformation>''',
+    'GetEventSearchResults': '''<tt:Result>
+<tt:RecordingToken>rec_1</tt:RecordingToken><tt:TrackToken>track_1</tt:TrackToken>
+<tt:Time>2026-01-01T00:00:%(second)02dZ</tt:Time><tt:StartStateEvent>false</tt:StartStateEvent>
+</tt:Result>''',
+}
+
+
+MESSAGE = '''<wsnt:NotificationMessage>
+<wsnt:Topic Dialect="http://www.onvif.org/ver10/tev/topicExpression/ConcreteSet">tns1:VideoSource/MotionAlarm</wsnt:Topic>
+<wsnt:Message><tt:Message UtcTime="2026-01-01T00:00:00Z" PropertyOperation="Changed">
+<tt:Source><tt:SimpleItem Name="Source" Value="video_1"/></tt:Source>
+<tt:Data><tt:SimpleItem Name="State" Value="true"/></tt:Data>
+</tt:Message></wsnt:Message></wsnt:NotificationMessage>'''
+
+
+# Bytes of the fake snapshots, framed as a JPEG
+JPEG = '\xff\xd8' + 'snapshot' * 4096 + '\xff\xd9'
+
+DIGEST_REALM = 'fake'
+DIGEST_NONCE = 'c2e3d5f0a1'
+
+AUTH_PARAM = re.compile(r'(\w+)="?([^",]*)"?')
+
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+class FakeCameraHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one segment, Nagle would delay keep-alive replies
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def authorized(self):
+        camera = self.server.camera
+        value = self.headers.get('Authorization', '')
+        if not value.startswith('Digest '):
+            return False
+        params = dict(AUTH_PARAM.findall(value[7:]))
+        ha1 = md5('%s:%s:%s' % (camera.user, DIGEST_REALM, camera.passwd))
+        ha2 = md5('GET:%s' % params.get('uri'))
+        expected = md5(':'.join((ha1, DIGEST_NONCE, params.get('nc', ''),
+                                 params.get('cnonce', ''), 'auth', ha2)))
+        return params.get('response') == expected
+
+    def do_GET(self):
+        camera = self.server.camera
+        camera.record('GET', self.path, '')
+        if camera.delay:
+            time.sleep(camera.delay)
+        match = re.match(r'/(\w+)/\w+\.jpg$', self.path)
+        if camera.digest and not self.authorized():
+            with camera.lock:
+                camera.challenges += 1
+            status, data = 401, 'Unauthorized'
+        elif match is None or match.group(1) != camera.snapshot_path:
+            status, data = 404, 'Not found'
+        else:
+            status, data = 200, camera.snapshot
+
+        self.send_response(status)
+        if status == 401:
+            self.send_header('WWW-Authenticate',
+                             'Digest realm="%s", qop="auth", nonce="%s"'
+                             % (DIGEST_REALM, DIGEST_NONCE))
+        self.send_header('Content-Type', 'image/jpeg')
+        if status == 200 and camera.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(data), 8192):
+                chunk = data[i:i + 8192]
+                self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write('0\r\n\r\n')
+            return
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        operation = re.search(r'<(?:\w+:)?Body[^>]*>\s*<(?:\w+:)?(\w+)',
+                              body).group(1)
+        camera = self.server.camera
+        camera.record(operation, self.path, body)
+        if camera.delay:
+            time.sleep(camera.delay)
+        if camera.set_delay and operation.startswith('Set'):
+            time.sleep(camera.set_delay)
+        with camera.lock:
+            drop = camera.dropped.get(operation, 0)
+            if drop:
+                camera.dropped[operation] = drop - 1
+        if drop:
+            # Closed without a response
+            self.close_connection = 1
+            return
+        if operation in camera.no_content:
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        status = 200
+        if operation in camera.faults:
+            status = 500
+            content = FAULT % camera.faults[operation]
+        elif operation == 'SetVideoEncoderConfiguration' and \
+             not camera.set_encoder(body):
+            status = 500
+            content = FAULT % 'Configuration locked'
+        else:
+            content = camera.responses.get(operation,
+                                           '<%sResponse/>' % operation)
+            variables = camera.variables(self.headers.get('Host'))
+            token = re.search(r'ProfileToken>([^<]*)<', body)
+            variables['token'] = token.group(1) if token else 'stream'
+            if operation == 'PullMessages':
+                limit = re.search(r'MessageLimit>(\d+)<', body)
+                variables['messages'] = MESSAGE * camera.pending_events(
+                        int(limit.group(1)) if limit else None)
+            elif operation in ('FindRecordings', 'FindEvents'):
+                camera.returned = 0
+            elif operation in SEARCH_RESULTS:
+                limit = int(re.search(r'MaxResults>(\d+)<', body).group(1))
+                first, count, done = camera.next_results(limit)
+                if camera.recordings is not None and \
+                   operation == 'GetRecordingSearchResults':
+                    variables['results'] = ''.join(
+                            camera.recording_information(recording)
+                            for recording in
+                            camera.recordings[first:first + count])
+                else:
+                    variables['results'] = ''.join(
+                            SEARCH_RESULTS[operation] %
+                            {'index': index, 'second': index % 60}
+                            for index in range(first, first + count))
+                variables['state'] = 'Completed' if done else 'Searching'
+            token = re.search(r'RecordingToken>([^<]*)<', body)
+            if token:
+                variables['recording'] = token.group(1)
+            if token and camera.recordings is not None:
+                recording = [ r for r in camera.recordings
+                              if r['token'] == token.group(1) ][0]
+                variables['content'] = recording['content']
+                track = re.search(r'TrackToken>([^<]*)<', body)
+                if track:
+                    variables['description'] = \
+                            recording['tracks'][track.group(1)]
+            content = content % variables
+        data = ENVELOPE % content
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/soap+xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeCameraServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, *args, **kwargs):
+        BaseHTTPServer.HTTPServer.__init__(self, *args, **kwargs)
+        self.connections = set()
+
+    def process_request(self, request, client_address):
+        self.connections.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        self.connections.discard(request)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections, nothing to report
+        pass
+
+    def close_connections(self):
+        for request in list(self.connections):
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class FakeCamera(object):
+    '''
+    Fake ONVIF camera listening on the loopback interface
+
+    >>> camera = FakeCamera().start()
+    >>> mycam = ONVIFCamera(camera.host, camera.port, 'admin', '12345')
+    >>> camera.calls
+    ['GetCapabilities', 'CreatePullPointSubscription']
+    >>> camera.stop()
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0, hostname='fake'):
+        self.server = FakeCameraServer((host, port), FakeCameraHandler)
+        self.server.camera = self
+        self.host, self.port = self.server.server_address
+        self.delay = delay
+        self.hostname = hostname
+        self.serial = 'SN0001'
+        self.firmware = '1.0'
+        self.responses = dict(RESPONSES)
+        # Snapshots: path of their URIs, image, Digest authentication
+        self.snapshot_path = 'snapshot'
+        self.snapshot = JPEG
+        self.digest = False
+        self.chunked = False
+        self.user = 'admin'
+        self.passwd = '12345'
+        self.challenges = 0
+        self.faults = { }
+        # Operations answered with 204 No Content, and number of requests
+        # of an operation whose connection is closed without a response
+        self.no_content = set()
+        self.dropped = { }
+        self.calls = [ ]
+        self.bodies = [ ]
+        self.paths = [ ]
+        # Notification messages queued for PullMessages
+        self.events = 0
+        # Results of the searches: found so far, returned, and whether
+        # the search is completed
+        self.found = 0
+        self.returned = 0
+        self.search_completed = True
+        # Recordings: dicts of token, content, latest (end of the data)
+        # and tracks (token => description), None for numbered results
+        self.recordings = None
+        # Video encoder configurations, and the tokens of the ones whose
+        # SetVideoEncoderConfiguration fails
+        self.encoders = [
+            {'token': 'encoder_1', 'Width': 1920, 'Height': 1080,
+             'Quality': 5, 'FrameRateLimit': 25, 'BitrateLimit': 4096,
+             'GovLength': 50},
+            {'token': 'encoder_2', 'Width': 640, 'Height': 360,
+             'Quality': 5, 'FrameRateLimit': 15, 'BitrateLimit': 512,
+             'GovLength': 30}]
+        self.locked = set()
+        # Seconds a Set operation takes, e.g. restarting an encoder
+        self.set_delay = 0
+        # RTSP session timeout of the replays
+        self.session_timeout = 'PT60S'
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def variables(self, host=None):
+        # Answer with the address the client used, so that a camera
+        # bound to 0.0.0.0 can stand for many devices on 127.x.y.z
+        host = host or '%s:%d' % (self.host, self.port)
+        now = time.gmtime()
+        return {'base': 'http://%s' % host,
+                'host': host.split(':')[0], 'hostname': self.hostname,
+                'serial': self.serial, 'firmware': self.firmware,
+                'snapshot_path': self.snapshot_path,
+                'messages': '', 'source': SOURCE,
+                'session_timeout': self.session_timeout,
+                'encoders': ''.join(ENCODER % encoder
+                                    for encoder in self.encoders),
+                'recording_count': len(self.recordings or ()),
+                'data_until': max([ r['latest'] for r in self.recordings ]
+                                  if self.recordings
+                                  else ['2026-01-01T00:00:00Z']),
+                'year': now.tm_year, 'month': now.tm_mon, 'day': now.tm_mday,
+                'hour': now.tm_hour, 'minute': now.tm_min,
+                'second': now.tm_sec}
+
+    def pending_events(self, limit=None):
+        with self.lock:
+            count = self.events if limit is None else min(self.events, limit)
+            self.events -= count
+            return count
+
+    def next_results(self, limit):
+        '''(index of the first, count, completed) of the next results'''
+        with self.lock:
+            first = self.returned
+            found = self.found if self.recordings is None \
+                    else len(self.recordings)
+            count = min(found - first, limit)
+            self.returned += count
+            return first, count, self.search_completed
+
+    def recording_information(self, recording):
+        tracks = ''.join(TRACK % {'token': token, 'description': description,
+                                  'latest': recording['latest']}
+                         for token, description in
+                         sorted(recording['tracks'].items()))
+        return RECORDING % dict(recording, tracks=tracks, source=SOURCE)
+
+    def set_encoder(self, body):
+        '''Applies a SetVideoEncoderConfiguration, False when locked'''
+        token = re.search(r'token="([^"]*)"', body)
+        if token is None:
+            return True
+        if token.group(1) in self.locked:
+            return False
+        with self.lock:
+            encoder = [ e for e in self.encoders
+                        if e['token'] == token.group(1) ][0]
+            for name in ENCODER_FIELDS:
+                value = re.search(r'%s>([^<]*)<' % name, body)
+                if value:
+                    encoder[name] = value.group(1)
+        return True
+
+    def record(self, operation, path, body):
+        with self.lock:
+            self.calls.append(operation)
+            self.bodies.append(body)
+            self.paths.append(path)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        # Wake up the handlers waiting on keep-alive connections
+        self.server.close_connections()
+
+
+PROBE_MATCHES = '''<?xml version="1.0" encoding="UTF-8"?>
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope"
+ xmlns:a="http://schemas.xmlsoap.org/ws/2004/08/addressing"
+ xmlns:d="http://schemas.xmlsoap.org/ws/2005/04/discovery"
+ xmlns:dn="http://www.onvif.org/ver10/network/wsdl">
+<s:Header><a:RelatesTo>%(relates_to)s</a:RelatesTo></s:Header>
+<s:Body><d:ProbeMatches><d:ProbeMatch>
+<a:EndpointReference><a:Address>%(endpoint)s</a:Address></a:EndpointReference>
+<d:Types>dn:NetworkVideoTransmitter</d:Types>
+<d:Scopes>onvif://www.onvif.org/name/fake onvif://www.onvif.org/hardware/fake</d:Scopes>
+<d:XAddrs>%(xaddrs)s</d:XAddrs>
+<d:MetadataVersion>1</d:MetadataVersion>
+</d:ProbeMatch></d:ProbeMatches></s:Body></s:Envelope>'''
+
+
+class FakeResponder(object):
+    '''
+    Simulated WS-Discovery devices answering Probes on a loopback UDP
+    port. One probe out of `every` is answered, twice like devices
+    repeating their UDP replies, by a device of its own whose XAddr is
+    `xaddr`.
+    '''
+
+    def __init__(self, host='0.0.0.0', port=0, every=1,
+                 xaddr='http://127.0.0.1/onvif/device_service'):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.1)
+        self.port = self.sock.getsockname()[1]
+        self.every = every
+        self.xaddr = xaddr
+        self.probes = 0
+        self.answered = 0
+        self.running = False
+        self.thread = None
+
+    def serve(self):
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            self.probes += 1
+            if self.probes % self.every:
+                continue
+            relates_to = re.search('MessageID>([^<]*)<', data).group(1)
+            reply = PROBE_MATCHES % {
+                    'relates_to': relates_to, 'xaddrs': self.xaddr,
+                    'endpoint': 'urn:uuid:00000000-0000-0000-0000-%012d'
+                                % self.probes}
+            self.answered += 1
+            for _ in range(2):
+                self.sock.sendto(reply, address)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
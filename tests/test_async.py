@@ -0,0 +1,140 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import unittest
+
+from onvif import AsyncONVIFCamera, ONVIFError
+from onvif.asyncclient import AsyncLoop, HTTPResponse
+
+from fake_camera import FakeCamera
+
+class TestAsyncCamera(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+        self.loop = AsyncLoop()
+        self.cam = AsyncONVIFCamera(self.camera.host, self.camera.port,
+                                    'admin', '12345', loop=self.loop)
+
+    def tearDown(self):
+        self.camera.stop()
+        self.loop.close()
+
+    def test_no_io_on_construction(self):
+        self.assertEqual(self.camera.calls, [ ])
+
+    def test_operation(self):
+        pending = self.cam.devicemgmt.GetHostname()
+        self.assertFalse(pending.done())
+        self.assertEqual(pending.result(timeout=5).Name, 'fake')
+
+    def test_credentials(self):
+        self.cam.devicemgmt.GetHostname().result(timeout=5)
+        self.assertTrue('<wsse:Username>admin</wsse:Username>'
+                        in self.camera.bodies[-1])
+
+    def test_callback(self):
+        names = [ ]
+        self.cam.devicemgmt.GetHostname(callback=lambda ret: names.append(ret.Name))
+        self.loop.run()
+        self.assertEqual(names, ['fake'])
+
+    def test_update_xaddrs(self):
+        xaddrs = self.cam.update_xaddrs().result(timeout=5)
+        self.assertEqual(self.camera.calls,
+                         ['GetCapabilities', 'CreatePullPointSubscription'])
+        self.assertTrue(xaddrs['http://www.onvif.org/ver10/media/wsdl']
+                        .endswith('/onvif/media'))
+
+    def test_lazy_discovery(self):
+        media = self.cam.create_media_service()
+        profiles = media.GetProfiles().result(timeout=5)
+        self.assertEqual([ p._token for p in profiles ],
+                         ['profile_1', 'profile_2'])
+        self.assertEqual(self.camera.calls, ['GetCapabilities', 'GetProfiles'])
+
+    def test_concurrent_calls(self):
+        pendings = [ self.cam.devicemgmt.GetHostname() for _ in range(50) ]
+        results = self.loop.gather(pendings).result(timeout=10)
+        self.assertEqual([ r.Name for r in results ], ['fake'] * 50)
+
+    def test_fault(self):
+        self.camera.faults['GetHostname'] = 'Not authorized'
+        with self.assertRaises(ONVIFError) as ctx:
+            self.cam.devicemgmt.GetHostname().result(timeout=5)
+        self.assertEqual(str(ctx.exception), 'Not authorized')
+
+    def test_catch(self):
+        self.camera.faults['GetHostname'] = 'Not authorized'
+        pending = self.cam.devicemgmt.GetHostname() \
+                      .catch(lambda err: self.cam.devicemgmt.GetSystemDateAndTime())
+        self.assertEqual(pending.result(timeout=5).DateTimeType, 'Manual')
+
+    def test_connection_refused(self):
+        self.camera.stop()
+        with self.assertRaises(ONVIFError):
+            self.cam.devicemgmt.GetHostname().result(timeout=5)
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.cam.devicemgmt.GetHostname().result(timeout=5)
+        self.assertEqual(self.loop.stats(),
+                         {'created': 1, 'reused': 2, 'idle': 1})
+
+    def test_dropped_connection(self):
+        self.cam.devicemgmt.GetHostname().result(timeout=5)
+        # The camera drops the idle connection
+        self.camera.server.close_connections()
+        self.assertEqual(self.cam.devicemgmt.GetHostname().result(timeout=5)
+                         .Name, 'fake')
+        self.assertEqual(self.loop.stats()['created'], 2)
+
+    def test_host_name(self):
+        cam = AsyncONVIFCamera('localhost', self.camera.port, 'admin',
+                               '12345', loop=self.loop)
+        self.assertEqual(cam.devicemgmt.GetHostname().result(timeout=5).Name,
+                         'fake')
+        # Resolved off the loop, once
+        self.assertTrue(('localhost', self.camera.port) in self.loop.addresses)
+        cam.devicemgmt.GetHostname().result(timeout=5)
+        self.assertEqual(len(self.camera.calls), 2)
+
+    def test_to_dict(self):
+        ret = self.cam.devicemgmt.GetHostname().result(timeout=5)
+        self.assertEqual(self.cam.to_dict(ret)['Name'], 'fake')
+
+class TestHTTPResponse(unittest.TestCase):
+
+    RESPONSE = ('HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                '5;ext=1\r\nHello\r\n7\r\n, world\r\n0\r\n'
+                'X-Trailer: 1\r\n\r\n')
+
+    def test_chunked(self):
+        for step in (1, 3, len(self.RESPONSE)):
+            response = HTTPResponse()
+            for i in range(0, len(self.RESPONSE), step):
+                self.assertFalse(response.complete)
+                response.feed(self.RESPONSE[i:i + step])
+            self.assertTrue(response.complete)
+            self.assertEqual(response.body, 'Hello, world')
+            self.assertTrue(response.keep_alive())
+
+    def test_length(self):
+        response = HTTPResponse()
+        response.feed('HTTP/1.1 200 OK\r\nContent-Length: 4\r\n'
+                      'Connection: close\r\n\r\nab')
+        self.assertFalse(response.complete)
+        response.feed('cd')
+        self.assertEqual(response.body, 'abcd')
+        self.assertFalse(response.keep_alive())
+
+    def test_eof(self):
+        response = HTTPResponse()
+        response.feed('HTTP/1.0 200 OK\r\n\r\nab')
+        response.feed('cd')
+        self.assertTrue(response.eof())
+        self.assertEqual(response.body, 'abcd')
+        self.assertFalse(response.keep_alive())
+
+if __name__ == '__main__':
+    unittest.main()
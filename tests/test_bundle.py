@@ -0,0 +1,123 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from onvif import compile_wsdl, bundle as bundle_module
+from onvif.bundle import WSDLBundle, BUNDLE_NAME, BUNDLE_FORMAT
+from onvif.registry import WSDLRegistry
+
+WSDL_DIR = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'wsdl')
+
+class TestBundle(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cls.wsdl_dir = os.path.join(cls.tmp, 'wsdl')
+        shutil.copytree(WSDL_DIR, cls.wsdl_dir)
+        cls.path = os.path.join(cls.wsdl_dir, BUNDLE_NAME)
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            compile_wsdl.main(['-w', cls.wsdl_dir, 'replay.wsdl'])
+        finally:
+            cls.output, sys.stdout = sys.stdout.getvalue(), stdout
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    def copy(self):
+        '''Copy of the WSDL directory along with its bundle'''
+        wsdl_dir = os.path.join(tempfile.mkdtemp(dir=self.tmp), 'wsdl')
+        shutil.copytree(self.wsdl_dir, wsdl_dir)
+        return wsdl_dir
+
+    def test_write(self):
+        self.assertTrue('replay.wsdl' in self.output)
+        self.assertTrue(('Wrote %s' % self.path) in self.output)
+        bundle = WSDLBundle(self.path)
+        try:
+            self.assertEqual(bundle.entries.keys(), ['replay.wsdl'])
+            self.assertTrue(bundle.is_valid(self.wsdl_dir))
+            definitions = bundle.load('replay.wsdl')
+            self.assertTrue('GetReplayUri' in
+                            definitions.services[0].ports[0].methods)
+            self.assertEqual(bundle.load('ptz.wsdl'), None)
+        finally:
+            bundle.close()
+
+    def test_registry(self):
+        registry = WSDLRegistry()
+        template = registry.get_template(
+                os.path.join(self.wsdl_dir, 'replay.wsdl'))
+        self.assertTrue(registry.bundles[self.wsdl_dir] is not None)
+        self.assertTrue('GetReplayUri' in
+                        template.wsdl.services[0].ports[0].methods)
+        # Clones don't drag the preloaded definitions along
+        self.assertEqual(template.options.cachingpolicy, 0)
+        registry.clear()
+
+    def test_stale_digest(self):
+        wsdl_dir = self.copy()
+        with open(os.path.join(wsdl_dir, 'replay.wsdl'), 'a') as fp:
+            fp.write('<!-- changed -->\n')
+        path = os.path.join(wsdl_dir, BUNDLE_NAME)
+        bundle = WSDLBundle(path)
+        try:
+            self.assertFalse(bundle.is_valid(wsdl_dir))
+            # Still the one of the documents it was built from
+            self.assertTrue(bundle.is_valid(self.wsdl_dir))
+        finally:
+            bundle.close()
+        registry = WSDLRegistry()
+        self.assertRaises(ValueError, registry.load_bundle, path)
+        # Ignored, the documents are parsed
+        self.assertEqual(registry.get_bundle(wsdl_dir), None)
+        template = registry.get_template(os.path.join(wsdl_dir,
+                                                      'replay.wsdl'))
+        self.assertTrue('GetReplayUri' in
+                        template.wsdl.services[0].ports[0].methods)
+        registry.clear()
+
+    def test_stats(self):
+        bundle = WSDLBundle(self.path)
+        digest = bundle_module.wsdl_digest
+        try:
+            # Same times and sizes, nothing hashed
+            bundle_module.wsdl_digest = None
+            self.assertTrue(bundle.is_valid(self.wsdl_dir))
+            bundle_module.wsdl_digest = digest
+            # Touched, hashed and still the same documents
+            wsdl_dir = self.copy()
+            os.utime(os.path.join(wsdl_dir, 'replay.wsdl'), (0, 0))
+            self.assertTrue(bundle.is_valid(wsdl_dir))
+        finally:
+            bundle_module.wsdl_digest = digest
+            bundle.close()
+
+    def test_mismatched(self):
+        bundle = WSDLBundle(self.path)
+        try:
+            self.assertTrue(bundle.is_valid())
+            version = bundle.header['suds']
+            bundle.header['suds'] = '0.0'
+            self.assertFalse(bundle.is_valid())
+            bundle.header['suds'] = version
+            bundle.header['format'] = BUNDLE_FORMAT + 1
+            self.assertFalse(bundle.is_valid())
+        finally:
+            bundle.close()
+        path = os.path.join(self.tmp, 'garbage.bundle')
+        with open(path, 'wb') as fp:
+            fp.write('not a bundle')
+        self.assertRaises(ValueError, WSDLBundle, path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import time
+import threading
+import unittest
+
+from onvif import ONVIFCamera, AsyncONVIFCamera, ONVIFError
+from onvif.asyncclient import AsyncLoop
+from onvif.cache import ResponseCache
+
+from fake_camera import FakeCamera
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def media(self, **kwargs):
+        self.cache = ResponseCache(**kwargs)
+        cam = ONVIFCamera(self.camera.host, self.camera.port, 'admin', '12345',
+                          lazy=True, response_cache=self.cache)
+        return cam.create_media_service()
+
+    def count(self, operation):
+        return self.camera.calls.count(operation)
+
+    def test_hit(self):
+        media = self.media()
+        first = media.GetProfiles()
+        first[0].Name = 'changed'
+        second = media.GetProfiles()
+        self.assertEqual(self.count('GetProfiles'), 1)
+        # Every hit is a reply of its own
+        self.assertEqual(second[0].Name, 'main')
+        self.assertEqual(second[0]._token, 'profile_1')
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertTrue(stats['bytes'] > 0)
+
+    def test_params(self):
+        media = self.media()
+        setup = {'Stream': 'RTP-Unicast', 'Transport': {'Protocol': 'RTSP'}}
+        media.GetStreamUri({'StreamSetup': setup, 'ProfileToken': 'profile_1'})
+        media.GetStreamUri({'ProfileToken': 'profile_1', 'StreamSetup': setup})
+        self.assertEqual(self.count('GetStreamUri'), 1)
+        media.GetStreamUri({'ProfileToken': 'profile_2', 'StreamSetup': setup})
+        self.assertEqual(self.count('GetStreamUri'), 2)
+
+    def test_ttl(self):
+        media = self.media(ttl=0.2, ttls={'GetStreamUri': 0})
+        media.GetProfiles()
+        media.GetProfiles()
+        time.sleep(0.3)
+        media.GetProfiles()
+        self.assertEqual(self.count('GetProfiles'), 2)
+        media.GetStreamUri({'ProfileToken': 'profile_1'})
+        media.GetStreamUri({'ProfileToken': 'profile_1'})
+        self.assertEqual(self.count('GetStreamUri'), 2)
+
+    def test_invalidation(self):
+        media = self.media()
+        media.GetProfiles()
+        media.SetVideoEncoderConfiguration({'ForcePersistence': True})
+        media.GetProfiles()
+        self.assertEqual(self.count('GetProfiles'), 2)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+    def test_invalidated_in_flight(self):
+        media = self.media()
+        self.camera.delay = 0.2
+        thread = threading.Thread(target=media.GetProfiles)
+        thread.start()
+        time.sleep(0.1)
+        self.cache.invalidate(media.xaddr)
+        thread.join()
+        self.camera.delay = 0
+        media.GetProfiles()
+        self.assertEqual(self.count('GetProfiles'), 2)
+        # Nothing left behind for the service
+        self.cache.invalidate(media.xaddr)
+        self.assertEqual(self.cache.flights, { })
+        self.assertFalse(media.xaddr in self.cache.xaddr_keys)
+
+    def test_credentials(self):
+        # Users don't get the replies cached for others
+        media = self.media()
+        media.GetProfiles()
+        other = ONVIFCamera(self.camera.host, self.camera.port, 'operator',
+                            'secret', lazy=True, response_cache=self.cache)
+        other.create_media_service().GetProfiles()
+        self.assertEqual(self.count('GetProfiles'), 2)
+        media.GetProfiles()
+        self.assertEqual(self.count('GetProfiles'), 2)
+
+    def test_single_flight(self):
+        media = self.media()
+        self.camera.delay = 0.2
+        results = [ ]
+        def get():
+            results.append(media.GetProfiles())
+        threads = [ threading.Thread(target=get) for _ in range(8) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.count('GetProfiles'), 1)
+        self.assertEqual(len(results), 8)
+        self.assertEqual(len(set(id(ret) for ret in results)), 8)
+        self.assertEqual(self.cache.stats()['coalesced'], 7)
+
+    def test_fault_not_cached(self):
+        media = self.media()
+        self.camera.faults['GetProfiles'] = 'Not now'
+        self.assertRaises(ONVIFError, media.GetProfiles)
+        del self.camera.faults['GetProfiles']
+        media.GetProfiles()
+        self.assertEqual(self.count('GetProfiles'), 2)
+
+    def test_max_bytes(self):
+        media = self.media(max_bytes=4000)
+        for i in range(10):
+            media.GetStreamUri({'ProfileToken': 'profile_%d' % i})
+        stats = self.cache.stats()
+        self.assertTrue(stats['bytes'] <= 4000)
+        self.assertTrue(stats['evictions'] > 0)
+        # Least recently used first
+        media.GetStreamUri({'ProfileToken': 'profile_9'})
+        media.GetStreamUri({'ProfileToken': 'profile_0'})
+        self.assertEqual(self.count('GetStreamUri'), 11)
+
+    def test_fast_decode(self):
+        media = self.media()
+        media.set_fast_decode()
+        self.assertEqual(media.GetProfiles()[0]['_token'], 'profile_1')
+        self.assertEqual(media.GetProfiles()[1]['Name'], 'sub')
+        self.assertEqual(self.count('GetProfiles'), 1)
+
+    def test_async(self):
+        self.cache = ResponseCache()
+        loop = AsyncLoop()
+        cam = AsyncONVIFCamera(self.camera.host, self.camera.port, 'admin',
+                               '12345', loop=loop, response_cache=self.cache)
+        media = cam.create_media_service()
+        # Identical requests in flight on the loop are sent once
+        pendings = [ media.GetProfiles() for _ in range(3) ]
+        profiles = loop.gather(pendings).result(5)
+        self.assertEqual([ len(p) for p in profiles ], [2, 2, 2])
+        self.assertFalse(profiles[1] is profiles[2])
+        self.assertEqual(self.count('GetProfiles'), 1)
+        self.assertEqual(self.cache.stats()['coalesced'], 2)
+        self.assertEqual(len(media.GetProfiles().result(5)), 2)
+        self.assertEqual(self.count('GetProfiles'), 1)
+        media.SetVideoEncoderConfiguration({'ForcePersistence': True}) \
+             .result(5)
+        media.GetProfiles().result(5)
+        self.assertEqual(self.count('GetProfiles'), 2)
+        loop.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from onvif import ONVIFCamera, ONVIFError
+from onvif.registry import wsdl_registry
+
+from fake_camera import FakeCamera
+
+class TestCamera(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def create_cam(self, **kwargs):
+        return ONVIFCamera(self.camera.host, self.camera.port,
+                           'admin', '12345', **kwargs)
+
+    def test_shared_wsdl(self):
+        self.create_cam().create_media_service()
+        stats = wsdl_registry.stats()
+        self.create_cam().create_media_service()
+        self.assertEqual(wsdl_registry.stats()['misses'], stats['misses'])
+        self.assertTrue(wsdl_registry.stats()['hits'] > stats['hits'])
+
+    def test_credentials(self):
+        # Services sharing a parsed WSDL send their own credentials
+        self.create_cam(lazy=True).devicemgmt.GetHostname()
+        self.assertTrue('<wsse:Username>admin</wsse:Username>'
+                        in self.camera.bodies[-1])
+        ONVIFCamera(self.camera.host, self.camera.port, 'operator', 'secret',
+                    lazy=True).devicemgmt.GetHostname()
+        self.assertTrue('<wsse:Username>operator</wsse:Username>'
+                        in self.camera.bodies[-1])
+
+    def test_lazy(self):
+        cam = self.create_cam(lazy=True)
+        self.assertEqual(self.camera.calls, [ ])
+        cam.create_media_service()
+        self.assertEqual(self.camera.calls, ['GetCapabilities'])
+        cam.create_pullpoint_service()
+        self.assertEqual(self.camera.calls,
+                         ['GetCapabilities', 'CreatePullPointSubscription'])
+
+    def test_lazy_discovery(self):
+        cam = self.create_cam(lazy=True)
+        self.camera.delay = 0.2
+        executor = ThreadPoolExecutor(max_workers=4)
+        try:
+            futures = [ executor.submit(cam.create_media_service)
+                        for _ in range(4) ]
+            time.sleep(0.1)
+            # Discovering doesn't hold the services lock
+            self.assertTrue(cam.services_lock.acquire(False))
+            cam.services_lock.release()
+            for future in futures:
+                future.result()
+        finally:
+            executor.shutdown()
+        # Discovered once for all of them
+        self.assertEqual(self.camera.calls, ['GetCapabilities'])
+        # Every service comes from the registry unless opted out in
+        # `use_services_template`
+        self.assertTrue(cam.create_replay_service().from_registry)
+        cam.use_services_template['replay'] = False
+        self.assertFalse(cam.create_replay_service().from_registry)
+        self.assertTrue(cam.media.from_registry)
+
+    def test_keep_alive(self):
+        cam = self.create_cam()
+        media = cam.create_media_service()
+        for _ in range(5):
+            cam.devicemgmt.GetHostname()
+            media.GetProfiles()
+        stats = cam.pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['reused'], stats['requests'] - 1)
+
+    def test_retry(self):
+        cam = self.create_cam(lazy=True)
+        cam.devicemgmt.GetHostname()
+        # Closed before the response: a Get operation is sent again on a
+        # new connection, others may have been applied
+        self.camera.dropped = {'GetHostname': 1, 'SetHostname': 1}
+        self.assertEqual(cam.devicemgmt.GetHostname().Name, 'fake')
+        self.assertEqual(self.camera.calls.count('GetHostname'), 3)
+        self.assertRaises(ONVIFError, cam.devicemgmt.SetHostname,
+                          {'Name': 'other'})
+        self.assertEqual(self.camera.calls.count('SetHostname'), 1)
+
+    def test_no_content(self):
+        cam = self.create_cam(lazy=True)
+        self.camera.no_content.add('SetHostname')
+        self.assertEqual(cam.devicemgmt.SetHostname({'Name': 'other'}), None)
+        cam.devicemgmt.set_fast_decode()
+        self.assertEqual(cam.devicemgmt.SetHostname({'Name': 'other'}), None)
+
+    def test_proxy(self):
+        cam = self.create_cam(lazy=True)
+        requests = cam.pool.stats()['requests']
+        # The camera stands for the proxy
+        cam.devicemgmt.ws_client.set_options(
+                proxy={'http': '%s:%d' % (self.camera.host, self.camera.port)},
+                username='admin', password='12345')
+        self.assertEqual(cam.devicemgmt.GetHostname().Name, 'fake')
+        self.assertTrue(self.camera.paths[-1].startswith('http://'))
+        self.assertEqual(cam.pool.stats()['requests'], requests)
+
+    def test_executor(self):
+        pool = ThreadPoolExecutor(max_workers=2)
+        cam = self.create_cam(executor=pool)
+        futures = [ cam.devicemgmt.GetHostname() for _ in range(10) ]
+        self.assertEqual([ f.result(timeout=5).Name for f in futures ],
+                         ['fake'] * 10)
+
+        self.camera.faults['GetHostname'] = 'Not authorized'
+        future = cam.devicemgmt.GetHostname()
+        self.assertTrue(isinstance(future.exception(timeout=5), ONVIFError))
+        pool.shutdown()
+
+    def test_operation_cache(self):
+        cam = self.create_cam()
+        operation = cam.devicemgmt.GetHostname
+        self.assertTrue(cam.devicemgmt.GetHostname is operation)
+        cam.update_auth(user='root')
+        self.assertFalse(cam.devicemgmt.GetHostname is operation)
+
+        other = FakeCamera(hostname='other').start()
+        try:
+            self.assertEqual(cam.devicemgmt.GetHostname().Name, 'fake')
+            cam.devicemgmt.set_xaddr('http://%s:%d/onvif/device_service'
+                                     % (other.host, other.port))
+            self.assertEqual(cam.devicemgmt.GetHostname().Name, 'other')
+        finally:
+            other.stop()
+
+    def test_operation_cache_cleared(self):
+        service = self.create_cam(lazy=True).devicemgmt
+        wrap = service.service_wrapper
+        def service_wrapper(func):
+            # Cleared while the wrapper is built
+            service.clear_operations()
+            return wrap(func)
+        service.service_wrapper = service_wrapper
+        operation = service.GetHostname
+        del service.service_wrapper
+        self.assertFalse('GetHostname' in service.operations)
+        self.assertFalse(service.GetHostname is operation)
+        self.assertTrue(service.GetHostname is service.GetHostname)
+
+    def test_concurrent_calls(self):
+        # Concurrent calls of services sharing a parsed WSDL keep their
+        # credentials and replies apart
+        other = FakeCamera(hostname='other').start()
+        other.user, other.passwd = 'operator', 'secret'
+        try:
+            cams = [ (self.create_cam(lazy=True), 'fake'),
+                     (ONVIFCamera(other.host, other.port, 'operator',
+                                  'secret', lazy=True), 'other') ]
+            def hostname(index):
+                cam, name = cams[index % 2]
+                return cam.devicemgmt.GetHostname().Name, name
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                for got, expected in executor.map(hostname, range(64)):
+                    self.assertEqual(got, expected)
+            for body in self.camera.bodies:
+                self.assertTrue('<wsse:Username>admin</wsse:Username>' in body)
+            for body in other.bodies:
+                self.assertTrue('<wsse:Username>operator</wsse:Username>'
+                                in body)
+        finally:
+            other.stop()
+
+    def test_anonymous(self):
+        # An anonymous service doesn't drop the credentials of the others
+        cam = ONVIFCamera(self.camera.host, self.camera.port, None, None,
+                          lazy=True)
+        cam.devicemgmt.GetHostname()
+        self.assertFalse('wsse:Security' in self.camera.bodies[-1])
+        self.create_cam(lazy=True).devicemgmt.GetHostname()
+        self.assertTrue('<wsse:Username>admin</wsse:Username>'
+                        in self.camera.bodies[-1])
+        cam.devicemgmt.GetHostname()
+        self.assertFalse('wsse:Security' in self.camera.bodies[-1])
+
+    def test_suds_unpatched(self):
+        # Other users of suds in the process keep its behaviour
+        from suds.bindings.binding import Binding
+        from suds.bindings.multiref import MultiRef
+        from suds.client import SoapClient
+        self.assertEqual(Binding.options.im_func.__module__,
+                         'suds.bindings.binding')
+        self.assertEqual(MultiRef.process.im_func.__module__,
+                         'suds.bindings.multiref')
+        self.assertEqual(SoapClient.invoke.im_func.__module__, 'suds.client')
+
+    def test_resolve_stream_uris(self):
+        cam = self.create_cam(lazy=True)
+        self.camera.faults['GetSnapshotUri'] = 'Not supported'
+        main, sub = cam.resolve_stream_uris()
+        self.assertEqual(main.token, 'profile_1')
+        self.assertEqual((main.encoding, main.width, main.height),
+                         ('H264', 1920, 1080))
+        self.assertEqual(main.stream_uri, 'rtsp://%s/profile_1' % self.camera.host)
+        self.assertEqual(sub.stream_uri, 'rtsp://%s/profile_2' % self.camera.host)
+        # Failed URIs don't fail the others
+        self.assertEqual((main.snapshot_uri, sub.snapshot_uri), (None, None))
+        self.assertEqual(sub.encoding, None)
+        self.assertEqual(self.camera.calls.count('GetProfiles'), 1)
+
+    def test_resolve_stream_uris_executor(self):
+        # The requests run on the executor of the camera, one worker
+        # is enough
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            cam = self.create_cam(lazy=True, executor=executor)
+            main, sub = cam.resolve_stream_uris()
+            self.assertTrue(sub.snapshot_uri.endswith('/profile_2.jpg'))
+            self.assertEqual(len(executor._threads), 1)
+        finally:
+            executor.shutdown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import unittest
+
+from onvif import ONVIFCamera, ONVIFError, ONVIFFleet
+from onvif.configure import ConfigApplier, format_plan, same
+
+from fake_camera import FakeCamera
+
+HD = {'video_encoder': {'Resolution': {'Width': 1280, 'Height': 720},
+                        'RateControl': {'FrameRateLimit': 25}}}
+
+class TestConfigApplier(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+        self.cam = ONVIFCamera(self.camera.host, self.camera.port,
+                               'admin', '12345', lazy=True)
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def calls(self):
+        del self.camera.calls[:]
+        return self.camera.calls
+
+    def test_same(self):
+        self.assertTrue(same(5.0, 5))
+        self.assertTrue(same(u'H264', 'H264'))
+        self.assertTrue(same(False, 'false'))
+        self.assertFalse(same(None, 0))
+
+    def test_plan(self):
+        applier = ConfigApplier(HD)
+        changes = applier.plan(self.cam)
+        self.assertEqual(sorted((c.token, c.path, c.old, c.new)
+                                for c in changes), [
+                ('encoder_1', 'Resolution.Height', 1080, 720),
+                ('encoder_1', 'Resolution.Width', 1920, 1280),
+                ('encoder_2', 'RateControl.FrameRateLimit', 15, 25),
+                ('encoder_2', 'Resolution.Height', 360, 720),
+                ('encoder_2', 'Resolution.Width', 640, 1280)])
+        self.assertFalse('SetVideoEncoderConfiguration' in self.camera.calls)
+
+    def test_minimal_writes(self):
+        applier = ConfigApplier({'video_encoder': {
+                'H264': {'GovLength': 50}, 'Quality': 5}},
+                tokens={'video_encoder': ['encoder_1']})
+        calls = self.calls()
+        self.assertEqual(applier.apply(self.cam), [ ])
+        # Up to date: neither options nor Set
+        self.assertEqual(calls[-1:], ['GetVideoEncoderConfigurations'])
+        self.assertFalse('GetVideoEncoderConfigurationOptions' in calls)
+
+        applier = ConfigApplier(HD)
+        self.assertEqual(len(applier.apply(self.cam)), 5)
+        self.assertEqual(self.camera.encoders[1]['Width'], '1280')
+        self.assertEqual(self.camera.encoders[1]['FrameRateLimit'], '25')
+        calls = self.calls()
+        self.assertEqual(applier.apply(self.cam), [ ])
+        self.assertEqual(calls, ['GetVideoEncoderConfigurations'])
+
+    def test_cached_options(self):
+        applier = ConfigApplier(HD)
+        applier.plan(self.cam)
+        calls = self.calls()
+        applier.plan(self.cam)
+        self.assertFalse('GetVideoEncoderConfigurationOptions' in calls)
+
+    def test_invalid(self):
+        applier = ConfigApplier({'video_encoder': {
+                'Resolution': {'Width': 1024, 'Height': 768},
+                'RateControl': {'BitrateLimit': 100000}}})
+        self.assertRaises(ONVIFError, applier.apply, self.cam)
+        self.assertFalse('SetVideoEncoderConfiguration' in self.camera.calls)
+        with self.assertRaises(ONVIFError) as context:
+            applier.plan(self.cam)
+        message = str(context.exception)
+        self.assertTrue('Resolution 1024x768 not available' in message)
+        self.assertTrue('BitrateLimit 100000 out of range' in message)
+
+    def test_rollback(self):
+        self.camera.locked.add('encoder_2')
+        applier = ConfigApplier(HD)
+        self.assertRaises(ONVIFError, applier.apply, self.cam)
+        self.assertEqual(self.camera.calls.count(
+                'SetVideoEncoderConfiguration'), 3)
+        self.assertEqual(self.camera.encoders[0]['Width'], '1920')
+        self.assertEqual(applier.stats()['rollbacks'], 1)
+
+    def test_fleet(self):
+        fleet = ONVIFFleet([ (self.camera.host, self.camera.port,
+                              'admin', '12345') ])
+        applier = ConfigApplier(HD)
+        plan = format_plan(applier.run(fleet, dry_run=True))
+        self.assertTrue('video_encoder encoder_1 Resolution.Width: '
+                        '1920 -> 1280' in plan)
+        results = list(applier.run(fleet))
+        self.assertEqual(results[0].error, None)
+        self.assertTrue(format_plan(applier.run(fleet, dry_run=True))
+                        .endswith('up to date'))
+
+if __name__ == '__main__':
+    unittest.main()
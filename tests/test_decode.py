@@ -0,0 +1,62 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import datetime as dt
+import unittest
+
+from onvif import ONVIFCamera, ONVIFError
+from onvif.decode import to_datetime
+
+from fake_camera import FakeCamera
+
+class TestFastDecode(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+        self.cam = ONVIFCamera(self.camera.host, self.camera.port,
+                               'admin', '12345', lazy=True)
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def test_unwrapped_list(self):
+        media = self.cam.create_media_service()
+        expected = media.GetProfiles()
+        media.set_fast_decode()
+        profiles = media.GetProfiles()
+        self.assertEqual([ p['_token'] for p in profiles ],
+                         [ p._token for p in expected ])
+        encoder = profiles[0]['VideoEncoderConfiguration']
+        self.assertEqual(encoder['Resolution'], {'Width': 1920, 'Height': 1080})
+        self.assertEqual(profiles[0]['_fixed'], True)
+        self.assertEqual(self.cam.to_dict(profiles), profiles)
+
+    def test_composite(self):
+        self.camera.events = 2
+        self.cam.create_pullpoint_service().set_fast_decode()
+        ret = self.cam.pullpoint.PullMessages({'Timeout': 'PT1S',
+                                               'MessageLimit': 10})
+        self.assertEqual(ret['TerminationTime'], dt.datetime(2026, 1, 1, 0, 1))
+        self.assertEqual(len(ret['NotificationMessage']), 2)
+        message = ret['NotificationMessage'][0]
+        self.assertEqual(message['Topic']['value'],
+                         'tns1:VideoSource/MotionAlarm')
+        self.assertEqual(message['Message']['Message']['Data']['SimpleItem'],
+                         {'_Name': 'State', '_Value': 'true'})
+
+    def test_fault(self):
+        self.camera.faults['GetHostname'] = 'Not authorized'
+        self.cam.devicemgmt.set_fast_decode()
+        with self.assertRaises(ONVIFError) as ctx:
+            self.cam.devicemgmt.GetHostname()
+        self.assertEqual(str(ctx.exception), 'Not authorized')
+
+    def test_datetime(self):
+        self.assertEqual(to_datetime('2026-01-01T10:00:00.5+02:00'),
+                         dt.datetime(2026, 1, 1, 8, 0))
+        self.assertEqual(to_datetime('2026-01-01T10:00:00Z'),
+                         dt.datetime(2026, 1, 1, 10, 0))
+        self.assertEqual(to_datetime('garbage'), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import time
+import unittest
+
+from onvif.discovery import WSDiscovery, iter_hosts, parse_probe_matches
+
+from fake_camera import FakeCamera, FakeResponder, PROBE_MATCHES
+
+class TestDiscovery(unittest.TestCase):
+
+    def test_iter_hosts(self):
+        hosts = list(iter_hosts('192.168.1.0/24'))
+        self.assertEqual(len(hosts), 254)
+        self.assertEqual(hosts[0], '192.168.1.1')
+        self.assertEqual(hosts[-1], '192.168.1.254')
+        self.assertEqual(list(iter_hosts('10.0.0.7')), ['10.0.0.7'])
+
+    def test_parse(self):
+        data = PROBE_MATCHES % {'relates_to': 'urn:uuid:1',
+                                'endpoint': 'urn:uuid:2',
+                                'xaddrs': 'http://[fe80::1]/onvif/device_service '
+                                          'http://10.0.0.7:8080/onvif/device_service'}
+        relates_to, matches = parse_probe_matches(data, '10.0.0.7')
+        self.assertEqual(relates_to, 'urn:uuid:1')
+        match, = matches
+        self.assertEqual(match.endpoint, 'urn:uuid:2')
+        self.assertEqual(match.types, ['dn:NetworkVideoTransmitter'])
+        self.assertEqual(match.metadata_version, 1)
+        # The XAddr on the address the device answered from
+        self.assertEqual((match.host, match.port), ('10.0.0.7', 8080))
+
+    def test_camera(self):
+        camera = FakeCamera().start()
+        responder = FakeResponder(xaddr='http://%s:%d/onvif/device_service'
+                                  % (camera.host, camera.port)).start()
+        try:
+            discovery = WSDiscovery()
+            match, = list(discovery.sweep('127.0.0.1', port=responder.port,
+                                          timeout=0.5))
+            mycam = match.camera('admin', '12345')
+            self.assertEqual(mycam.devicemgmt.GetHostname().Name, 'fake')
+            self.assertEqual(discovery.stats()['duplicates'], 1)
+        finally:
+            responder.stop()
+            camera.stop()
+
+    def test_sweep(self):
+        responder = FakeResponder(every=1000).start()
+        try:
+            discovery = WSDiscovery()
+            start = time.time()
+            matches = list(discovery.sweep('127.1.0.0/16', port=responder.port,
+                                           rate=50000, timeout=0.5))
+            elapsed = time.time() - start
+        finally:
+            responder.stop()
+        self.assertEqual(discovery.sent, 65534)
+        self.assertTrue(elapsed < 10)
+        # Every device once, its repeated reply suppressed
+        self.assertEqual(len(matches), responder.answered)
+        self.assertTrue(responder.answered >= 60)
+        self.assertEqual(discovery.stats()['duplicates'], responder.answered)
+        self.assertEqual(len(set([ m.endpoint for m in matches ])),
+                         len(matches))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import os
+import re
+import base64
+import hashlib
+import datetime
+import unittest
+
+from suds.client import Client
+from suds.plugin import MessagePlugin
+
+from onvif import ONVIFCamera, ONVIFService
+from onvif.client import DEFAULT_STREAM_SETUP
+from onvif.registry import call_binding
+from onvif.cache import ResponseCache
+from onvif.envelope import EnvelopeCompiler
+
+from fake_camera import FakeCamera
+
+def without_header(envelope):
+    return re.sub(r'<SOAP-ENV:Header>.*</SOAP-ENV:Header>', '', envelope)
+
+class TestEnvelopeCompiler(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+        self.cam = ONVIFCamera(self.camera.host, self.camera.port,
+                               'admin', '12345', lazy=True)
+        self.ptz = self.cam.create_ptz_service()
+        self.compiler = EnvelopeCompiler()
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def render(self, name, params):
+        func = getattr(self.ptz.ws_client.service, name)
+        return self.compiler.render(func.method, func.client.options, params)
+
+    def suds_render(self, name, params):
+        func = getattr(self.ptz.ws_client.service, name)
+        binding = call_binding(func.method.binding.input, func.client.options)
+        return binding.get_message(func.method, (), params).plain()
+
+    def move(self, x, y):
+        request = self.ptz.create_type('ContinuousMove')
+        request.ProfileToken = u'profile & <1>'
+        request.Velocity.PanTilt._x = x
+        request.Velocity.PanTilt._y = y
+        request.Velocity.Zoom._x = 0
+        return Client.dict(request)
+
+    def test_same_envelope(self):
+        for x, y in ((0.5, -0.25), (1e-7, 1), (0, -1.0)):
+            params = self.move(x, y)
+            self.assertEqual(without_header(self.render('ContinuousMove',
+                                                        params).plain()),
+                             without_header(self.suds_render('ContinuousMove',
+                                                             params)))
+        for pan_tilt, zoom in ((True, False), (False, True)):
+            params = {'ProfileToken': 'profile_1', 'PanTilt': pan_tilt,
+                      'Zoom': zoom}
+            self.assertEqual(without_header(self.render('Stop',
+                                                        params).plain()),
+                             without_header(self.suds_render('Stop', params)))
+        # One template per shape, the types of the leaves included
+        self.assertEqual(self.compiler.stats(),
+                         {'compiled': 4, 'uncompilable': 0, 'templates': 4})
+
+    def test_fallback(self):
+        params = {'ProfileToken': 'profile_1',
+                  'Timeout': datetime.timedelta(seconds=1)}
+        self.assertEqual(self.render('Stop', params), None)
+
+        self.ptz.ws_client.set_options(plugins=[ MessagePlugin() ])
+        try:
+            self.assertEqual(self.render('Stop', {'ProfileToken': 'p'}), None)
+        finally:
+            self.ptz.ws_client.set_options(plugins=[ ])
+
+    def test_sent(self):
+        self.ptz.set_compile_requests()
+        self.ptz.ContinuousMove(self.move(0.5, 0.5))
+        self.ptz.Stop({'ProfileToken': 'profile_1', 'PanTilt': True})
+        self.ptz.Stop({'ProfileToken': 'profile_2', 'PanTilt': False})
+        self.assertEqual(self.camera.calls[-3:],
+                         ['ContinuousMove', 'Stop', 'Stop'])
+        body = self.camera.bodies[-1]
+        self.assertTrue('<ns0:ProfileToken>profile_2</ns0:ProfileToken>'
+                        '<ns0:PanTilt>false</ns0:PanTilt>' in body)
+        values = dict(re.findall(r'<\w+:(\w+)[^>]*>([^<]*)</', body))
+        self.assertEqual(base64.b64decode(values['Password']),
+                         hashlib.sha1(base64.b64decode(values['Nonce']) +
+                                      values['Created'] + '12345').digest())
+
+    def test_anonymous(self):
+        # Anonymous and authenticated clients don't share templates
+        anonymous = ONVIFService(self.ptz.xaddr, None, None,
+                                 os.path.join(self.cam.wsdl_dir, 'ptz.wsdl'),
+                                 compile_requests=True)
+        params = {'ProfileToken': 'profile_1', 'PanTilt': True}
+        anonymous.Stop(params)
+        self.assertFalse('wsse:Security' in self.camera.bodies[-1])
+        self.ptz.set_compile_requests()
+        self.ptz.Stop(params)
+        self.assertTrue('<wsse:Username>admin</wsse:Username>'
+                        in self.camera.bodies[-1])
+        anonymous.Stop(params)
+        self.assertFalse('wsse:Security' in self.camera.bodies[-1])
+
+    def test_maxsize(self):
+        compiler = self.compiler = EnvelopeCompiler(maxsize=2)
+        def stop(token):
+            self.render('Stop', {'ProfileToken': token, 'PanTilt': True})
+            return compiler.stats()['compiled']
+        for token in ('profile_1', 1, 1.5):
+            stop(token)
+        self.assertEqual(compiler.stats()['templates'], 2)
+        self.assertEqual(stop(1.5), 3)
+        # The least recently used one was dropped
+        self.assertEqual(stop('profile_1'), 4)
+        self.assertEqual(stop(1.5), 4)
+
+    def test_cached_fast_decode(self):
+        cam = ONVIFCamera(self.camera.host, self.camera.port,
+                          'admin', '12345', lazy=True,
+                          response_cache=ResponseCache())
+        media = cam.create_media_service()
+        media.set_compile_requests()
+        media.set_fast_decode()
+        params = {'ProfileToken': 'profile_1',
+                  'StreamSetup': DEFAULT_STREAM_SETUP}
+        for _ in range(2):
+            reply = media.GetStreamUri(params)
+            self.assertTrue(reply['Uri'].endswith('/profile_1'))
+        self.assertEqual(self.camera.calls.count('GetStreamUri'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import unittest
+from itertools import islice
+
+from onvif import ONVIFCamera, AsyncONVIFCamera, ONVIFError
+from onvif.asyncclient import AsyncLoop
+from onvif.events import EventStream, AsyncEventStream
+
+from fake_camera import FakeCamera
+
+class TestEventStream(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+        self.cam = ONVIFCamera(self.camera.host, self.camera.port,
+                               'admin', '12345', lazy=True)
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def test_iterate(self):
+        self.camera.events = 100
+        stream = EventStream(self.cam, message_limit=8, timeout=1)
+        messages = list(islice(stream, 100))
+        self.assertEqual(len(messages), 100)
+        self.assertEqual(messages[0].Topic.value,
+                         'tns1:VideoSource/MotionAlarm')
+        # Batches grew with the backlog: 8 + 16 + 32 + 44
+        self.assertEqual(stream.pulls, 4)
+        self.assertEqual(stream.message_limit, 64)
+        stream.close()
+        self.assertEqual(self.camera.calls[-1], 'Unsubscribe')
+
+    def test_adapt(self):
+        stream = EventStream(self.cam, message_limit=8, max_limit=32,
+                             timeout=1, max_timeout=4)
+        stream.adapt(8)
+        stream.adapt(16)
+        stream.adapt(32)
+        self.assertEqual(stream.message_limit, 32)
+        stream.adapt(0)
+        stream.adapt(0)
+        stream.adapt(0)
+        self.assertEqual(stream.message_limit, 8)
+        self.assertEqual(stream.timeout, 4)
+        stream.adapt(1)
+        self.assertEqual(stream.timeout, 1)
+
+    def test_renew(self):
+        stream = EventStream(self.cam, timeout=1)
+        self.assertEqual(stream.pull(), [ ])
+        stream.expires = 0
+        stream.pull()
+        self.assertEqual(stream.renewals, 1)
+        self.assertEqual(stream.subscriptions, 1)
+
+        # Cameras without Renew get a new subscription, the old one is
+        # dropped
+        self.camera.faults['Renew'] = 'Not supported'
+        stream.expires = 0
+        del self.camera.calls[:]
+        stream.pull()
+        self.assertEqual(stream.subscriptions, 2)
+        self.assertEqual(self.camera.calls[:3], ['Renew', 'Unsubscribe',
+                                                 'CreatePullPointSubscription'])
+
+    def test_resubscribe(self):
+        stream = EventStream(self.cam, timeout=1, retry_delay=0)
+        stream.pull()
+        self.camera.faults['PullMessages'] = 'Subscription lost'
+        self.assertRaises(ONVIFError, stream.pull)
+        self.assertEqual(stream.errors, 1)
+        # Unsubscribed at best, the camera doesn't keep it
+        self.assertEqual(self.camera.calls[-1], 'Unsubscribe')
+
+        # Camera back, the stream subscribes again
+        self.camera.faults.pop('PullMessages')
+        self.camera.events = 1
+        message = next(iter(stream))
+        self.assertEqual(message.Topic.value, 'tns1:VideoSource/MotionAlarm')
+        self.assertEqual(stream.subscriptions, 2)
+
+    def test_async_resubscribe(self):
+        loop = AsyncLoop()
+        cam = AsyncONVIFCamera(self.camera.host, self.camera.port,
+                               'admin', '12345', loop=loop)
+        stream = AsyncEventStream(cam, timeout=1)
+        stream.pull().result(5)
+        self.camera.faults['PullMessages'] = 'Subscription lost'
+        self.assertRaises(ONVIFError, stream.pull().result, 5)
+        loop.run()
+        self.assertEqual(self.camera.calls[-1], 'Unsubscribe')
+        self.camera.faults.pop('PullMessages')
+        stream.pull().result(5)
+        self.assertEqual(stream.subscriptions, 2)
+        loop.run_until_complete(stream.close(), 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import time
+import unittest
+
+from onvif.fleet import ONVIFFleet, SubnetRateLimiter
+from onvif.cache import ResponseCache
+
+from fake_camera import FakeCamera
+
+class TestFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera(host='0.0.0.0').start()
+        self.inventory = [ ('127.0.0.%d' % i, self.camera.port, 'admin', '12345')
+                           for i in range(1, 21) ]
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def test_run(self):
+        fleet = ONVIFFleet(self.inventory, concurrency=4)
+        self.assertEqual(self.camera.calls, [ ])
+        results = list(fleet.run('media', 'GetProfiles'))
+        self.assertEqual(sorted([ r.device for r in results ]),
+                         sorted(fleet.devices.keys()))
+        for ret in results:
+            self.assertEqual(ret.error, None)
+            self.assertEqual(ret.result[0]._token, 'profile_1')
+
+    def test_concurrent_replies(self):
+        self.camera.delay = 0.02
+        inventory = [ ('127.0.1.%d' % i, self.camera.port, 'admin', '12345')
+                      for i in range(1, 201) ]
+        fleet = ONVIFFleet(inventory, concurrency=50)
+        # Every device gets its own reply, not one parsed concurrently
+        for ret in fleet.run('devicemgmt', 'GetCapabilities',
+                             {'Category': 'All'}):
+            self.assertEqual(ret.result.Media.XAddr,
+                             'http://%s/onvif/media' % ret.device)
+
+    def test_resolve_stream_uris(self):
+        cache = ResponseCache()
+        fleet = ONVIFFleet(self.inventory, concurrency=8, response_cache=cache)
+        for _ in range(2):
+            results = list(fleet.resolve_stream_uris())
+            self.assertEqual(len(results), 20)
+            for ret in results:
+                self.assertEqual([ r.snapshot_uri for r in ret.result ],
+                                 ['http://%s/snapshot/profile_1.jpg' % ret.device,
+                                  'http://%s/snapshot/profile_2.jpg' % ret.device])
+        # The second import is answered from the cache
+        self.assertEqual(self.camera.calls.count('GetProfiles'), 20)
+        self.assertEqual(self.camera.calls.count('GetStreamUri'), 40)
+
+    def test_errors_are_captured(self):
+        inventory = self.inventory[:2] + [('127.0.0.1', 1, 'admin', '12345')]
+        fleet = ONVIFFleet(inventory, timeout=2)
+        results = dict([ (r.device, r) for r in
+                         fleet.run('devicemgmt', 'GetHostname') ])
+        self.assertTrue(results['127.0.0.1:1'].error is not None)
+        self.assertEqual(results['127.0.0.2:%d' % self.camera.port].result.Name,
+                         'fake')
+
+    def test_timeout(self):
+        def operation(camera):
+            if camera.host == '127.0.0.1':
+                time.sleep(1)
+            return camera.host
+        fleet = ONVIFFleet(self.inventory[:4], concurrency=2, timeout=0.3)
+        start = time.time()
+        results = list(fleet.map(operation))
+        # The whole operation has a deadline, not only each request
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertEqual(len(results), 4)
+        late = [ r for r in results if r.error is not None ]
+        self.assertEqual([ r.device for r in late ],
+                         ['127.0.0.1:%d' % self.camera.port])
+        self.assertTrue('Timed out' in str(late[0].error))
+        self.assertTrue(0.3 <= late[0].elapsed < 0.9)
+
+    def test_timeout_rate_limited(self):
+        # Waiting for a slot of the rate limiter doesn't count
+        fleet = ONVIFFleet(self.inventory[:12], concurrency=12, rate=8,
+                           timeout=1)
+        results = list(fleet.run('devicemgmt', 'GetHostname'))
+        self.assertEqual([ r.error for r in results ], [ None ] * 12)
+        self.assertEqual(self.camera.calls.count('GetHostname'), 12)
+
+    def test_rate_limit(self):
+        limiter = SubnetRateLimiter(rate=20, prefix=24)
+        self.assertEqual(limiter.subnet('10.0.1.2'), limiter.subnet('10.0.1.200'))
+        self.assertNotEqual(limiter.subnet('10.0.1.2'), limiter.subnet('10.0.2.2'))
+
+        fleet = ONVIFFleet(self.inventory[:10], concurrency=10, rate=20)
+        start = time.time()
+        list(fleet.run('devicemgmt', 'GetHostname'))
+        # 10 calls on one /24 at 20 calls/s
+        self.assertTrue(time.time() - start >= 0.45)
+
+if __name__ == '__main__':
+    unittest.main()
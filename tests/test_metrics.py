@@ -0,0 +1,105 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import urllib2
+import unittest
+
+from onvif import ONVIFCamera, AsyncONVIFCamera, ONVIFError
+from onvif.asyncclient import AsyncLoop
+from onvif.cache import ResponseCache
+from onvif.metrics import OperationMetrics, PrometheusExporter
+
+from fake_camera import FakeCamera
+
+class TestOperationMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+        self.metrics = OperationMetrics()
+        self.key = '%s:%s' % (self.camera.host, self.camera.port)
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def make_camera(self, **kwargs):
+        return ONVIFCamera(self.camera.host, self.camera.port,
+                           'admin', '12345', lazy=True, metrics=self.metrics,
+                           **kwargs)
+
+    def test_samples(self):
+        cam = self.make_camera()
+        for _ in range(3):
+            cam.devicemgmt.GetHostname()
+        stats = self.metrics.stats()[(self.key, 'devicemgmt', 'GetHostname')]
+        self.assertEqual(stats['count'], 3)
+        for phase in ('serialize', 'network', 'parse'):
+            self.assertEqual(stats[phase]['count'], 3)
+            self.assertTrue(stats[phase]['sum'] <= stats['sum'])
+        self.assertEqual(stats['request_size']['count'], 3)
+        self.assertTrue(stats['reply_size']['max'] > 100)
+        self.assertEqual(stats['errors'], { })
+
+    def test_errors(self):
+        cam = self.make_camera()
+        self.camera.faults['GetHostname'] = 'Not authorized'
+        for _ in range(2):
+            self.assertRaises(ONVIFError, cam.devicemgmt.GetHostname)
+        stats = self.metrics.stats()[(self.key, 'devicemgmt', 'GetHostname')]
+        self.assertEqual(stats['errors'], {'WebFault': 2})
+        self.assertEqual(stats['network']['count'], 2)
+
+    def test_cache_hits(self):
+        cam = self.make_camera(response_cache=ResponseCache())
+        for _ in range(2):
+            cam.devicemgmt.GetHostname()
+        stats = self.metrics.stats()[(self.key, 'devicemgmt', 'GetHostname')]
+        # The hit sent no request
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['network']['count'], 1)
+
+    def test_async(self):
+        loop = AsyncLoop()
+        cam = AsyncONVIFCamera(self.camera.host, self.camera.port,
+                               'admin', '12345', loop=loop,
+                               metrics=self.metrics)
+        cam.devicemgmt.GetHostname().result(timeout=5)
+        stats = self.metrics.stats()[(self.key, 'devicemgmt', 'GetHostname')]
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['network']['count'], 1)
+
+    def test_failing_recorder(self):
+        class Failing(object):
+            def record(self, sample):
+                raise ValueError(sample)
+        cam = ONVIFCamera(self.camera.host, self.camera.port,
+                          'admin', '12345', lazy=True, metrics=Failing())
+        self.assertEqual(cam.devicemgmt.GetHostname().Name, 'fake')
+
+    def test_prometheus(self):
+        cam = self.make_camera()
+        cam.devicemgmt.GetHostname()
+        self.camera.faults['GetHostname'] = 'Not "authorized"'
+        self.assertRaises(ONVIFError, cam.devicemgmt.GetHostname)
+        labels = 'device="%s",service="devicemgmt",operation="GetHostname"' \
+                 % self.key
+        exporter = PrometheusExporter(self.metrics, port=0,
+                                      host='127.0.0.1').start()
+        try:
+            text = urllib2.urlopen('http://127.0.0.1:%d/metrics'
+                                   % exporter.port).read()
+        finally:
+            exporter.stop()
+        lines = text.splitlines()
+        self.assertTrue('# TYPE onvif_request_duration_seconds histogram'
+                        in lines)
+        self.assertTrue('onvif_request_duration_seconds_count{%s} 2' % labels
+                        in lines)
+        self.assertTrue('onvif_request_duration_seconds_bucket{%s,le="+Inf"} 2'
+                        % labels in lines)
+        self.assertTrue('onvif_request_phase_seconds_count{%s,phase="parse"} 2'
+                        % labels in lines)
+        self.assertTrue('onvif_request_errors_total{%s,error="WebFault"} 1'
+                        % labels in lines)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import time
+import unittest
+from Queue import Empty
+
+from onvif import ONVIFCamera
+from onvif.multiplexer import EventMultiplexer
+
+from fake_camera import FakeCamera
+
+class TestEventMultiplexer(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera(host='0.0.0.0').start()
+        self.cameras = [ ONVIFCamera('127.0.0.%d' % i, self.camera.port,
+                                     'admin', '12345', lazy=True)
+                         for i in range(1, 6) ]
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def poll_until(self, mux, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            mux.poll()
+
+    def test_ingest(self):
+        self.camera.events = 100
+        mux = EventMultiplexer(self.cameras, timeout=1).start()
+        messages = [ mux.get(timeout=10) for _ in range(100) ]
+        self.assertRaises(Empty, mux.get, timeout=0.1)
+        self.assertEqual(messages[0][1].Topic.value,
+                         'tns1:VideoSource/MotionAlarm')
+        stats = mux.stats()
+        self.assertEqual(stats['events'], 100)
+        self.assertEqual(stats['dropped'], 0)
+        self.assertEqual(len(stats['cameras']), 5)
+        self.assertTrue(all([ s['lag'] is not None
+                              for s in stats['cameras'].values()
+                              if s['events'] ]))
+        mux.stop()
+        self.assertEqual(self.camera.calls.count('Unsubscribe'), 5)
+
+    def test_backpressure(self):
+        self.camera.events = 1000
+        mux = EventMultiplexer(self.cameras, maxsize=50, timeout=1)
+        self.poll_until(mux, lambda: mux.stats()['queued'] == 50)
+        self.poll_until(mux, lambda: False, timeout=0.5)
+        stats = mux.stats()
+        # Each camera got its share of the queue, then was left alone
+        self.assertEqual(stats['queued'], 50)
+        for key, camera in stats['cameras'].items():
+            self.assertEqual(camera['queued'], 10)
+            self.assertTrue(camera['throttled'] > 0)
+        self.assertEqual(stats['dropped'], 0)
+
+        key, message = mux.get()
+        self.poll_until(mux, lambda: mux.stats()['cameras'][key]['events'] == 11)
+        self.assertEqual(mux.stats()['cameras'][key]['queued'], 10)
+
+if __name__ == '__main__':
+    unittest.main()
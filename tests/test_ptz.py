@@ -0,0 +1,81 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import time
+import unittest
+
+from onvif import ONVIFCamera
+from onvif.ptz import PTZController
+from onvif.histogram import Histogram
+
+from fake_camera import FakeCamera
+
+class TestPTZController(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera(delay=0.05).start()
+        self.cam = ONVIFCamera(self.camera.host, self.camera.port,
+                               'admin', '12345', lazy=True)
+        self.ptz = PTZController(self.cam, 'profile_1')
+
+    def tearDown(self):
+        self.ptz.close(stop=False)
+        self.camera.stop()
+
+    def moves(self):
+        return [ body for op, body in zip(self.camera.calls,
+                                          self.camera.bodies)
+                 if op == 'ContinuousMove' ]
+
+    def test_coalesce(self):
+        for i in range(50):
+            self.ptz.move(i / 100.0, -0.1)
+            time.sleep(0.002)
+        self.assertTrue(self.ptz.stop(wait=True, timeout=5))
+        moves = self.moves()
+        # Updates arriving during a round trip replace each other
+        self.assertTrue(len(moves) < 10)
+        self.assertEqual(self.camera.calls[-1], 'Stop')
+        stats = self.ptz.stats()
+        self.assertEqual(stats['updates'], 50)
+        self.assertEqual(stats['moves'] + stats['coalesced'], 50)
+        self.assertEqual(stats['stops'], 1)
+        self.assertTrue(stats['move_rtt']['p50'] >= 0.05)
+
+    def test_stop_retried(self):
+        self.camera.faults['Stop'] = 'Not now'
+        self.ptz.move(0.5, 0.5, zoom=0.1)
+        time.sleep(0.1)
+        self.ptz.stop()
+        time.sleep(0.3)
+        self.assertFalse(self.ptz.stop(wait=True, timeout=0))
+        del self.camera.faults['Stop']
+        self.assertTrue(self.ptz.stop(wait=True, timeout=5))
+        self.assertTrue(self.ptz.stats()['stop_failures'] >= 1)
+        self.assertTrue('x="0.1"' in self.moves()[-1])
+
+    def test_stop_before_later_move(self):
+        self.ptz.move(0.5, 0)
+        self.ptz.stop()
+        self.ptz.move(-0.5, 0)
+        time.sleep(0.3)
+        calls = [ op for op in self.camera.calls
+                  if op in ('ContinuousMove', 'Stop') ]
+        self.assertEqual(calls[-2:], ['Stop', 'ContinuousMove'])
+        self.assertTrue('x="-0.5"' in self.moves()[-1])
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_percentile(self):
+        latency = Histogram(buckets=(0.01, 0.1, 1))
+        self.assertEqual(latency.percentile(50), None)
+        for value in (0.005, 0.05, 0.05, 0.5, 2):
+            latency.observe(value)
+        self.assertEqual(latency.percentile(50), 0.1)
+        self.assertEqual(latency.percentile(100), 2)
+        self.assertEqual(latency.cumulative(),
+                         [(0.01, 1), (0.1, 3), (1, 4), (None, 5)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import json
+import unittest
+
+from onvif import ONVIFCamera
+from onvif.recordings import RecordingSync
+
+from fake_camera import FakeCamera
+
+def recording(token, content, latest, **tracks):
+    return {'token': token, 'content': content, 'latest': latest,
+            'tracks': tracks}
+
+def summary(changes):
+    return sorted((change.kind, change.recording, change.track,
+                   change.configuration is not None) for change in changes)
+
+class TestRecordingSync(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+        self.camera.recordings = [
+                recording('rec_1', 'lobby', '2026-01-01T01:00:00Z',
+                          video='main', audio='mic'),
+                recording('rec_2', 'door', '2026-01-01T02:00:00Z',
+                          video='main')]
+        self.cam = ONVIFCamera(self.camera.host, self.camera.port,
+                               'admin', '12345', lazy=True)
+        self.sync = RecordingSync(self.cam, concurrency=2)
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def calls(self):
+        del self.camera.calls[:]
+        return self.camera.calls
+
+    def test_added(self):
+        changes = self.sync.sync()
+        self.assertEqual(summary(changes), [
+                ('added', 'rec_1', None, True),
+                ('added', 'rec_1', 'audio', True),
+                ('added', 'rec_1', 'video', True),
+                ('added', 'rec_2', None, True),
+                ('added', 'rec_2', 'video', True)])
+        configurations = dict(((change.recording, change.track),
+                               change.configuration) for change in changes)
+        self.assertEqual(configurations[('rec_2', None)].Content, 'door')
+        self.assertEqual(configurations[('rec_1', 'audio')].Description,
+                         'mic')
+
+    def test_unchanged(self):
+        self.sync.sync()
+        calls = self.calls()
+        self.assertEqual(self.sync.sync(), [ ])
+        self.assertEqual(calls, ['GetRecordingSummary'])
+
+    def test_data_range(self):
+        self.sync.sync()
+        self.camera.recordings[0]['latest'] = '2026-01-01T03:00:00Z'
+        calls = self.calls()
+        self.assertEqual(summary(self.sync.sync()), [
+                ('modified', 'rec_1', None, False),
+                ('modified', 'rec_1', 'audio', False),
+                ('modified', 'rec_1', 'video', False)])
+        self.assertFalse('GetRecordingConfiguration' in calls)
+        self.assertFalse('GetTrackConfiguration' in calls)
+
+    def test_configuration(self):
+        self.sync.sync()
+        self.camera.recordings[1]['content'] = 'back door'
+        self.camera.recordings[0]['tracks']['audio'] = 'new mic'
+        calls = self.calls()
+        # Not in the summary
+        self.assertEqual(self.sync.sync(), [ ])
+        self.sync.full_interval = 0
+        changes = self.sync.sync()
+        self.assertEqual(summary(changes), [
+                ('modified', 'rec_1', 'audio', True),
+                ('modified', 'rec_2', None, True)])
+        self.assertEqual(calls.count('GetRecordingConfiguration'), 1)
+        self.assertEqual(calls.count('GetTrackConfiguration'), 1)
+
+    def test_removed(self):
+        self.sync.sync()
+        del self.camera.recordings[1]
+        del self.camera.recordings[0]['tracks']['audio']
+        self.assertEqual(summary(self.sync.sync()), [
+                ('removed', 'rec_1', 'audio', False),
+                ('removed', 'rec_2', None, False)])
+
+    def test_restart(self):
+        self.sync.sync()
+        state = json.loads(json.dumps(self.sync.state))
+        self.assertEqual(RecordingSync(self.cam, state=state).sync(), [ ])
+
+    def test_failed_configuration(self):
+        self.camera.faults['GetTrackConfiguration'] = 'Not now'
+        self.assertEqual(self.sync.sync(), [ ])
+        del self.camera.faults['GetTrackConfiguration']
+        self.assertEqual(len(self.sync.sync()), 5)
+        self.assertEqual(self.sync.sync(), [ ])
+
+if __name__ == '__main__':
+    unittest.main()
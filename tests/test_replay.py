@@ -0,0 +1,91 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import time
+import unittest
+
+from onvif import ONVIFCamera, ONVIFError
+from onvif.replay import ReplayResolver, duration_seconds
+
+from fake_camera import FakeCamera
+
+class TestDuration(unittest.TestCase):
+
+    def test_durations(self):
+        self.assertEqual(duration_seconds('PT60S'), 60)
+        self.assertEqual(duration_seconds('PT1M30.5S'), 90.5)
+        self.assertEqual(duration_seconds('P1DT1H'), 90000)
+        self.assertEqual(duration_seconds('60'), None)
+        self.assertEqual(duration_seconds(None), None)
+
+class TestReplayResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+        self.cam = ONVIFCamera(self.camera.host, self.camera.port,
+                               'admin', '12345', lazy=True)
+        self.replay = ReplayResolver(self.cam, concurrency=2)
+
+    def tearDown(self):
+        self.replay.close()
+        self.camera.stop()
+
+    def calls(self):
+        del self.camera.calls[:]
+        return self.camera.calls
+
+    def test_uri(self):
+        calls = self.calls()
+        self.assertEqual(self.replay.uri('rec_1'),
+                         'rtsp://%s/replay/rec_1' % self.camera.host)
+        self.replay.uri('rec_1')
+        self.assertEqual(calls[-2:],
+                         ['GetReplayConfiguration', 'GetReplayUri'])
+        self.assertEqual(calls.count('GetReplayUri'), 1)
+        stats = self.replay.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['session_timeout'], 60)
+
+    def test_resolve(self):
+        self.replay.uri('rec_0')
+        calls = self.calls()
+        uris = self.replay.resolve([ 'rec_%d' % i for i in range(5) ])
+        self.assertEqual(uris['rec_4'],
+                         'rtsp://%s/replay/rec_4' % self.camera.host)
+        # Kept ones aren't asked again
+        self.assertEqual(calls, ['GetReplayUri'] * 4)
+
+    def test_session_timeout(self):
+        self.camera.session_timeout = 'PT0.2S'
+        calls = self.calls()
+        self.replay.uri('rec_1')
+        time.sleep(0.3)
+        self.replay.uri('rec_1')
+        self.assertEqual(calls.count('GetReplayUri'), 2)
+
+    def test_error(self):
+        self.camera.faults['GetReplayUri'] = 'No such recording'
+        self.assertRaises(ONVIFError, self.replay.uri, 'rec_1')
+        self.assertEqual(self.replay.resolve(['rec_2']), {'rec_2': None})
+        del self.camera.faults['GetReplayUri']
+        self.assertTrue(self.replay.uri('rec_1'))
+        self.assertEqual(self.replay.stats()['errors'], 2)
+
+    def test_follow(self):
+        self.camera.found = 10
+        calls = self.calls()
+        results = self.replay.follow(self.cam.find_recordings(), ahead=4)
+        first = next(results)
+        self.assertEqual(first.RecordingToken, 'rec_0')
+        # The URIs of the next results are on their way
+        self.assertEqual(self.replay.stats()['misses'], 5)
+        tokens = [ first.RecordingToken ] + \
+                 [ info.RecordingToken for info in results ]
+        self.assertEqual(len(tokens), 10)
+        uris = [ self.replay.uri(token) for token in tokens ]
+        self.assertEqual(uris[9], 'rtsp://%s/replay/rec_9' % self.camera.host)
+        self.assertEqual(calls.count('GetReplayUri'), 10)
+        self.assertEqual(self.replay.stats()['prefetched'], 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import re
+import datetime
+import unittest
+
+from onvif import ONVIFCamera, ONVIFError
+
+from fake_camera import FakeCamera
+
+class TestPagedSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+        self.cam = ONVIFCamera(self.camera.host, self.camera.port,
+                               'admin', '12345', lazy=True)
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def page_sizes(self):
+        return [ int(re.search(r'MaxResults>(\d+)<', body).group(1))
+                 for op, body in zip(self.camera.calls, self.camera.bodies)
+                 if op == 'GetRecordingSearchResults' ]
+
+    def test_pages(self):
+        self.camera.found = 300
+        tokens = [ info.RecordingToken
+                   for info in self.cam.find_recordings(batch=16) ]
+        self.assertEqual(tokens, [ 'rec_%d' % i for i in range(300) ])
+        # Full pages double the size, up to the last one
+        self.assertEqual(self.page_sizes(), [16, 32, 64, 128, 256])
+        self.assertEqual(self.camera.calls[-1], 'EndSearch')
+
+    def test_early_stop(self):
+        self.camera.found = 300
+        for info in self.cam.find_recordings():
+            if info.RecordingToken == 'rec_4':
+                break
+        self.assertEqual(self.page_sizes(), [64])
+        self.assertEqual(self.camera.calls[-1], 'EndSearch')
+
+    def test_slow_search(self):
+        self.camera.found = 3
+        self.camera.search_completed = False
+        results = self.cam.find_recordings()
+        for _ in range(3):
+            next(results)
+        self.camera.search_completed = True
+        self.assertEqual(list(results), [ ])
+        # Few results per page halve the size
+        self.assertEqual(self.page_sizes(), [64, 32])
+
+    def test_error(self):
+        self.camera.faults['GetRecordingSearchResults'] = 'Invalid token'
+        self.assertRaises(ONVIFError, list, self.cam.find_recordings())
+        self.assertEqual(self.camera.calls[-1], 'EndSearch')
+
+    def test_events(self):
+        self.camera.found = 5
+        self.cam.create_search_service().set_fast_decode()
+        events = list(self.cam.find_events(
+                {'StartPoint': datetime.datetime(2026, 1, 1),
+                 'IncludeStartState': False}))
+        self.assertEqual(len(events), 5)
+        self.assertEqual(events[0]['RecordingToken'], 'rec_1')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import json
+import unittest
+from cStringIO import StringIO
+
+from suds.sudsobject import Object
+from suds.sax.text import Text
+
+from onvif import ONVIFCamera
+from onvif.serialize import to_dict, dump_json
+
+from fake_camera import FakeCamera
+
+class TestSerialize(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+        cam = ONVIFCamera(self.camera.host, self.camera.port,
+                          'admin', '12345', lazy=True)
+        self.media = cam.create_media_service()
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def test_to_dict(self):
+        profiles = self.media.to_dict(self.media.GetProfiles())
+        encoder = profiles[0]['VideoEncoderConfiguration']
+        self.assertEqual(encoder['Resolution'], {'Width': 1920, 'Height': 1080})
+        self.assertEqual(profiles[0]['_token'], 'profile_1')
+        self.assertTrue(isinstance(profiles[0]['Name'], Text))
+
+        profiles = to_dict(self.media.GetProfiles(), attr_prefix='@',
+                           text=unicode)
+        self.assertEqual(profiles[1], {'@token': 'profile_2',
+                                       '@fixed': True, 'Name': 'sub'})
+        self.assertFalse(isinstance(profiles[1]['Name'], Text))
+
+        profiles = to_dict(self.media.GetProfiles(), attr_prefix=None)
+        self.assertEqual(profiles[1], {'Name': 'sub'})
+
+    def test_dump_json(self):
+        profiles = self.media.GetProfiles()
+        fp = StringIO()
+        dump_json(profiles, fp, attr_prefix='')
+        ret = json.loads(fp.getvalue())
+        self.assertEqual(ret, json.loads(json.dumps(to_dict(profiles, ''))))
+        self.assertEqual(ret[0]['token'], 'profile_1')
+
+    def test_deep(self):
+        root = node = Object()
+        for _ in range(20000):
+            node.Child = Object()
+            node.Items = [1, 2.5, None]
+            node = node.Child
+        converted = to_dict(root)
+        fp = StringIO()
+        dump_json(root, fp)
+        self.assertEqual(fp.getvalue().count('"Child":'), 20000)
+        self.assertEqual(converted['Child']['Child']['Items'], [1, 2.5, None])
+
+if __name__ == '__main__':
+    unittest.main()
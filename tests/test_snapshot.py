@@ -0,0 +1,141 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from threading import Lock
+
+from onvif import ONVIFCamera, ONVIFError
+from onvif.snapshot import SnapshotPoller, HTTPAuth
+
+from fake_camera import FakeCamera, JPEG
+
+class TestSnapshotClient(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+        self.cam = ONVIFCamera(self.camera.host, self.camera.port,
+                               'admin', '12345', lazy=True)
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def test_fetch(self):
+        for _ in range(5):
+            image = self.cam.snapshots.fetch('profile_1')
+            self.assertEqual(image.tobytes(), JPEG)
+        self.assertEqual(self.camera.calls.count('GetSnapshotUri'), 1)
+        self.assertEqual(self.camera.calls.count('GET'), 5)
+        # The SOAP requests and the images share the connection
+        self.assertEqual(self.cam.pool.stats()['created'], 1)
+        stats = self.cam.snapshots.stats()
+        self.assertEqual((stats['fetched'], stats['bytes']), (5, 5 * len(JPEG)))
+
+    def test_buffers(self):
+        buf = bytearray(len(JPEG) + 10)
+        image = self.cam.snapshots.fetch('profile_1', buf)
+        self.assertEqual(str(buf[:len(JPEG)]), JPEG)
+        self.assertEqual(len(image), len(JPEG))
+        # Too small, read into a new buffer
+        small = bytearray(16)
+        self.assertEqual(self.cam.snapshots.fetch('profile_1', small).tobytes(),
+                         JPEG)
+        self.assertEqual(small, bytearray(16))
+        self.camera.chunked = True
+        self.assertEqual(self.cam.snapshots.fetch('profile_1').tobytes(), JPEG)
+
+    def test_digest(self):
+        self.camera.digest = True
+        for _ in range(5):
+            self.assertEqual(self.cam.snapshots.fetch('profile_2').tobytes(),
+                             JPEG)
+        # Challenged once, the credentials are then sent up front
+        self.assertEqual(self.camera.challenges, 1)
+        self.assertEqual(self.cam.snapshots.stats()['challenges'], 1)
+
+        self.camera.passwd = 'other'
+        with self.assertRaises(ONVIFError) as cm:
+            self.cam.snapshots.fetch('profile_2')
+        self.assertEqual(cm.exception.status, 401)
+
+    def test_uri_changed(self):
+        self.cam.snapshots.fetch('profile_1')
+        self.camera.snapshot_path = 'moved'
+        self.assertEqual(self.cam.snapshots.fetch('profile_1').tobytes(), JPEG)
+        self.assertEqual(self.cam.snapshots.stats()['resolved'], 2)
+
+    def test_save(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'snapshot.jpg')
+            self.assertEqual(self.cam.snapshots.save('profile_1', path),
+                             len(JPEG))
+            with open(path, 'rb') as image:
+                self.assertEqual(image.read(), JPEG)
+            self.assertEqual(os.listdir(tmp), ['snapshot.jpg'])
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_unreachable(self):
+        snapshots = self.cam.snapshots
+        self.assertRaises(ONVIFError, snapshots.get,
+                          'http://127.0.0.1:1/snapshot.jpg', lambda r: r.read())
+        # A failing read drops the connection rather than leaving its
+        # response unread
+        def read(response):
+            raise IOError('disk full')
+        self.assertRaises(IOError, snapshots.request, 'profile_1', read)
+        self.assertEqual(self.cam.pool.stats()['failed'], 1)
+
+    def test_unreachable_poller(self):
+        cam = ONVIFCamera('127.0.0.1', 1, 'admin', '12345', lazy=True)
+        cam.snapshots.uris['profile_1'] = 'http://127.0.0.1:1/snapshot.jpg'
+        poller = SnapshotPoller([ (cam, 'profile_1') ], interval=0.1,
+                                callback=lambda *args: None, workers=1)
+        poller.start()
+        time.sleep(0.35)
+        poller.stop()
+        self.assertTrue(poller.stats()['errors'] >= 2)
+
+    def test_basic_auth(self):
+        auth = HTTPAuth('admin', '12345')
+        self.assertEqual(auth.header('GET', '/'), None)
+        self.assertTrue(auth.challenge('Basic realm="fake"'))
+        self.assertEqual(auth.header('GET', '/'), 'Basic YWRtaW46MTIzNDU=')
+
+
+class TestSnapshotPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera(host='0.0.0.0').start()
+
+    def tearDown(self):
+        self.camera.stop()
+
+    def test_poll(self):
+        cameras = [ ONVIFCamera('127.0.0.%d' % i, self.camera.port,
+                                'admin', '12345', lazy=True)
+                    for i in range(1, 11) ]
+        images = { }
+        lock = Lock()
+        def callback(camera, token, image):
+            self.assertEqual(image.tobytes(), JPEG)
+            with lock:
+                key = (camera.host, token)
+                images[key] = images.get(key, 0) + 1
+        poller = SnapshotPoller([ (cam, 'profile_1') for cam in cameras ],
+                                interval=0.2, callback=callback, workers=4)
+        poller.start()
+        time.sleep(0.9)
+        poller.stop()
+        self.assertEqual(len(images), 10)
+        self.assertTrue(min(images.values()) >= 3)
+        stats = poller.stats()
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(stats['fetched'], sum(images.values()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import os
+import time
+import shutil
+import threading
+import tempfile
+import unittest
+
+from onvif import ONVIFCamera, AsyncONVIFCamera, ONVIFError, SERVICES
+from onvif.asyncclient import AsyncLoop
+from onvif.store import CapabilityStore, MemoryCapabilityStore, device_key
+from onvif.cache import ResponseCache
+from onvif.client import get_revalidation_executor, REVALIDATION_MAX_WORKERS
+
+from fake_camera import FakeCamera
+
+MEDIA = SERVICES['media']['ns']
+PULLPOINT = SERVICES['pullpoint']['ns']
+
+class TestCapabilityStore(unittest.TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera().start()
+        self.key = device_key(self.camera.host, self.camera.port)
+        self.tmp = tempfile.mkdtemp()
+        self.store = CapabilityStore(os.path.join(self.tmp, 'capabilities.db'))
+
+    def tearDown(self):
+        self.camera.stop()
+        self.store.close()
+        shutil.rmtree(self.tmp)
+
+    def connect(self, cls=ONVIFCamera, **kwargs):
+        return cls(self.camera.host, self.camera.port, 'admin', '12345',
+                   store=self.store, **kwargs)
+
+    def wait_for(self, operation, timeout=5):
+        deadline = time.time() + timeout
+        while operation not in self.camera.calls and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_cold_start(self):
+        self.connect()
+        record = self.store.get(self.key)
+        self.assertEqual(record['serial'], 'SN0001')
+        self.assertEqual(record['firmware'], '1.0')
+        self.assertTrue('media' in record['services'])
+        self.assertTrue(record['xaddrs'][MEDIA].endswith('/onvif/media'))
+        # The subscription doesn't outlive the process
+        self.assertFalse(PULLPOINT in record['xaddrs'])
+
+    def test_warm_start(self):
+        self.connect()
+        del self.camera.calls[:]
+        # Reopened as by a restarted process
+        self.store.close()
+        self.store = CapabilityStore(self.store.path)
+        mycam = self.connect(revalidate=False)
+        self.assertEqual(self.camera.calls, [ ])
+        self.assertEqual(len(mycam.create_media_service().GetProfiles()), 2)
+        self.assertEqual(self.camera.calls, ['GetProfiles'])
+
+    def test_background_revalidation(self):
+        self.connect()
+        updated = self.store.get(self.key)['updated']
+        del self.camera.calls[:]
+        self.camera.firmware = '2.0'
+        mycam = self.connect()
+        self.wait_for('GetDeviceInformation')
+        time.sleep(0.1)
+        self.assertEqual(self.camera.calls[:2],
+                         ['GetCapabilities', 'GetDeviceInformation'])
+        self.assertTrue(mycam.validated)
+        record = self.store.get(self.key)
+        self.assertEqual(record['firmware'], '2.0')
+        self.assertTrue(record['updated'] > updated)
+
+    def test_stale_xaddrs(self):
+        self.connect()
+        record = self.store.get(self.key)
+        record['xaddrs'][MEDIA] = 'http://127.0.0.1:1/onvif/media'
+        self.store.put(self.key, record)
+        mycam = self.connect(revalidate=False)
+        media = mycam.create_media_service()
+        # The first failure revalidates, the service is re-pointed
+        self.assertRaises(ONVIFError, media.GetProfiles)
+        self.assertEqual(len(media.GetProfiles()), 2)
+        self.assertFalse('127.0.0.1:1' in
+                         self.store.get(self.key)['xaddrs'][MEDIA])
+
+    def test_bounded_revalidation(self):
+        self.connect()
+        self.camera.delay = 0.1
+        cams = [ self.connect() for _ in range(16) ]
+        for mycam in cams:
+            mycam.start_revalidation().result(timeout=10)
+            self.assertTrue(mycam.validated)
+        # On the shared pool, not a thread per camera
+        self.assertTrue(len(get_revalidation_executor()._threads) <=
+                        REVALIDATION_MAX_WORKERS)
+
+    def test_swapped_in(self):
+        mycam = self.connect(adjust_time=True)
+        xaddrs, dt_diff = mycam.xaddrs, mycam.dt_diff
+        self.camera.delay = 0.2
+        thread = threading.Thread(target=mycam.update_xaddrs,
+                                  kwargs={'subscribe': False})
+        thread.start()
+        time.sleep(0.1)
+        # The current capabilities are kept until the new ones are known
+        self.assertTrue(mycam.xaddrs is xaddrs)
+        self.assertEqual(mycam.dt_diff, dt_diff)
+        thread.join()
+        self.assertFalse(mycam.xaddrs is xaddrs)
+        self.assertEqual(mycam.xaddrs[MEDIA], xaddrs[MEDIA])
+        self.assertTrue(mycam.dt_diff is not None)
+
+    def test_replaced_device(self):
+        self.connect()
+        deleted = [ ]
+        delete = self.store.delete
+        self.store.delete = lambda device: deleted.append(device) or \
+                                           delete(device)
+        cache = ResponseCache()
+        mycam = self.connect(revalidate=False, response_cache=cache)
+        media = mycam.create_media_service()
+        media.GetProfiles()
+        # Another device answers at the same address
+        self.camera.serial = 'SN0002'
+        mycam.revalidate()
+        self.assertEqual(deleted, [ self.key ])
+        self.assertEqual(self.store.get(self.key)['serial'], 'SN0002')
+        media.GetProfiles()
+        self.assertEqual(self.camera.calls.count('GetProfiles'), 2)
+
+    def test_max_age(self):
+        store = MemoryCapabilityStore(max_age=60)
+        store.put('a:80', {'xaddrs': { }})
+        self.assertEqual(store.get('a:80')['xaddrs'], { })
+        store.records['a:80']['updated'] -= 120
+        self.assertEqual(store.get('a:80'), None)
+
+    def test_async_warm_start(self):
+        self.connect()
+        del self.camera.calls[:]
+        loop = AsyncLoop()
+        mycam = self.connect(cls=AsyncONVIFCamera, loop=loop)
+        profiles = mycam.create_media_service().GetProfiles().result(5)
+        self.assertEqual(len(profiles), 2)
+        # Revalidated on the loop along with the other calls
+        loop.run()
+        self.assertTrue('GetCapabilities' in self.camera.calls)
+        self.assertTrue(mycam.validated)
+
+    def test_async_stale_xaddrs(self):
+        self.connect()
+        record = self.store.get(self.key)
+        record['xaddrs'][MEDIA] = 'http://127.0.0.1:1/onvif/media'
+        self.store.put(self.key, record)
+        loop = AsyncLoop()
+        mycam = self.connect(cls=AsyncONVIFCamera, loop=loop,
+                             revalidate=False)
+        media = mycam.create_media_service()
+        # The failure revalidates on the loop, the service is re-pointed
+        self.assertRaises(ONVIFError, media.GetProfiles().result, 5)
+        mycam.revalidation.result(5)
+        self.assertTrue(mycam.validated)
+        self.assertEqual(len(media.GetProfiles().result(5)), 2)
+        self.assertFalse('127.0.0.1:1' in
+                         self.store.get(self.key)['xaddrs'][MEDIA])
+
+if __name__ == '__main__':
+    unittest.main()
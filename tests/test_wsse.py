@@ -0,0 +1,75 @@
+#!/usr/bin/python
+#-*-coding=utf-8
+
+import re
+import time
+import base64
+import hashlib
+import datetime
+import threading
+import unittest
+
+from onvif import ONVIFCamera
+from onvif.wsse import DigestSecurity, NoncePool
+
+from fake_camera import FakeCamera
+
+def parse(header):
+    values = dict(re.findall(r'<\w+:(\w+)[^>]*>([^<]*)</', header))
+    return (values['Username'], values['Password'],
+            base64.b64decode(values['Nonce']), values['Created'])
+
+class TestDigestSecurity(unittest.TestCase):
+
+    def test_digest(self):
+        security = DigestSecurity('admin', '12345')
+        user, digest, nonce, created = parse(security.render())
+        self.assertEqual(user, 'admin')
+        self.assertEqual(len(nonce), 16)
+        self.assertEqual(base64.b64decode(digest),
+                         hashlib.sha1(nonce + created + '12345').digest())
+        self.assertTrue(re.match(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{6}Z$',
+                                 created))
+
+    def test_dt_diff(self):
+        security = DigestSecurity('admin', '12345',
+                                  dt_diff=datetime.timedelta(hours=-2))
+        created = parse(security.render())[3]
+        created = time.mktime(time.strptime(created[:19], '%Y-%m-%dT%H:%M:%S'))
+        expected = time.mktime(time.gmtime(time.time() - 7200))
+        self.assertTrue(abs(created - expected) <= 1)
+
+    def test_nonces(self):
+        security = DigestSecurity('admin', '12345')
+        nonces = [ ]
+        def render():
+            for _ in range(500):
+                nonces.append(parse(security.render())[2])
+        threads = [ threading.Thread(target=render) for _ in range(4) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(nonces)), 2000)
+
+    def test_pool(self):
+        pool = NoncePool(size=4, batch=2)
+        nonces = [ pool.next() for _ in range(5) ]
+        self.assertEqual([ len(nonce) for nonce in nonces ], [4] * 5)
+
+    def test_sent(self):
+        camera = FakeCamera().start()
+        try:
+            cam = ONVIFCamera(camera.host, camera.port, 'admin', '12345',
+                              lazy=True)
+            cam.devicemgmt.GetHostname()
+            header = re.search(r'<wsse:Security.*</wsse:Security>',
+                               camera.bodies[-1]).group(0)
+            user, digest, nonce, created = parse(header)
+            self.assertEqual(base64.b64decode(digest),
+                             hashlib.sha1(nonce + created + '12345').digest())
+        finally:
+            camera.stop()
+
+if __name__ == '__main__':
+    unittest.main()